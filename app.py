@@ -1,282 +1,360 @@
-import io
-import json
+import hashlib
+import os
 import re
+import sqlite3
+import time
+import uuid
 import streamlit as st
-from pypdf import PdfReader
-from openai import OpenAI
+
+import metrics
+
+from blobs import get_context_store, session_memory, spill_exists, spill_stats, spill_upload
+from cache import get_response_cache
+from draft_text import parse_ref_segments, split_paragraphs
+from jobs import STAGES, get_job_runner
+from pipeline import (
+    has_subsection,
+    prefetch_context,
+    run_expand_job,
+    run_generate_job,
+    run_subsection_job,
+    section_subsections,
+    warm_up,
+)
+from projects import get_project_store
 
 # =========================================================
 # 1) Page Configuration (Premium UI: Linear/Notion + Lux, LIGHT text)
 # =========================================================
+rerun_started = time.perf_counter()
 st.set_page_config(page_title="Report Mate", layout="centered")
 
-st.markdown(
-    """
-<style>
-@import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700;800&display=swap');
-
-:root{
-  --bg: #F7F8FA;
-  --bg2:#F3F4F7;
-  --panel: rgba(255,255,255,0.86);
-  --panel2: rgba(255,255,255,0.96);
-  --border: rgba(15,23,42,0.10);
-  --border2: rgba(15,23,42,0.14);
-  --text: rgba(17,24,39,0.92);   /* 거의 검정 */
-  --muted: rgba(17,24,39,0.62);
-  --muted2: rgba(17,24,39,0.52);
-  --accent: #6D5EF7;
-  --accent2: #00B7FF;
-  --shadow: 0 18px 60px rgba(2,6,23,0.10);
-  --shadow2: 0 12px 40px rgba(2,6,23,0.08);
-}
-
-html, body, [class*="css"]{
-  font-family: 'Inter', -apple-system, BlinkMacSystemFont, sans-serif;
-  background:
-    radial-gradient(1200px 800px at 18% 10%, rgba(109,94,247,0.14), transparent 55%),
-    radial-gradient(900px 600px at 85% 15%, rgba(0,183,255,0.10), transparent 50%),
-    radial-gradient(700px 700px at 55% 88%, rgba(0,0,0,0.04), transparent 45%),
-    linear-gradient(180deg, var(--bg), var(--bg2)) !important;
-  color: var(--text) !important;
-}
-
-/* Make container feel premium + centered */
-.block-container{
-  padding-top: 2.2rem;
-  padding-bottom: 3rem;
-  max-width: 980px;
-}
-
-/* Sidebar styling */
-section[data-testid="stSidebar"]{
-  background: rgba(255,255,255,0.72);
-  border-right: 1px solid rgba(15,23,42,0.10);
-}
-section[data-testid="stSidebar"] *{
-  color: var(--text) !important;
-}
-
-/* Hero */
-.hero{
-  padding: 28px 26px;
-  border-radius: 22px;
-  background: linear-gradient(135deg, rgba(109,94,247,0.16), rgba(0,183,255,0.08));
-  border: 1px solid var(--border);
-  box-shadow: var(--shadow);
-  margin: 8px 0 18px 0;
-  position: relative;
-  overflow: hidden;
-}
-.hero:before{
-  content:"";
-  position:absolute;
-  inset:-2px;
-  background: radial-gradient(900px 320px at 15% 18%, rgba(255,255,255,0.65), transparent 60%);
-  pointer-events:none;
-}
-.badge{
-  display:inline-flex;
-  gap:8px;
-  align-items:center;
-  padding: 6px 10px;
-  border-radius: 999px;
-  border: 1px solid var(--border);
-  background: rgba(255,255,255,0.65);
-  color: var(--muted);
-  font-size: 12px;
-  font-weight: 800;
-}
-.hero-title{
-  margin-top: 10px;
-  font-size: 34px;
-  font-weight: 900;
-  letter-spacing: -0.02em;
-  line-height: 1.12;
-}
-.hero-sub{
-  margin-top: 8px;
-  font-size: 15px;
-  color: var(--muted);
-  line-height: 1.65;
-  max-width: 78ch;
-}
-.kpi{
-  display:flex;
-  gap:10px;
-  flex-wrap:wrap;
-  margin-top: 12px;
-}
-.pill{
-  background: rgba(255,255,255,0.70);
-  border: 1px solid var(--border);
-  padding: 7px 10px;
-  border-radius: 999px;
-  font-size: 12px;
-  color: var(--muted);
-  font-weight: 700;
-}
-
-/* Cards (Glass) */
-.glass{
-  background: var(--panel);
-  border: 1px solid var(--border);
-  border-radius: 22px;
-  padding: 22px;
-  box-shadow: var(--shadow2);
-  backdrop-filter: blur(10px);
-  -webkit-backdrop-filter: blur(10px);
-  margin: 14px 0 18px 0;
-}
-.card-title{
-  font-size: 13px;
-  color: var(--muted);
-  font-weight: 900;
-  letter-spacing: 0.08em;
-  text-transform: uppercase;
-  margin-bottom: 10px;
-}
-.h3{
-  font-size: 18px;
-  font-weight: 900;
-  letter-spacing: -0.01em;
-  margin: 0 0 8px 0;
-}
-.help{
-  font-size: 13px;
-  color: var(--muted);
-  line-height: 1.6;
-  margin-top: 6px;
-}
-
-/* Inputs */
-.stTextInput>div>div>input,
-.stTextArea textarea,
-.stFileUploader section,
-.stSelectbox>div>div{
-  border-radius: 14px !important;
-  border: 1px solid rgba(15,23,42,0.12) !important;
-  background: rgba(255,255,255,0.80) !important;
-  color: var(--text) !important;
-}
-.stTextArea textarea::placeholder,
-.stTextInput input::placeholder{
-  color: rgba(17,24,39,0.40) !important;
-}
-
-/* Buttons */
-.stButton>button{
-  width:100%;
-  border-radius: 14px;
-  border: 1px solid rgba(15,23,42,0.10);
-  background: linear-gradient(135deg, rgba(109,94,247,1), rgba(0,183,255,0.90));
-  color: white !important;
-  font-weight: 900;
-  padding: 12px 14px;
-  box-shadow: 0 12px 30px rgba(109,94,247,0.22);
-  transition: transform .12s ease, box-shadow .12s ease, filter .12s ease;
-}
-.stButton>button:hover{
-  transform: translateY(-1px);
-  box-shadow: 0 16px 44px rgba(109,94,247,0.28);
-  filter: brightness(1.02);
-}
-
-/* Secondary button */
-.secondary-btn .stButton>button{
-  background: rgba(255,255,255,0.78) !important;
-  border: 1px solid rgba(15,23,42,0.12) !important;
-  box-shadow: none !important;
-  color: rgba(17,24,39,0.86) !important;
-}
-.secondary-btn .stButton>button:hover{
-  transform: translateY(-1px);
-  box-shadow: 0 14px 36px rgba(2,6,23,0.10) !important;
-  filter: none !important;
-}
-
-/* Tabs */
-[data-baseweb="tab-list"]{
-  background: rgba(255,255,255,0.70);
-  border: 1px solid rgba(15,23,42,0.10);
-  border-radius: 14px;
-  padding: 6px;
-}
-[data-baseweb="tab"]{
-  border-radius: 12px;
-  color: var(--muted) !important;
-  font-weight: 900;
-}
-[aria-selected="true"]{
-  background: rgba(255,255,255,0.95) !important;
-  color: var(--text) !important;
-}
-
-/* Popover button */
-div[data-testid="stPopover"] > button{
-  background: rgba(255,255,255,0.78) !important;
-  color: rgba(17,24,39,0.88) !important;
-  border: 1px solid rgba(15,23,42,0.12) !important;
-  border-radius: 10px !important;
-  padding: 2px 8px !important;
-  font-size: 12px !important;
-  min-height: 26px !important;
-}
+@st.cache_resource
+def page_style():
+    """Markup applying static/style.css, built once per process.
 
-hr{
-  border-color: rgba(15,23,42,0.10) !important;
-}
-.small{
-  font-size: 12px;
-  color: var(--muted2);
-}
-.footer{
-  text-align:center;
-  color: rgba(17,24,39,0.45);
-  font-size: 12px;
-  margin-top: 34px;
-}
-</style>
-""",
-    unsafe_allow_html=True,
-)
+    With static serving on (.streamlit/config.toml) each rerun sends only a <link> (an absolute URL under
+    server.baseUrlPath); the browser fetches and caches the stylesheet once. Otherwise the CSS is minified
+    and inlined, and goes out with every rerun.
+    """
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "style.css"), encoding="utf-8") as fh:
+        css = fh.read()
+    if st.get_option("server.enableStaticServing"):
+        version = hashlib.sha1(css.encode("utf-8")).hexdigest()[:12]
+        base = "/".join(part for part in st.get_option("server.baseUrlPath").split("/") if part)
+        prefix = f"/{base}" if base else ""
+        return f'<link rel="stylesheet" href="{prefix}/app/static/style.css?v={version}">'
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", re.sub(r"\s+", " ", css))
+    css = re.sub(r":\s+", ":", css)
+    return f"<style>{css.strip()}</style>"
+st.markdown(page_style(), unsafe_allow_html=True)
 
 # =========================================================
 # 2) Session State
 # =========================================================
+def open_project(project_id, version=None):
+    """Load a saved project (latest version by default) into the session; False if it is not stored."""
+    project = get_project_store().load(project_id, version)
+    if project is None:
+        return False
+    st.session_state.update({
+        "result": project["result"],
+        "context": get_context_store().put(project["context"]),
+        "last_inputs": project["inputs"],
+        "expansion_level": project["expansion_level"],
+        "token_report": project["token_report"],
+        "project_id": project_id,
+        "project_version": project["version"],
+    })
+    st.query_params["pid"] = project_id
+    return True
+
 def init_state():
     if "result" not in st.session_state:
         st.session_state["result"] = None
-    if "context_text" not in st.session_state:
-        st.session_state["context_text"] = ""
+    if "context" not in st.session_state:
+        # A handle into the shared context store, not the text itself.
+        st.session_state["context"] = None
     if "last_inputs" not in st.session_state:
         st.session_state["last_inputs"] = {}
     if "expansion_level" not in st.session_state:
         st.session_state["expansion_level"] = 0
+    if "token_report" not in st.session_state:
+        st.session_state["token_report"] = None
+    if "last_trace" not in st.session_state:
+        st.session_state["last_trace"] = None
+    if "session_id" not in st.session_state:
+        # Kept in the URL so a reconnecting browser finds its background job again.
+        st.session_state["session_id"] = st.query_params.get("sid") or uuid.uuid4().hex
+        st.query_params["sid"] = st.session_state["session_id"]
+    if "job_id" not in st.session_state:
+        job = get_job_runner().latest(st.session_state["session_id"])
+        st.session_state["job_id"] = job.id if job else None
+    if "project_id" not in st.session_state:
+        st.session_state["project_id"] = None
+        st.session_state["project_version"] = None
+        # The project ID is kept in the URL too: a new session (reload, restart) reopens it from the store.
+        if st.query_params.get("pid"):
+            try:
+                open_project(st.query_params["pid"])
+            except (sqlite3.Error, OSError):
+                pass
 
 init_state()
 
+def current_session_id():
+    return st.session_state.get("session_id", "default")
+
+JOB_MESSAGES = {
+    # kind: (progress message, error prefix)
+    "generate": ("선행연구들을 교차 분석하며 석사 수준의 초안을 작성 중입니다...", "분석 중 오류가 발생했습니다"),
+    "expand": ("초안을 더 전문적으로 확장 작성 중입니다...", "확장 중 오류가 발생했습니다"),
+    "subsection": ("선택한 소절을 다시 작성 중입니다...", "소절 작업 중 오류가 발생했습니다"),
+}
+JOB_KIND_LABELS = {"generate": "초안 생성", "expand": "초안 확장", "subsection": "소절 작업"}
+
+def attached_job():
+    job_id = st.session_state.get("job_id")
+    return get_job_runner().get(job_id, current_session_id()) if job_id else None
+
+def collect_job(job):
+    """Apply a finished job to the session and queue its messages for display."""
+    get_job_runner().collect(job.id)
+    st.session_state["job_id"] = None
+    if job.status == "done":
+        st.session_state.update(job.result["state"])
+        if st.session_state.get("project_id"):
+            st.query_params["pid"] = st.session_state["project_id"]
+        st.session_state["job_notices"] = [("warning", message) for message in job.result["warnings"]]
+    elif job.status == "error":
+        st.session_state["job_notices"] = [("error", f"{JOB_MESSAGES[job.kind][1]}: {job.error}")]
+    else:
+        st.session_state["job_notices"] = [("info", "작업을 취소했습니다.")]
+
+# Collect a finished background job before anything renders, so every section sees its result.
+job = attached_job()
+if job is None:
+    st.session_state["job_id"] = None
+elif job.finished:
+    collect_job(job)
+    job = None
+
 # =========================================================
 # 3) Sidebar
 # =========================================================
-with st.sidebar:
+GENERATION_MODES = {"단일 요청": None, "섹션별 병렬": "section", "소절별 병렬": "subsection"}
+TRACE_STAGE_LABELS = {"extract": "자료 추출", "prompt": "프롬프트 구성", "generate": "생성(API)", "merge": "결과 병합", "sources": "출처 확인", "condense": "논문별 노트", "save": "프로젝트 저장"}
+
+def ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.0f}"
+
+def render_diagnostics(trace):
+    if not trace:
+        st.caption("아직 기록된 실행이 없습니다.")
+        return
+    kind = JOB_KIND_LABELS.get(trace["kind"], trace["kind"])
+    context = f" · 자료 원문 {trace['context_chars']}자" if "context_chars" in trace else ""
+    if trace.get("context_tokens") is not None:
+        context += f"/{trace['context_tokens']}토큰"
+    if trace.get("compaction_chars_saved"):
+        context += f" · 정리로 {trace['compaction_chars_saved']}자(약 {trace['compaction_tokens_saved']}토큰) 절약"
+    st.caption(f"{kind} · {trace['status']} · 총 {trace['seconds']:.2f}s{context}")
+    st.table({
+        "단계": [TRACE_STAGE_LABELS.get(s["name"], s["name"]) for s in trace["spans"]],
+        "ms": [ms(s["seconds"]) for s in trace["spans"]],
+    })
+    if trace["files"]:
+        st.markdown("**파일별 추출**")
+        st.table({
+            "파일": [f["name"] for f in trace["files"]],
+            "파싱/캐시 쪽": [f"{f['pages_parsed']}/{f['pages_cached']}" for f in trace["files"]],
+            "ms/쪽": [ms(f["parse_seconds"] / f["pages_parsed"]) if f["pages_parsed"] else "-" for f in trace["files"]],
+        })
+    if trace["requests"]:
+        requests = trace["requests"]
+        st.markdown("**API 요청**")
+        st.table({
+            "대기 ms": [ms(r["queue_seconds"]) for r in requests],
+            "첫 토큰 ms": [ms(r["ttft_seconds"]) for r in requests],
+            "전체 ms": [ms(r["seconds"]) for r in requests],
+            "입력/출력 토큰": [f"{r['prompt_tokens'] or '-'}/{r['completion_tokens'] or '-'}" for r in requests],
+            "결과": [r["outcome"] for r in requests],
+        })
+    if st.session_state.get("rerun_ms") is not None:
+        st.caption(f"직전 화면 재실행: {st.session_state['rerun_ms']:.0f} ms")
+    if st.session_state.get("render_ms") is not None:
+        st.caption(f"결과 화면 렌더링: {st.session_state['render_ms']:.0f} ms")
+    st.caption(f"로그: {metrics.TRACE_LOG or '끔'} · 지표: {metrics.METRICS_FILE or '끔'}")
+
+def kb(size):
+    return f"{size / 1024:,.0f}"
+
+def render_memory():
+    usage = session_memory(st.session_state)
+    st.markdown("**세션 메모리**")
+    st.table({
+        "항목": [key for key, _ in usage["by_key"][:6]],
+        "KB": [kb(size) for _, size in usage["by_key"][:6]],
+    })
+    caption = f"이 세션 전체 {kb(usage['own_bytes'])} KB"
+    if usage["context_sessions"]:
+        caption += (
+            f" · 자료 원문 {kb(usage['context_bytes'])} KB를 {usage['context_sessions']}개 세션이 공유"
+            f"(세션당 {kb(usage['context_share_bytes'])} KB)"
+        )
+    st.caption(caption)
+    store, spilled = get_context_store().summary(), spill_stats()
+    st.caption(
+        f"공유 자료 원문: {store['entries']}개 · {kb(store['bytes'])} KB · 핸들 {store['handles']}개"
+        f" · 공유로 절약 {kb(store['saved_bytes'])} KB · 디스크로 넘긴 업로드 {spilled['files']}개"
+        f"({kb(spilled['bytes'])} KB)"
+    )
+
+
+def project_label(project):
+    return f"{project['title'][:30]} · {time.strftime('%m-%d %H:%M', time.localtime(project['updated']))}"
+
+@st.fragment
+def render_projects():
+    # Picking a project or version reruns only this block; opening one reruns the app.
+    try:
+        store = get_project_store()
+        projects = store.list(current_session_id())
+    except (sqlite3.Error, OSError) as e:
+        st.caption(f"프로젝트 저장소를 열 수 없습니다: {e}")
+        return
+    if not projects:
+        st.caption("저장된 프로젝트가 없습니다. 초안을 생성하면 자동으로 저장됩니다.")
+        return
+    labels = {project["id"]: project_label(project) for project in projects}
+    ids = list(labels)
+    current = st.session_state["project_id"]
+    project_id = st.selectbox("저장된 프로젝트", ids, index=ids.index(current) if current in ids else 0, format_func=labels.get)
+    versions = {version: level for version, level, _ in store.versions(project_id)}
+    version = st.selectbox(
+        "버전",
+        list(versions),
+        index=list(versions).index(st.session_state["project_version"])
+        if project_id == current and st.session_state["project_version"] in versions else 0,
+        format_func=lambda v: f"v{v} · 확장 {versions[v]}회",
+    )
+    if st.button("프로젝트 열기", use_container_width=True, disabled=job is not None):
+        if not open_project(project_id, version):
+            st.warning("프로젝트를 찾을 수 없습니다.")
+        st.rerun()
+    stats = store.stats()
+    st.caption(
+        f"저장된 프로젝트 {stats['projects']}개 · 버전 {stats['versions']}개 · 자료 원문 "
+        f"{stats['context_chars']:,}자 → {kb(stats['context_bytes'])} KB(압축) · DB {kb(stats['file_bytes'])} KB"
+    )
+
+@st.fragment
+def render_options():
+    # Runs as a fragment: changing an option reruns only this block, not the draft on screen;
+    # the values are read from session_state (opt_*) when a job is started.
     st.markdown("### ⚙️ Settings")
-    user_api_key = st.text_input("OpenAI API Key", type="password", placeholder="sk-...")
-    model_name = st.text_input("Model", value="gpt-4o-mini")
+    st.text_input("OpenAI API Key", type="password", placeholder="sk-...", key="opt_api_key")
+    st.text_input("Model", value="gpt-4o-mini", key="opt_model")
 
     st.divider()
     st.markdown("### 📝 Draft Options")
-    base_paras = st.select_slider("소절당 문단 수(기본)", options=[2, 3], value=2)
-    min_chars_per_para = st.select_slider("문단 최소 글자 수", options=[200, 250, 300, 400], value=200)
-    tone_setting = st.selectbox("어조", ["Academic", "Formal", "Analytical"], index=0)
-    expand_additional = st.select_slider("확장 시 소절당 추가 문단", options=[1, 2], value=1)
+    st.select_slider("소절당 문단 수(기본)", options=[2, 3], value=2, key="opt_base_paras")
+    st.select_slider("문단 최소 글자 수", options=[200, 250, 300, 400], value=200, key="opt_min_chars")
+    st.selectbox("어조", ["Academic", "Formal", "Analytical"], index=0, key="opt_tone")
+    st.select_slider("확장 시 소절당 추가 문단", options=[1, 2], value=1, key="opt_expand_paras")
+    st.toggle(
+        "모델이 출처 요약 작성(source_map)",
+        value=True,
+        help="끄면 REF마다 근거 요약을 요청하지 않아 출력 토큰과 생성 시간이 줄어듭니다. 출처 팝오버에는 항상 해당 쪽 원문 발췌가 표시되고, 자료에 없는 쪽을 가리키는 REF는 ⚠️로 표시됩니다.",
+        key="opt_source_map",
+    )
+
+    st.divider()
+    st.markdown("### 📚 Context")
+    st.toggle(
+        "관련 페이지 우선 선택(BM25)",
+        value=True,
+        help="주제·목적·가설과 각 소절에 가장 관련 있는 페이지를 골라 자료 원문으로 사용합니다. 끄면 앞쪽 페이지부터 순서대로 사용합니다.",
+        key="opt_retrieval",
+    )
+    use_map_reduce = st.toggle(
+        "논문별 노트로 압축(map-reduce)",
+        value=False,
+        help="논문이 많을 때 사용합니다. 저렴한 모델이 각 논문을 쪽 번호가 달린 짧은 노트로 먼저 요약(동시 요청)하고, 초안은 원문 대신 이 노트로 작성합니다. 노트는 파일별로 캐시되어 다시 요약하지 않습니다.",
+        key="opt_map_reduce",
+    )
+    st.text_input("노트 작성 모델", value="gpt-4o-mini", disabled=not use_map_reduce, key="opt_condense_model")
+    st.toggle(
+        "생성 중 실시간 표시(스트리밍)",
+        value=True,
+        help="응답을 스트리밍으로 받아 완성된 섹션부터 바로 보여줍니다.",
+        key="opt_stream",
+    )
+    st.selectbox(
+        "생성 방식",
+        list(GENERATION_MODES),
+        index=0,
+        help="병렬 모드는 섹션(4개) 또는 소절(17개)마다 요청을 나눠 동시에 생성한 뒤 하나의 초안으로 합칩니다.",
+        key="opt_generation_mode",
+    )
+    st.slider("동시 요청 수(병렬 생성·확장)", min_value=1, max_value=8, value=4, key="opt_concurrency")
+    st.select_slider(
+        "자료 원문 토큰 예산(최대)",
+        options=[4000, 8000, 12000, 16000, 24000, 32000, 48000],
+        value=12000,
+        help="모델 컨텍스트 창에서 프롬프트 템플릿과 예상 출력 분량을 뺀 범위 안에서 적용됩니다.",
+        key="opt_context_budget",
+    )
+
+    st.divider()
+    st.markdown("### 💾 Cache")
+    st.toggle(
+        "응답 캐시 사용",
+        value=True,
+        help="모델·프롬프트·온도가 같은 요청은 저장된 응답을 재사용해 비용 없이 즉시 반환합니다. 새로 생성하려면 끄세요.",
+        key="opt_response_cache",
+    )
+    cache_stats = get_response_cache().stats
+    st.caption(
+        f"응답 캐시: 적중 {cache_stats['hits']} · 미스 {cache_stats['misses']} · 만료 {cache_stats['expired']}"
+    )
+
+@st.fragment
+def render_diagnostics_panel():
+    if st.toggle("단계별 시간·토큰 보기", value=False, help="마지막 생성/확장의 단계별 시간, 파일별 추출, API 요청별 지연과 토큰 수, 세션별 메모리 사용량을 보여줍니다."):
+        render_diagnostics(st.session_state["last_trace"])
+        render_memory()
+
+with st.sidebar:
+    render_options()
+
+    st.divider()
+    st.markdown("### 📂 Projects")
+    render_projects()
+
+    st.divider()
+    st.markdown("### 🩺 Diagnostics")
+    render_diagnostics_panel()
 
     st.divider()
     if st.button("새 프로젝트 시작", use_container_width=True):
+        get_job_runner().cancel_session(st.session_state["session_id"])
+        st.query_params.pop("pid", None)
         st.session_state.clear()
         init_state()
         st.rerun()
 
+options = st.session_state
+user_api_key, model_name = options["opt_api_key"], options["opt_model"]
+base_paras, min_chars_per_para = options["opt_base_paras"], options["opt_min_chars"]
+tone_setting, expand_additional = options["opt_tone"], options["opt_expand_paras"]
+model_source_map, use_retrieval = options["opt_source_map"], options["opt_retrieval"]
+use_map_reduce, condense_model = options["opt_map_reduce"], options["opt_condense_model"]
+stream_output, generation_mode = options["opt_stream"], options["opt_generation_mode"]
+max_concurrency, context_token_budget = options["opt_concurrency"], options["opt_context_budget"]
+use_response_cache = options["opt_response_cache"]
+
 # =========================================================
 # 4) Hero Header (Title changed to "Report Mate")
 # =========================================================
@@ -306,12 +384,17 @@ st.markdown(
 st.markdown('<div class="glass">', unsafe_allow_html=True)
 st.markdown('<div class="card-title">Research Context</div>', unsafe_allow_html=True)
 
-topic = st.text_input("연구 주제", placeholder="예: 생성형 AI가 대학생의 학술적 글쓰기에 미치는 영향")
-col1, col2 = st.columns(2)
-with col1:
-    purpose = st.text_input("연구 목적", placeholder="연구를 통해 무엇을 밝히고 싶나요?")
-with col2:
-    hypothesis = st.text_input("연구 가설", placeholder="예상되는 결론은 무엇인가요?")
+@st.fragment
+def render_research_context():
+    # Runs as a fragment, like the sidebar options: typing here does not re-render the draft.
+    st.text_input("연구 주제", placeholder="예: 생성형 AI가 대학생의 학술적 글쓰기에 미치는 영향", key="input_topic")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.text_input("연구 목적", placeholder="연구를 통해 무엇을 밝히고 싶나요?", key="input_purpose")
+    with col2:
+        st.text_input("연구 가설", placeholder="예상되는 결론은 무엇인가요?", key="input_hypothesis")
+render_research_context()
+topic, purpose, hypothesis = options["input_topic"], options["input_purpose"], options["input_hypothesis"]
 
 uploaded_files = st.file_uploader(
     "선행연구 PDF 업로드 (다중 선택 가능)",
@@ -323,181 +406,166 @@ st.markdown(
     '<div class="help">Tip: 텍스트 추출이 안 되는 스캔 PDF는 내용이 비어 보일 수 있어요. 가능한 텍스트 기반 PDF를 업로드해 주세요.</div>',
     unsafe_allow_html=True,
 )
+
+PREFETCH_POLL_SECONDS = 1.0
+
+def upload_items(files):
+    """(name, data) per upload, spilled once per file and reused across reruns (spilled again if its temp copy is gone)."""
+    cached = st.session_state.get("upload_items", {})
+    items = {}
+    for f in files or []:
+        item = cached.get(f.file_id)
+        items[f.file_id] = item if item and spill_exists(item[1]) else spill_upload(f)
+    st.session_state["upload_items"] = items
+    return list(items.values())
+
+def prefetch_caption(future):
+    if not future.done():
+        return "⏳ 업로드한 자료를 미리 추출·색인하는 중입니다. 그동안 주제를 입력하세요."
+    if future.exception() is not None:
+        return "자료를 미리 추출하지 못했습니다. 생성할 때 다시 시도합니다."
+    index = future.result()
+    files = len({doc[0] for doc in index.docs})
+    caption = f"✅ 자료 준비 완료: {files}개 파일 · {len(index.docs)}쪽 색인"
+    return caption + (f" · 추출 실패 {len(index.errors)}개" if index.errors else "")
+
+@st.fragment(run_every=PREFETCH_POLL_SECONDS)
+def render_prefetch_status(future):
+    st.caption(prefetch_caption(future))
+    if future.done():
+        st.rerun()
+
+def prefetch_uploads(files):
+    """Start extraction whenever the set of uploads changes; adding or removing a file
+    only extracts that file, and generation reuses whatever is already done."""
+    items = upload_items(files)
+    key = tuple(f.file_id for f in files or [])
+    if st.session_state.get("prefetch_key") != key:
+        st.session_state["prefetch_key"] = key
+        st.session_state["prefetch"] = prefetch_context(items) if items else None
+    return st.session_state["prefetch"]
+
+upload_prefetch = prefetch_uploads(uploaded_files)
+if upload_prefetch is not None and upload_prefetch.done():
+    st.caption(prefetch_caption(upload_prefetch))
+elif upload_prefetch is not None:
+    render_prefetch_status(upload_prefetch)
 st.markdown("</div>", unsafe_allow_html=True)
 
 # =========================================================
-# 6) Core Logic (No RAG / No export)
+# 6) Rendering (the drafting pipeline itself lives in pipeline.py)
 # =========================================================
-def get_combined_text_with_meta(files, max_pages_each=10, max_chars=35000):
-    text_data = ""
-    for f in files:
-        reader = PdfReader(io.BytesIO(f.getvalue()))
-        file_name = f.name
-        for i, page in enumerate(reader.pages[:max_pages_each]):
-            content = page.extract_text()
-            if content:
-                text_data += f"\n[SOURCE: {file_name}, PAGE: {i+1}]\n{content}\n"
-    return text_data[:max_chars]
-
-def tone_instructions(tone: str) -> str:
-    if tone == "Academic":
-        return "학술적·객관적 문체로, 정의-근거-논증 연결을 분명히 하되 과도한 수사는 피할 것."
-    if tone == "Formal":
-        return "격식을 갖춘 문체로, 문장 구조를 정돈하고 단정적 표현은 근거와 함께 제시할 것."
-    if tone == "Analytical":
-        return "분석적 문체로, 비교·대조·비판적 논의(한계/공백)를 더 적극적으로 포함할 것."
-    return "학술적 문체를 유지할 것."
-
-def build_initial_prompt(topic, purpose, hypothesis, context, base_paras, min_chars_per_para, tone):
-    system_msg = f"""
-당신은 석사학위 논문을 다수 지도한 전문 학술 에디터입니다.
-제공된 자료에 근거해 엄밀한 학술 문체(석사 논문 수준)로 서술하며, 주장-근거-비판적 논의-연구 공백/기여를 명료하게 연결합니다.
-{tone_instructions(tone)}
-반드시 지정한 JSON 스키마로만 출력하세요.
-""".strip()
-
-    user_msg = f"""
-주제: {topic}
-목적: {purpose}
-가설: {hypothesis}
-
-[자료 원문]
-{context}
-
-[요구사항]
-1) detailed_outline (간결):
-- 각 섹션(서론/이론적 배경/연구방법/결론)당 6~10문장 이내로 전개 전략만 요약.
-
-2) interactive_draft (석사 수준, 기본 분량 강화):
-- 각 섹션을 소절로 나누어 작성 (예시 구조를 반드시 반영):
-  • 서론: 1.1 연구 배경, 1.2 문제 제기, 1.3 연구 목적/질문, 1.4 연구 기여/구성
-  • 이론적 배경: 2.1 핵심 개념 정의, 2.2 선행연구 흐름, 2.3 한계/논쟁점, 2.4 연구 공백 및 연구모형 시사점
-  • 연구방법: 3.1 연구설계, 3.2 표본/자료, 3.3 측정(변수/도구), 3.4 분석전략, 3.5 타당도·윤리
-  • 결론: 4.1 결과 요약(예상 포함), 4.2 이론적 함의, 4.3 실천적 함의, 4.4 한계 및 후속연구
-- 각 소절은 최소 {base_paras}개 문단으로 작성.
-- 각 문단은 최소 {min_chars_per_para}자 이상(한국어 기준).
-- 각 문단에 최소 1개의 인용 태그 [REF:파일명,p숫자]를 반드시 포함(가능하면 2개).
-- 논리 전개: (주장/요지 → 근거와 선행연구 연결 → 비판적 논의/한계 → 연구 공백 및 본 연구 위치화)를 균형 있게 포함.
-
-3) source_map:
-- 각 [REF:...] 태그에 대응하는 근거(해당 페이지의 핵심 요약)를 구체적으로 작성.
-
-4) REF 규칙:
-- 태그 포맷은 반드시 정확히 [REF:파일명,p숫자]
-- 파일명은 [SOURCE: ...]에 나온 파일명을 그대로 사용
-- 페이지 숫자는 [PAGE: ...]를 근거로 사용
-
-[반드시 아래 JSON으로만 출력]
-{{
-  "detailed_outline": {{
-    "서론": "...",
-    "이론적 배경": "...",
-    "연구방법": "...",
-    "결론": "..."
-  }},
-  "interactive_draft": {{
-    "서론": "...",
-    "이론적 배경": "...",
-    "연구방법": "...",
-    "결론": "..."
-  }},
-  "source_map": {{
-    "[REF:파일명,p숫자]": "이 REF가 지지하는 핵심 근거(해당 페이지 내용) 요약"
-  }}
-}}
-""".strip()
-    return system_msg, user_msg
-
-def build_expand_prompt(topic, purpose, hypothesis, context, current_result, add_paras, min_chars_per_para, tone):
-    system_msg = f"""
-당신은 석사학위 논문을 다수 지도한 전문 학술 에디터입니다.
-기존 초안을 더 전문적이고 더 길게 확장합니다. 근거(REF) 밀도와 논리 연결을 강화하세요.
-{tone_instructions(tone)}
-반드시 지정한 JSON 스키마로만 출력하세요.
-""".strip()
-
-    user_msg = f"""
-주제: {topic}
-목적: {purpose}
-가설: {hypothesis}
-
-[자료 원문]
-{context}
-
-[기존 결과(JSON)]
-{json.dumps(current_result, ensure_ascii=False)}
-
-[확장 요구사항]
-- interactive_draft만 확장 (detailed_outline는 유지 또는 약간 정리).
-- 각 소절(예: 1.1, 1.2...)마다 문단을 추가로 {add_paras}개씩 더 작성.
-- 새로 추가되는 각 문단은 최소 {min_chars_per_para}자 이상.
-- 새 문단마다 최소 1개의 [REF:파일명,p숫자] 포함(가능하면 2개).
-- source_map은 기존 매핑을 유지하고, 새로 추가된 REF가 있으면 반드시 추가/보강.
-
-[반드시 아래 JSON으로만 출력]
-{{
-  "detailed_outline": {{
-    "서론": "...",
-    "이론적 배경": "...",
-    "연구방법": "...",
-    "결론": "..."
-  }},
-  "interactive_draft": {{
-    "서론": "...",
-    "이론적 배경": "...",
-    "연구방법": "...",
-    "결론": "..."
-  }},
-  "source_map": {{
-    "[REF:파일명,p숫자]": "이 REF가 지지하는 핵심 근거(해당 페이지 내용) 요약"
-  }}
-}}
-""".strip()
-    return system_msg, user_msg
-
-def call_openai_json(api_key, model, system_msg, user_msg, temperature=0.45):
-    client = OpenAI(api_key=api_key)
-    resp = client.chat.completions.create(
-        model=model,
-        messages=[{"role": "system", "content": system_msg}, {"role": "user", "content": user_msg}],
-        response_format={"type": "json_object"},
-        temperature=temperature,
-    )
-    return json.loads(resp.choices[0].message.content)
-
-def render_text_with_ref_popovers(text, source_map):
-    parts = re.split(r"(\[REF:[^\]]+\])", text)
-    buffer = ""
-    for part in parts:
-        if part.startswith("[REF:"):
-            if buffer.strip():
-                st.markdown(buffer)
-            buffer = ""
-            ref_info = source_map.get(part, "상세 출처 정보를 불러올 수 없습니다.")
+def render_text_with_ref_popovers(text, sources, missing_text="상세 출처 정보를 불러올 수 없습니다."):
+    """sources: a (partial) result; finished ones also carry source_excerpts and invalid_refs."""
+    source_map = sources.get("source_map") or {}
+    excerpts = sources.get("source_excerpts") or {}
+    invalid = sources.get("invalid_refs") or ()
+    for is_ref, part in parse_ref_segments(text):
+        if is_ref and part in invalid:
+            with st.popover(f"⚠️ {part}"):
+                st.markdown("**확인 필요:** 제공된 자료 원문에 이 파일·쪽이 없습니다. 인용을 직접 확인해주세요.")
+                if part in source_map:
+                    st.markdown(f"**모델이 작성한 근거:**\n\n{source_map[part]}")
+        elif is_ref:
             with st.popover(f"📍 {part}"):
-                st.markdown(f"**상세 근거:**\n\n{ref_info}")
+                if part in source_map or part not in excerpts:
+                    st.markdown(f"**상세 근거:**\n\n{source_map.get(part, missing_text)}")
+                if part in excerpts:
+                    st.markdown(f"**원문 발췌:**\n\n> {excerpts[part]}")
         else:
-            buffer += part
-    if buffer.strip():
-        st.markdown(buffer)
+            st.markdown(part)
+
+def render_outline_section(section, detail):
+    st.markdown('<div class="glass">', unsafe_allow_html=True)
+    st.markdown(f"<div class='h3'>{section}</div>", unsafe_allow_html=True)
+    st.markdown(f"<div class='help'>{detail}</div>", unsafe_allow_html=True)
+    st.markdown("</div>", unsafe_allow_html=True)
+
+def render_draft_section(section, text, sources, missing_text="상세 출처 정보를 불러올 수 없습니다.", page_size=None):
+    """Render a draft section; with page_size, only the first N paragraphs plus a '더 보기' button."""
+    st.markdown('<div class="glass">', unsafe_allow_html=True)
+    st.markdown(f"<div class='h3'>{section}</div>", unsafe_allow_html=True)
+    if page_size is None:
+        render_text_with_ref_popovers(text, sources, missing_text=missing_text)
+    else:
+        paragraphs = split_paragraphs(text)
+        state_key = f"visible_paragraphs::{section}"
+        visible = max(page_size, st.session_state.get(state_key, page_size))
+        render_text_with_ref_popovers("\n\n".join(paragraphs[:visible]), sources, missing_text=missing_text)
+        if visible < len(paragraphs):
+            st.button(
+                f"더 보기 ({visible}/{len(paragraphs)} 문단)",
+                key=f"more::{section}",
+                on_click=st.session_state.__setitem__,
+                args=(state_key, visible + page_size),
+            )
+    st.markdown("</div>", unsafe_allow_html=True)
 
 # =========================================================
 # 7) Actions
 # =========================================================
+JOB_POLL_SECONDS = 1.0
+JOB_STAGE_LABELS = {
+    "extracting": "자료 추출 중",
+    "condensing": "논문별 노트 작성 중",
+    "prompting": "프롬프트 구성 중",
+    "generating": "초안 생성 중",
+    "merging": "결과 병합 중",
+}
+def render_partial_result(partial):
+    tab1, tab2 = st.tabs(["📋 상세 설계 개요(간결)", "✍️ 각주 포함 초안(전문적)"])
+    with tab1:
+        for section, detail in partial.get("detailed_outline", {}).items():
+            render_outline_section(section, detail)
+    with tab2:
+        for section, text in partial.get("interactive_draft", {}).items():
+            render_draft_section(section, text, partial, missing_text="근거를 받는 중입니다…")
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def render_job_progress():
+    # Polls the background job; only this block reruns until the job finishes.
+    job = attached_job()
+    if job is None or job.finished:
+        st.rerun()
+    state = job.snapshot()
+    message = JOB_MESSAGES[job.kind][0]
+    stage = state["stage"]
+    done = STAGES.index(stage) + 0.5 if stage in STAGES else 0
+    label = JOB_STAGE_LABELS.get(stage, "대기 중")
+    if state["detail"]:
+        label = f"{label} ({state['detail']})"
+
+    st.markdown('<div class="glass">', unsafe_allow_html=True)
+    st.markdown('<div class="card-title">Results (생성 중…)</div>', unsafe_allow_html=True)
+    st.progress(done / len(STAGES), text=f"{message} — {label}")
+    st.button(
+        "⏹ 작업 취소" if not state["cancel_requested"] else "취소하는 중…",
+        on_click=job.cancel,
+        disabled=state["cancel_requested"],
+    )
+    if state["partial"]:
+        render_partial_result(state["partial"])
+    st.markdown("</div>", unsafe_allow_html=True)
+
 st.markdown('<div class="glass">', unsafe_allow_html=True)
 st.markdown('<div class="card-title">Actions</div>', unsafe_allow_html=True)
 
 btn_col1, btn_col2 = st.columns(2)
 with btn_col1:
-    generate_clicked = st.button("🚀 분석 및 상세 초안 생성", type="primary")
+    generate_clicked = st.button("🚀 분석 및 상세 초안 생성", type="primary", disabled=job is not None)
 with btn_col2:
     st.markdown('<div class="secondary-btn">', unsafe_allow_html=True)
-    expand_clicked = st.button("➕ 초안 확장(추가 작성)", disabled=(st.session_state["result"] is None))
+    expand_clicked = st.button(
+        "➕ 초안 확장(추가 작성)", disabled=(st.session_state["result"] is None or job is not None)
+    )
     st.markdown("</div>", unsafe_allow_html=True)
 
-st.markdown('<div class="small">• 확장은 기존 초안을 바탕으로 소절마다 문단을 추가합니다.</div>', unsafe_allow_html=True)
+st.markdown('<div class="small">• 확장은 기존 초안을 다시 보내지 않고, 소절마다 새 문단만 생성해 이어 붙입니다.</div>', unsafe_allow_html=True)
 st.markdown("</div>", unsafe_allow_html=True)
 
+for level, notice in st.session_state.pop("job_notices", []):
+    getattr(st, level)(notice)
+
 if generate_clicked:
     if not user_api_key:
         st.error("API 키를 입력해주세요.")
@@ -506,75 +574,137 @@ if generate_clicked:
     elif not topic:
         st.warning("연구 주제를 입력해주세요.")
     else:
-        with st.spinner("선행연구들을 교차 분석하며 석사 수준의 초안을 작성 중입니다..."):
-            try:
-                context = get_combined_text_with_meta(uploaded_files, max_pages_each=10)
-                st.session_state["context_text"] = context
-                st.session_state["expansion_level"] = 0
-                st.session_state["last_inputs"] = {
-                    "topic": topic,
-                    "purpose": purpose,
-                    "hypothesis": hypothesis,
-                    "base_paras": base_paras,
-                    "min_chars_per_para": min_chars_per_para,
-                    "tone_setting": tone_setting,
-                    "model_name": model_name,
-                }
-
-                system_msg, user_msg = build_initial_prompt(
-                    topic, purpose, hypothesis, context, base_paras, min_chars_per_para, tone_setting
-                )
-                st.session_state["result"] = call_openai_json(
-                    api_key=user_api_key,
-                    model=model_name,
-                    system_msg=system_msg,
-                    user_msg=user_msg,
-                    temperature=0.45,
-                )
-            except Exception as e:
-                st.error(f"분석 중 오류가 발생했습니다: {e}")
+        job = get_job_runner().submit(
+            current_session_id(),
+            "generate",
+            run_generate_job,
+            user_api_key,
+            current_session_id(),
+            upload_items(uploaded_files),
+            {
+                "topic": topic,
+                "purpose": purpose,
+                "hypothesis": hypothesis,
+                "base_paras": base_paras,
+                "min_chars_per_para": min_chars_per_para,
+                "tone_setting": tone_setting,
+                "model_name": model_name,
+            },
+            use_retrieval,
+            GENERATION_MODES[generation_mode],
+            max_concurrency,
+            context_token_budget,
+            stream_output,
+            use_response_cache,
+            model_source_map,
+            condense_model if use_map_reduce else None,
+            uuid.uuid4().hex,
+        )
+        st.session_state["job_id"] = job.id
+        st.rerun()
+
+def draft_inputs():
+    """Inputs of the draft on screen (from its generation run), falling back to the current inputs.
 
+    Reads session_state rather than this run's variables, which are stale in a fragment rerun.
+    """
+    last = st.session_state.get("last_inputs", {})
+    return {
+        "topic": last.get("topic", options["input_topic"]),
+        "purpose": last.get("purpose", options["input_purpose"]),
+        "hypothesis": last.get("hypothesis", options["input_hypothesis"]),
+        "tone_setting": last.get("tone_setting", options["opt_tone"]),
+        "model_name": last.get("model_name", options["opt_model"]),
+    }
 if expand_clicked:
     if not user_api_key:
         st.warning("먼저 OpenAI API Key를 입력해주세요.")
     elif st.session_state["result"] is None:
         st.warning("먼저 초안을 생성해주세요.")
     else:
-        with st.spinner("초안을 더 전문적으로 확장 작성 중입니다..."):
-            try:
-                last = st.session_state.get("last_inputs", {})
-                topic0 = last.get("topic", topic)
-                purpose0 = last.get("purpose", purpose)
-                hypothesis0 = last.get("hypothesis", hypothesis)
-                model0 = last.get("model_name", model_name)
-                tone0 = last.get("tone_setting", tone_setting)
-
-                context = st.session_state.get("context_text", "")
-                system_msg, user_msg = build_expand_prompt(
-                    topic0,
-                    purpose0,
-                    hypothesis0,
-                    context,
-                    st.session_state["result"],
-                    expand_additional,
-                    min_chars_per_para,
-                    tone0,
-                )
-                st.session_state["result"] = call_openai_json(
-                    api_key=user_api_key,
-                    model=model0,
-                    system_msg=system_msg,
-                    user_msg=user_msg,
-                    temperature=0.50,
-                )
-                st.session_state["expansion_level"] += 1
-            except Exception as e:
-                st.error(f"확장 중 오류가 발생했습니다: {e}")
+        job = get_job_runner().submit(
+            current_session_id(),
+            "expand",
+            run_expand_job,
+            user_api_key,
+            current_session_id(),
+            draft_inputs(),
+            st.session_state["context"].text if st.session_state["context"] else "",
+            st.session_state["result"],
+            st.session_state.get("expansion_level", 0),
+            expand_additional,
+            min_chars_per_para,
+            max_concurrency,
+            use_response_cache,
+            model_source_map,
+            st.session_state["project_id"],
+        )
+        st.session_state["job_id"] = job.id
+        st.rerun()
+
+if job is not None:
+    render_job_progress()
 
 # =========================================================
 # 8) Results
 # =========================================================
-if st.session_state["result"]:
+DRAFT_PARAGRAPHS_PER_PAGE = 6
+SUBSECTION_ACTIONS = {"rewrite": "더 깊게 다시 쓰기", "expand": "문단 추가"}
+
+def render_subsection_actions(section, text):
+    """Rewrite or extend one subsection of a section; only its pages and neighbours are sent.
+
+    Offered only for subsections whose '1.1 …' heading is in the text, so a reply has a place to go.
+    Runs inside the results fragment, so the options are read from session_state.
+    """
+    subsections = {
+        number: title for number, title, _ in section_subsections(section, text) if has_subsection(text, number, section)
+    }
+    if not subsections:
+        return
+    with st.expander(f"🎯 {section} · 소절 하나만 다시 작성/확장"):
+        col1, col2 = st.columns([3, 2])
+        with col1:
+            number = st.selectbox("소절", list(subsections), format_func=subsections.get, key=f"subsection::{section}")
+        with col2:
+            mode = st.radio(
+                "작업", list(SUBSECTION_ACTIONS), format_func=SUBSECTION_ACTIONS.get,
+                key=f"subsection_mode::{section}", horizontal=True,
+            )
+        clicked = st.button("선택한 소절 실행", key=f"subsection_run::{section}", disabled=job is not None)
+        st.caption("이 소절과 관련된 자료 쪽과 앞뒤 소절 일부만 보내므로 전체 확장보다 빠르고 저렴합니다.")
+    if not clicked:
+        return
+    if not options["opt_api_key"]:
+        st.warning("먼저 OpenAI API Key를 입력해주세요.")
+        return
+    submitted = get_job_runner().submit(
+        current_session_id(),
+        "subsection",
+        run_subsection_job,
+        options["opt_api_key"],
+        current_session_id(),
+        draft_inputs(),
+        st.session_state["context"].text if st.session_state["context"] else "",
+        st.session_state["result"],
+        section,
+        number,
+        mode,
+        options["opt_expand_paras"],
+        options["opt_base_paras"],
+        options["opt_min_chars"],
+        options["opt_response_cache"],
+        options["opt_source_map"],
+        st.session_state["project_id"],
+        st.session_state.get("expansion_level", 0),
+    )
+    st.session_state["job_id"] = submitted.id
+    st.rerun()
+
+@st.fragment
+def render_results():
+    # Runs as a fragment: paging, section switching and popovers rerun only this block.
+    started = time.perf_counter()
     res = st.session_state["result"]
 
     st.markdown('<div class="glass">', unsafe_allow_html=True)
@@ -583,24 +713,71 @@ if st.session_state["result"]:
     if st.session_state.get("expansion_level", 0) > 0:
         st.success(f"초안이 {st.session_state['expansion_level']}회 확장되었습니다.")
 
+    report = st.session_state.get("token_report")
+    if report:
+        with st.expander("🔢 토큰 예산 (계획 vs 실제)"):
+            rows = {
+                "작업": JOB_KIND_LABELS.get(report["kind"], report["kind"]),
+                "요청 수": report.get("requests", 1),
+                "응답 캐시 적중": report.get("cache_hits", 0),
+                "복구한 응답(잘림·형식 오류)": report.get("repaired_responses", 0),
+                "누락분 재요청": report.get("repair_requests", 0),
+                "실패한 요청(API 오류)": report.get("failed_requests", 0),
+                "자료 원문 토큰": report["context_tokens"],
+                "프롬프트 토큰(로컬 계산)": report["prompt_tokens_local"],
+                "프롬프트 토큰(API 실제)": report["prompt_tokens_api"],
+                "출력 토큰(API 실제)": report["completion_tokens_api"],
+            }
+            if "planned_input_tokens" in report:
+                rows.update({
+                    "컨텍스트 창": report["context_window"],
+                    "템플릿 토큰": report["template_tokens"],
+                    "출력 예약 토큰": report["reserved_output_tokens"],
+                    "자료 원문 예산": report["input_budget_tokens"],
+                    "계획 입력 토큰": report["planned_input_tokens"],
+                })
+            if "compaction_chars_saved" in report:
+                rows.update({
+                    "정리로 줄인 글자 수": report["compaction_chars_saved"],
+                    "정리로 줄인 토큰(추정)": report["compaction_tokens_saved"],
+                    "제외한 참고문헌 쪽": report["compaction_pages_dropped"],
+                })
+            if "map_model" in report:
+                rows.update({
+                    "노트 작성 모델": report["map_model"],
+                    "논문별 노트 수": report["map_notes"],
+                    "노트 작성 캐시 적중": report["map_cache_hits"],
+                    "노트 작성 프롬프트 토큰(API 실제)": report["map_prompt_tokens_api"],
+                    "노트 작성 출력 토큰(API 실제)": report["map_completion_tokens_api"],
+                })
+            st.table({"항목": list(rows.keys()), "값": [str(v) for v in rows.values()]})
+            if not report["exact_tokenizer"]:
+                st.caption("tiktoken을 사용할 수 없어 토큰 수는 추정치입니다.")
+
     tab1, tab2 = st.tabs(["📋 상세 설계 개요(간결)", "✍️ 각주 포함 초안(전문적)"])
 
     with tab1:
         for section, detail in res.get("detailed_outline", {}).items():
-            st.markdown('<div class="glass">', unsafe_allow_html=True)
-            st.markdown(f"<div class='h3'>{section}</div>", unsafe_allow_html=True)
-            st.markdown(f"<div class='help'>{detail}</div>", unsafe_allow_html=True)
-            st.markdown("</div>", unsafe_allow_html=True)
+            render_outline_section(section, detail)
 
     with tab2:
-        source_map = res.get("source_map", {})
-        for section, text in res.get("interactive_draft", {}).items():
-            st.markdown('<div class="glass">', unsafe_allow_html=True)
-            st.markdown(f"<div class='h3'>{section}</div>", unsafe_allow_html=True)
-            render_text_with_ref_popovers(text, source_map)
-            st.markdown("</div>", unsafe_allow_html=True)
+        draft = res.get("interactive_draft", {})
+        sections = list(draft)
+        if sections:
+            shown = st.segmented_control(
+                "섹션", ["전체"] + sections, default="전체", key="results_section", label_visibility="collapsed"
+            ) or "전체"
+            for section in (sections if shown == "전체" else [shown]):
+                render_draft_section(section, draft[section], res, page_size=DRAFT_PARAGRAPHS_PER_PAGE)
+                render_subsection_actions(section, draft[section])
 
     st.markdown("</div>", unsafe_allow_html=True)
+    elapsed = time.perf_counter() - started
+    metrics.record_stage("render", elapsed)
+    st.session_state["render_ms"] = elapsed * 1000
+
+if st.session_state["result"]:
+    render_results()
 else:
     st.markdown(
         """
@@ -613,3 +790,11 @@ else:
     )
 
 st.markdown('<div class="footer">© 2026 Report Mate</div>', unsafe_allow_html=True)
+
+# Whole-script time of this rerun (fragment reruns are timed as "render"); read by benchmarks/load.py.
+rerun_seconds = time.perf_counter() - rerun_started
+metrics.record_stage("rerun", rerun_seconds)
+st.session_state["rerun_ms"] = rerun_seconds * 1000
+# Once per process, after the first page is out: import the OpenAI SDK, load the tokenizer and spawn the
+# extraction workers in the background, so the first upload and generation do not wait for them.
+warm_up(model_name)
@@ -0,0 +1,179 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from blobs import MappedFile
+from jobs import Job
+from pipeline import run_generate_job
+
+# =========================================================
+# Headless batch drafting
+#   python batch.py manifest.jsonl -o drafts.jsonl --workers 4
+# - The manifest is JSON Lines (or a JSON array); each job has topic, purpose,
+#   hypothesis, pdfs (paths relative to the manifest) and optional options.
+# - Every finished job is appended to the output file as one JSON line, so an
+#   interrupted run resumes by skipping jobs already recorded as "done".
+# =========================================================
+GRANULARITIES = {"single": None, "section": "section", "subsection": "subsection"}
+
+
+def load_manifest(path):
+    with open(path, encoding="utf-8") as fh:
+        text = fh.read()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def entry_id(entry):
+    if entry.get("id"):
+        return str(entry["id"])
+    payload = json.dumps(entry, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def finished_ids(output_path):
+    done = set()
+    try:
+        with open(output_path, encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by an interrupted run
+                if record.get("status") == "done":
+                    done.add(record["id"])
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def job_options(entry, args):
+    options = {
+        "model": args.model,
+        "mode": args.mode,
+        "base_paras": 2,
+        "min_chars_per_para": 200,
+        "tone": "Academic",
+        "use_retrieval": True,
+        "max_concurrency": args.concurrency,
+        "context_token_budget": 12000,
+        "use_cache": not args.no_cache,
+        "source_map": not args.no_source_map,
+        "condense_model": args.condense_model,
+    }
+    options.update(entry.get("options") or {})
+    return options
+
+
+def run_entry(job, entry, base_dir, args, api_key):
+    options = job_options(entry, args)
+    items = [(os.path.basename(path), MappedFile(os.path.join(base_dir, path))) for path in entry.get("pdfs", [])]
+    inputs = {
+        "topic": entry.get("topic", ""),
+        "purpose": entry.get("purpose", ""),
+        "hypothesis": entry.get("hypothesis", ""),
+        "base_paras": options["base_paras"],
+        "min_chars_per_para": options["min_chars_per_para"],
+        "tone_setting": options["tone"],
+        "model_name": options["model"],
+    }
+    return run_generate_job(
+        job, api_key, job.session, items, inputs,
+        options["use_retrieval"], GRANULARITIES[options["mode"]], options["max_concurrency"],
+        options["context_token_budget"], False, options["use_cache"], options["source_map"],
+        options["condense_model"],
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate Report Mate drafts for a manifest of jobs.")
+    parser.add_argument("manifest", help="JSON Lines (or JSON array) of jobs")
+    parser.add_argument("-o", "--output", default="drafts.jsonl", help="results file; appended to and used to resume")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="jobs run at the same time")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight per job (parallel modes)")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--mode", choices=list(GRANULARITIES), default="single")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the response cache")
+    parser.add_argument(
+        "--no-source-map", action="store_true", help="do not ask the model for REF summaries (page excerpts only)"
+    )
+    parser.add_argument(
+        "--condense-model", help="map-reduce mode: condense each paper into page notes with this model first"
+    )
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"))
+    args = parser.parse_args(argv)
+    if not args.api_key:
+        parser.error("an API key is required (--api-key or OPENAI_API_KEY)")
+
+    entries = load_manifest(args.manifest)
+    base_dir = os.path.dirname(os.path.abspath(args.manifest))
+    done = finished_ids(args.output)
+    pending = [(entry_id(entry), entry) for entry in entries]
+    pending = [(job_id, entry) for job_id, entry in pending if job_id not in done]
+    skipped = len(entries) - len(pending)
+    print(f"{len(entries)} jobs, {skipped} already done, {len(pending)} to run", file=sys.stderr)
+
+    totals = {"done": 0, "error": 0, "requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "cache_hits": 0}
+    jobs = {}
+    started = time.monotonic()
+    interrupted = False
+    with open(args.output, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {}
+        for job_id, entry in pending:
+            job = jobs[job_id] = Job(job_id, "generate")
+            futures[pool.submit(run_entry, job, entry, base_dir, args, args.api_key)] = (job_id, time.monotonic())
+        try:
+            for fut in as_completed(futures):
+                job_id, submitted = futures[fut]
+                record = {"id": job_id}
+                try:
+                    output = fut.result()
+                except Exception as e:
+                    record.update(status="error", error=str(e))
+                else:
+                    report = output["state"]["token_report"]
+                    record.update(
+                        status="done",
+                        result=output["state"]["result"],
+                        token_report=report,
+                        warnings=output["warnings"],
+                    )
+                    totals["requests"] += report["requests"]
+                    totals["prompt_tokens"] += report["prompt_tokens_api"] or 0
+                    totals["completion_tokens"] += report["completion_tokens_api"] or 0
+                    totals["cache_hits"] += report["cache_hits"]
+                record["elapsed_seconds"] = round(time.monotonic() - submitted, 2)
+                totals[record["status"]] += 1
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                os.fsync(out.fileno())
+                print(f"[{totals['done'] + totals['error']}/{len(pending)}] {job_id}: {record['status']}", file=sys.stderr)
+        except KeyboardInterrupt:
+            # Requests in flight are aborted too: the pipeline polls its job while it waits on the API.
+            interrupted = True
+            print("interrupted, cancelling running jobs", file=sys.stderr)
+            for job in jobs.values():
+                job.cancel()
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    elapsed = time.monotonic() - started
+    finished = totals["done"] + totals["error"]
+    print(
+        f"{'interrupted: ' if interrupted else ''}"
+        f"{totals['done']} done, {totals['error']} failed, {skipped} skipped in {elapsed:.1f}s "
+        f"({finished / elapsed * 60 if elapsed else 0:.1f} jobs/min); "
+        f"{totals['requests']} requests ({totals['cache_hits']} cached), "
+        f"{totals['prompt_tokens']} prompt + {totals['completion_tokens']} completion tokens "
+        f"({(totals['prompt_tokens'] + totals['completion_tokens']) / elapsed if elapsed else 0:.0f} tokens/s)",
+        file=sys.stderr,
+    )
+    return 130 if interrupted else (1 if totals["error"] else 0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# Benchmarks must neither read nor fill the real caches, and the process-wide
+# rate limits are meant for the real API. Both are read when the app modules
+# are imported, so they are set here, before any benchmark module loads them.
+os.environ.setdefault("REPORT_MATE_CACHE_DIR", tempfile.mkdtemp(prefix="report-mate-bench-"))
+os.environ.setdefault("REPORT_MATE_OPENAI_RPM", "0")
+os.environ.setdefault("REPORT_MATE_OPENAI_TPM", "0")
@@ -0,0 +1,310 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from benchmarks.mock_openai import MockOpenAI
+from benchmarks.run import TOPIC, compare, git_revision, paper_set
+from blobs import session_memory
+
+# =========================================================
+# Multi-session load test of app.py
+#   python -m benchmarks.load --sessions 8 -o load.json
+#   python -m benchmarks.load --sessions 8 -o after.json --compare load.json
+# - Each simulated user is a Streamlit AppTest session going through
+#   page load -> upload -> generate -> expand against the local mock server,
+#   all in this process, so they share the job runner, caches, extraction
+#   pool and OpenAI client the way sessions of one server do.
+# - AppTest swaps process-wide Streamlit globals while a script runs, so script
+#   runs are serialized here ("queue" is the wait for that); background jobs,
+#   extraction and API calls still overlap. Job polling reruns the whole
+#   script, not only the progress fragment, so rerun counts are an upper bound.
+# - Cold start is measured in fresh interpreters, with and without the
+#   background warm-up (REPORT_MATE_WARM_UP).
+# =========================================================
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+API_KEY = "sk-load"
+TIMEOUT = 120
+ACTIONS = ("first_load", "upload", "generate", "expand")
+
+_script_lock = threading.Lock()
+
+
+def summarize(values):
+    """Percentiles of a list of milliseconds; median_ms keeps the file comparable with benchmarks.run."""
+    values = sorted(values)
+    if not values:
+        return None
+
+    def pct(p):
+        return round(values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))], 3)
+
+    return {
+        "runs": len(values),
+        "median_ms": pct(50),
+        "p90_ms": pct(90),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+        "min_ms": round(values[0], 3),
+        "max_ms": round(values[-1], 3),
+        "mean_ms": round(statistics.fmean(values), 3),
+    }
+
+
+def rss_bytes():
+    """Resident memory of this process (Linux); None elsewhere. Extraction workers are not included."""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Session:
+    """One simulated user, driven through AppTest; samples collects milliseconds per measurement."""
+
+    def __init__(self, index, items, poll, think, generation_mode, at=None):
+        from streamlit.testing.v1 import AppTest
+
+        self.index = index
+        self.items = items
+        self.poll = poll
+        self.think = think
+        self.generation_mode = generation_mode
+        self.at = at or AppTest.from_file(APP, default_timeout=TIMEOUT)
+        self.samples = defaultdict(list)
+        self.error = None
+        self.memory = None
+
+    def run(self):
+        """One script run; returns the AppTest for chaining."""
+        requested = time.perf_counter()
+        with _script_lock:
+            started = time.perf_counter()
+            self.at.run()
+        finished = time.perf_counter()
+        self.samples["queue"].append((started - requested) * 1000)
+        self.samples["run"].append((finished - started) * 1000)
+        if "rerun_ms" in self.at.session_state:
+            self.samples["rerun"].append(self.at.session_state["rerun_ms"])
+        if self.at.exception:
+            raise RuntimeError(self.at.exception[0].value)
+        return self.at
+
+    def wait_until(self, done):
+        while not done():
+            time.sleep(self.poll)
+            self.run()
+
+    def timed(self, action, fn):
+        started = time.perf_counter()
+        fn()
+        self.samples[action].append((time.perf_counter() - started) * 1000)
+        time.sleep(self.think)
+
+    def first_load(self):
+        self.run()
+
+    def upload(self):
+        at = self.at
+        [w for w in at.sidebar.text_input if w.label == "OpenAI API Key"][0].set_value(API_KEY)
+        [w for w in at.sidebar.toggle if w.label == "응답 캐시 사용"][0].set_value(False)
+        [w for w in at.sidebar.selectbox if w.label == "생성 방식"][0].set_value(self.generation_mode)
+        [w for w in at.text_input if w.label == "연구 주제"][0].set_value(f"{TOPIC[0]} {self.index}")
+        at.file_uploader[0].set_value([(name, data, "application/pdf") for name, data in self.items])
+        self.run()
+        self.wait_until(lambda: self.at.session_state["prefetch"] is None or self.at.session_state["prefetch"].done())
+
+    def click(self, label):
+        [b for b in self.at.button if b.label.startswith(label)][0].click()
+        self.run()
+        self.wait_until(lambda: not self.at.session_state["job_id"])
+        if self.at.error:
+            raise RuntimeError(self.at.error[0].value)
+
+    def generate(self):
+        self.click("🚀")
+        if not self.at.session_state["result"]:
+            raise RuntimeError("generation finished without a result")
+
+    def expand(self):
+        level = self.at.session_state["expansion_level"]
+        self.click("➕")
+        if self.at.session_state["expansion_level"] != level + 1:
+            raise RuntimeError("expansion did not complete")
+
+    def simulate(self):
+        try:
+            for action in ACTIONS:
+                self.timed(action, getattr(self, action))
+            self.memory = session_memory(self.at.session_state)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+
+
+def load_test(mock, sessions, pages, poll, think, ramp, shared_papers, generation_mode):
+    papers = [paper_set(pages, 0 if shared_papers else i + 1) for i in range(sessions)]
+    users = [Session(i, papers[i], poll, think, generation_mode) for i in range(sessions)]
+    rss_before = rss_bytes()
+    requests_before = mock.requests
+    threads = []
+    started = time.perf_counter()
+    for user in users:
+        thread = threading.Thread(target=user.simulate, name=f"load-session-{user.index}")
+        thread.start()
+        threads.append(thread)
+        time.sleep(ramp)
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    rss_after = rss_bytes()
+
+    results = {}
+    for name in ACTIONS + ("rerun", "run", "queue"):
+        stats = summarize([ms for user in users for ms in user.samples[name]])
+        if stats:
+            results[f"load.{name}"] = stats
+    finished = [user for user in users if user.memory is not None]
+    own = [user.memory["own_bytes"] for user in finished]
+    shared = [user.memory["context_share_bytes"] for user in finished]
+    memory = {
+        "rss_before_bytes": rss_before,
+        "rss_after_bytes": rss_after,
+        "rss_per_session_bytes": (rss_after - rss_before) // sessions if rss_before and rss_after else None,
+        "session_state_bytes_median": int(statistics.median(own)) if own else None,
+        "session_state_bytes_max": max(own, default=None),
+        "shared_context_bytes_per_session_median": int(statistics.median(shared)) if shared else None,
+    }
+    load = {
+        "wall_seconds": round(wall, 3),
+        "sessions_completed": len(finished),
+        "errors": [f"session {user.index}: {user.error}" for user in users if user.error],
+        "api_requests": mock.requests - requests_before,
+        "reruns": sum(len(user.samples["run"]) for user in users),
+    }
+    return results, memory, load
+
+
+# Runs in a fresh interpreter; the app's own modules are first imported by the first script run.
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=120)
+at.run()
+loaded = time.perf_counter()
+from benchmarks.load import Session
+from benchmarks.run import paper_set
+user = Session(0, paper_set(int(sys.argv[2]), 10_000), 0.05, float(sys.argv[3]), sys.argv[4], at=at)
+time.sleep(user.think)
+user.timed("upload", user.upload)
+user.timed("generate", user.generate)
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_run_ms": (loaded - imported) * 1000,
+    "upload_ms": user.samples["upload"][0],
+    "generate_ms": user.samples["generate"][0],
+}))
+"""
+
+
+def cold_start(mock, repeat, pages, think, generation_mode):
+    """First page load, upload and generation in fresh interpreters (new cache each), warm-up on and off."""
+    samples = defaultdict(list)
+    for warm in ("1", "0"):
+        for _ in range(repeat):
+            env = dict(
+                os.environ, OPENAI_BASE_URL=mock.base_url, REPORT_MATE_WARM_UP=warm,
+                REPORT_MATE_CACHE_DIR=tempfile.mkdtemp(prefix="report-mate-load-"),
+            )
+            out = subprocess.run(
+                [sys.executable, "-c", _PROBE, APP, str(pages), str(think), generation_mode],
+                capture_output=True, text=True, env=env, timeout=TIMEOUT * 2,
+                cwd=os.path.dirname(APP),
+            )
+            if out.returncode:
+                raise RuntimeError(f"cold-start probe failed:\n{out.stderr[-2000:]}")
+            for name, ms in json.loads(out.stdout.strip().splitlines()[-1]).items():
+                label = "warm_up" if warm == "1" else "no_warm_up"
+                samples[f"cold.{name[:-3]}.{label}"].append(ms)
+    return {name: summarize(values) for name, values in sorted(samples.items())}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-session load test of the Report Mate app.")
+    parser.add_argument("-o", "--output", default="load.json")
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=10, help="pages per synthetic paper (3 papers per session)")
+    parser.add_argument("--mode", default="단일 요청", help="the app's 생성 방식 option")
+    parser.add_argument("--shared-papers", action="store_true", help="every session uploads the same papers")
+    parser.add_argument("--latency", type=float, default=0.3, help="mock server seconds before first byte")
+    parser.add_argument("--poll", type=float, default=0.25, help="seconds between reruns while waiting")
+    parser.add_argument("--think", type=float, default=0.5, help="seconds a user pauses between actions")
+    parser.add_argument("--ramp", type=float, default=0.2, help="seconds between session starts")
+    parser.add_argument("--cold-repeat", type=int, default=3, help="fresh-process runs per warm-up setting; 0 skips")
+    parser.add_argument("--compare", help="earlier load JSON")
+    parser.add_argument("--fail-over", type=float, help="exit 1 if a median is this many percent slower")
+    args = parser.parse_args(argv)
+
+    started = time.time()
+    mock = MockOpenAI(latency=args.latency).start()
+    os.environ["OPENAI_BASE_URL"] = mock.base_url
+    try:
+        results = cold_start(mock, args.cold_repeat, args.pages, args.think, args.mode) if args.cold_repeat else {}
+        load_results, memory, load = load_test(
+            mock, args.sessions, args.pages, args.poll, args.think, args.ramp, args.shared_papers, args.mode
+        )
+        results.update(load_results)
+    finally:
+        mock.stop()
+
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": {
+                key: getattr(args, key)
+                for key in ("sessions", "pages", "mode", "shared_papers", "latency", "poll", "think", "ramp")
+            },
+        },
+        "load": load,
+        "memory": memory,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, ensure_ascii=False, indent=2)
+    print(f"wrote {len(results)} measurements to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        regressions = compare(baseline, report, args.fail_over)
+        if regressions:
+            print(f"{len(regressions)} measurement(s) slower than {args.fail_over}%", file=sys.stderr)
+            return 1
+    else:
+        print(f"{'measurement':<34} {'p50':>10} {'p95':>10} {'max':>10}")
+        for name, stats in results.items():
+            print(f"{name:<34} {stats['median_ms']:>8.1f}ms {stats['p95_ms']:>8.1f}ms {stats['max_ms']:>8.1f}ms")
+    print(
+        f"{load['sessions_completed']}/{args.sessions} sessions in {load['wall_seconds']:.1f}s · "
+        f"{load['reruns']} reruns · {load['api_requests']} API requests", file=sys.stderr,
+    )
+    for error in load["errors"]:
+        print(error, file=sys.stderr)
+    return 1 if load["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
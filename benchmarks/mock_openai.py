@@ -0,0 +1,211 @@
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pipeline import DRAFT_OUTLINE
+
+# =========================================================
+# Local mock of the chat-completions endpoint
+# - Answers the app's draft / section / outline / expansion / subsection /
+#   notes prompts with well-formed JSON of the requested shape, citing
+#   [SOURCE/PAGE] markers found in the prompt, so merge and render code sees
+#   realistic output.
+# - latency: seconds before the first byte; chunk_delay: seconds between
+#   streamed chunks of chunk_chars characters.
+# - truncate_every: cut every n-th reply in half (finish_reason "length"),
+#   to exercise JSON repair and follow-up requests; 0 never does.
+# - Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1
+# =========================================================
+_SOURCE = re.compile(r"\[SOURCE: (.+?), PAGE: (\d+)\]")
+_SCOPE = re.compile(r"'(.+?)' 섹션의 다음 소절만 작성: (.+)")
+_EXPAND_SUBSECTION = re.compile(r'^\s*"(\d\.\d)": \[', re.MULTILINE)
+_PARAS = re.compile(r"최소 (\d+)개 문단")
+_ADD_PARAS = re.compile(r"새 문단을 (\d+)개씩")
+_MIN_CHARS = re.compile(r"최소 (\d+)자 이상")
+_NOTE_PAGE = re.compile(r"^\[PAGE: (\d+)\]$", re.MULTILINE)
+
+_FILLER = (
+    "선행연구는 생성형 인공지능이 학술적 글쓰기의 계획과 수정 단계에 서로 다른 방식으로 관여한다고 보고하며, "
+    "이러한 차이는 학습자의 자기효능감과 피드백 활용 방식에 따라 조절되는 것으로 해석된다. "
+)
+
+
+def _paragraph(min_chars, refs):
+    body = (_FILLER * (min_chars // len(_FILLER) + 1))[:min_chars]
+    return body + " " + " ".join(refs)
+
+
+class _Responder:
+    def __init__(self, prompt):
+        self.prompt = prompt
+        self.sources = _SOURCE.findall(prompt) or [("source.pdf", "1")]
+        self.min_chars = int((_MIN_CHARS.findall(prompt) or ["200"])[0])
+        self.source_map = {}
+        self.wants_source_map = '"source_map"' in prompt
+        self.cursor = 0
+
+    def refs(self, n=2):
+        tags = []
+        for _ in range(n):
+            name, page = self.sources[self.cursor % len(self.sources)]
+            self.cursor += 1
+            tag = f"[REF:{name},p{page}]"
+            if self.wants_source_map:
+                self.source_map[tag] = f"{name} {page}쪽의 핵심 근거 요약"
+            tags.append(tag)
+        return tags
+
+    def section_text(self, subsections, paras):
+        blocks = []
+        for sub in subsections:
+            body = "\n\n".join(_paragraph(self.min_chars, self.refs()) for _ in range(paras))
+            blocks.append(f"{sub}\n{body}")
+        return "\n\n".join(blocks)
+
+    def document(self):
+        if '"notes"' in self.prompt:
+            pages = _NOTE_PAGE.findall(self.prompt) or ["1"]
+            return {"notes": [{"page": int(page), "note": f"{page}쪽의 연구 목적·방법·주요 결과 요약."} for page in pages]}
+
+        if "rewritten_paragraphs" in self.prompt:
+            paras = int((_PARAS.findall(self.prompt) or ["2"])[0])
+            numbers = _EXPAND_SUBSECTION.findall(self.prompt)
+            rewritten = {num: [_paragraph(self.min_chars, self.refs()) for _ in range(paras)] for num in numbers}
+            return self.with_source_map({"rewritten_paragraphs": rewritten})
+
+        if "new_paragraphs" in self.prompt:
+            add = int((_ADD_PARAS.findall(self.prompt) or ["1"])[0])
+            numbers = _EXPAND_SUBSECTION.findall(self.prompt)
+            new = {num: [_paragraph(self.min_chars, self.refs()) for _ in range(add)] for num in numbers}
+            return self.with_source_map({"new_paragraphs": new})
+
+        paras = int((_PARAS.findall(self.prompt) or ["2"])[0])
+        scope = _SCOPE.search(self.prompt)
+        if scope:
+            section, subsections = scope.group(1), [s.strip() for s in scope.group(2).split(",")]
+            outline = {} if '"detailed_outline": {}' in self.prompt else {section: "섹션 전개 전략 요약. " * 6}
+            draft = {section: self.section_text(subsections, paras)}
+        elif "interactive_draft" not in self.prompt:
+            return {"detailed_outline": {section: "섹션 전개 전략 요약. " * 6 for section in DRAFT_OUTLINE}}
+        else:
+            outline = {section: "섹션 전개 전략 요약. " * 6 for section in DRAFT_OUTLINE}
+            draft = {section: self.section_text(subs, paras) for section, subs in DRAFT_OUTLINE.items()}
+        return self.with_source_map({"detailed_outline": outline, "interactive_draft": draft})
+
+    def with_source_map(self, document):
+        if self.wants_source_map:
+            document["source_map"] = self.source_map
+        return document
+
+
+class MockOpenAI:
+    def __init__(self, latency=0.0, chunk_delay=0.0, chunk_chars=24, port=0, truncate_every=0):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_chars = chunk_chars
+        self.truncate_every = truncate_every
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with mock._lock:
+                    mock.requests += 1
+                    truncate = bool(mock.truncate_every) and mock.requests % mock.truncate_every == 0
+                prompt = "\n".join(m["content"] for m in body["messages"])
+                content = json.dumps(_Responder(prompt).document(), ensure_ascii=False)
+                if truncate:
+                    content = content[:len(content) // 2]
+                usage = {
+                    "prompt_tokens": len(prompt) // 2,
+                    "completion_tokens": len(content) // 2,
+                    "total_tokens": (len(prompt) + len(content)) // 2,
+                }
+                time.sleep(mock.latency)
+                if body.get("stream"):
+                    self._stream(body["model"], content, usage)
+                else:
+                    self._send_json({
+                        "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                     "finish_reason": "length" if truncate else "stop"}],
+                        "usage": usage,
+                    })
+
+            def _send_json(self, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, model, content, usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                base = {"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+                for i in range(0, len(content), mock.chunk_chars):
+                    delta = {"index": 0, "delta": {"content": content[i:i + mock.chunk_chars]}, "finish_reason": None}
+                    self._event(dict(base, choices=[delta]))
+                    if mock.chunk_delay:
+                        time.sleep(mock.chunk_delay)
+                self._event(dict(base, choices=[], usage=usage))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+            def _event(self, payload):
+                self.wfile.write(b"data: " + json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mock OpenAI chat-completions server for Report Mate.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the first byte")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="seconds between streamed chunks")
+    parser.add_argument("--chunk-chars", type=int, default=24)
+    parser.add_argument("--truncate-every", type=int, default=0, help="cut every n-th reply in half")
+    args = parser.parse_args(argv)
+    mock = MockOpenAI(args.latency, args.chunk_delay, args.chunk_chars, args.port, args.truncate_every).start()
+    print(f"OPENAI_BASE_URL={mock.base_url}")
+    try:
+        mock._thread.join()
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+from benchmarks.mock_openai import MockOpenAI
+from benchmarks.synthetic_pdf import synthetic_pdf
+from budget import TokenCounter
+from draft_text import parse_ref_segments
+from jobs import Job
+from json_stream import IncrementalJSONParser
+from pipeline import (
+    RETRIEVAL_MAX_PAGES_EACH,
+    build_initial_prompt,
+    get_combined_text_with_meta,
+    plan_expand_requests,
+    plan_section_requests,
+    retrieval_queries,
+    run_expand_job,
+    run_generate_job,
+)
+
+# =========================================================
+# Offline benchmark suite
+#   python -m benchmarks.run -o baseline.json
+#   python -m benchmarks.run -o after.json --compare baseline.json
+# - Synthetic Korean/English PDFs, a local mock chat-completions server, no
+#   network. Results are JSON (median/min/mean ms per benchmark) and can be
+#   compared against an earlier run.
+# =========================================================
+MODEL = "gpt-4o-mini"
+TOPIC = ("생성형 인공지능 학술적 글쓰기", "대학생의 글쓰기 과정에 미치는 영향 규명", "피드백 활용이 자기효능감을 높인다")
+INPUTS = {
+    "topic": TOPIC[0],
+    "purpose": TOPIC[1],
+    "hypothesis": TOPIC[2],
+    "base_paras": 2,
+    "min_chars_per_para": 200,
+    "tone_setting": "Academic",
+    "model_name": MODEL,
+}
+CONTEXT_TOKENS = 12000
+
+
+def paper_set(pages, seed):
+    """Three papers (Korean, English, mixed) of the given length."""
+    return [(f"{lang}-{seed}.pdf", synthetic_pdf(pages, lang, seed)) for lang in ("ko", "en", "mixed")]
+
+
+def measure(fn, repeat, setup=None):
+    """Time fn(setup(i)) repeat times; setup runs outside the timed region."""
+    times = []
+    for i in range(repeat):
+        arg = setup(i) if setup else None
+        started = time.perf_counter()
+        fn(arg)
+        times.append((time.perf_counter() - started) * 1000)
+    return {
+        "runs": repeat,
+        "median_ms": round(statistics.median(times), 3),
+        "min_ms": round(min(times), 3),
+        "mean_ms": round(statistics.fmean(times), 3),
+        "max_ms": round(max(times), 3),
+    }
+
+
+def context_benchmarks(pages_list, repeat):
+    results = {}
+    queries = retrieval_queries(*TOPIC)
+    seeds = iter(range(1, 1_000_000))
+    get_combined_text_with_meta(paper_set(2, 0), max_tokens=CONTEXT_TOKENS, model=MODEL)  # start the pool
+
+    for pages in pages_list:
+        warm = paper_set(pages, 0)
+        for mode, kwargs in (
+            ("sequential", {"max_pages_each": 10}),
+            ("retrieval", {"max_pages_each": RETRIEVAL_MAX_PAGES_EACH, "queries": queries}),
+        ):
+            def run(items, kwargs=kwargs):
+                get_combined_text_with_meta(items, max_tokens=CONTEXT_TOKENS, model=MODEL, **kwargs)
+
+            # Cold: never-seen PDFs (new seed each run), so nothing is cached.
+            results[f"context.{mode}.cold.{pages}p"] = measure(run, repeat, lambda i: paper_set(pages, next(seeds)))
+            run(warm)
+            results[f"context.{mode}.warm.{pages}p"] = measure(run, repeat, lambda i: warm)
+    return results
+
+
+def sample_context(pages):
+    return get_combined_text_with_meta(
+        paper_set(pages, 0), max_pages_each=RETRIEVAL_MAX_PAGES_EACH, queries=retrieval_queries(*TOPIC),
+        max_tokens=CONTEXT_TOKENS, model=MODEL,
+    )
+
+
+def prompt_benchmarks(context, result, repeat):
+    args = (TOPIC[0], TOPIC[1], TOPIC[2], context, 2, 200, "Academic")
+    return {
+        "prompt.initial": measure(lambda _: build_initial_prompt(*args), repeat),
+        "prompt.section_requests": measure(lambda _: plan_section_requests(*args, "section"), repeat),
+        "prompt.subsection_requests": measure(lambda _: plan_section_requests(*args, "subsection"), repeat),
+        "prompt.expand_requests": measure(
+            lambda _: plan_expand_requests(*TOPIC, context, result, 1, 200, "Academic", MODEL), repeat
+        ),
+        "tokens.count_context": measure(lambda _: TokenCounter(MODEL).count(context), repeat),
+    }
+
+
+def parse_benchmarks(result, repeat):
+    document = json.dumps(result, ensure_ascii=False)
+    chunks = [document[i:i + 24] for i in range(0, len(document), 24)]
+
+    def incremental(_):
+        parser = IncrementalJSONParser(on_value=lambda path, value: None)
+        for chunk in chunks:
+            parser.feed(chunk)
+
+    texts = list(result["interactive_draft"].values())
+
+    def segments_uncached(_):
+        for text in texts:
+            parse_ref_segments.__wrapped__(text)
+
+    def segments_cached(_):
+        for text in texts:
+            parse_ref_segments(text)
+
+    return {
+        "json.loads.draft": measure(lambda _: json.loads(document), repeat),
+        "json.incremental.draft": measure(incremental, repeat),
+        "segments.parse.uncached": measure(segments_uncached, repeat),
+        "segments.parse.cached": measure(segments_cached, repeat),
+    }
+
+
+def e2e_benchmarks(mock, pages, repeat):
+    items = paper_set(pages, 0)
+    results = {}
+    generated = None
+    for name, granularity, stream, source_map, condense_model in (
+        ("single", None, False, True, None),
+        ("single.stream", None, True, True, None),
+        ("single.local_sources", None, False, False, None),
+        ("single.mapreduce", None, False, True, "gpt-4o-mini"),
+        ("section", "section", False, True, None),
+        ("subsection", "subsection", False, True, None),
+    ):
+        def run(_, granularity=granularity, stream=stream, source_map=source_map, condense_model=condense_model):
+            nonlocal generated
+            job = Job(uuid.uuid4().hex, "generate")
+            generated = run_generate_job(
+                job, "sk-bench", job.session, items, INPUTS, True, granularity, 4, CONTEXT_TOKENS, stream, False,
+                source_map, condense_model,
+            )["state"]
+
+        before = mock.requests
+        results[f"e2e.generate.{name}"] = measure(run, repeat)
+        results[f"e2e.generate.{name}"]["requests_per_run"] = (mock.requests - before) / repeat
+
+    def expand(_):
+        job = Job(uuid.uuid4().hex, "expand")
+        run_expand_job(
+            job, "sk-bench", job.session, INPUTS, generated["context"].text, generated["result"], 0, 1, 200, 4, False
+        )
+
+    before = mock.requests
+    results["e2e.expand"] = measure(expand, repeat)
+    results["e2e.expand"]["requests_per_run"] = (mock.requests - before) / repeat
+    return results, generated
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, fail_over):
+    """Print per-benchmark median changes; returns the names slower than fail_over percent."""
+    regressions = []
+    print(f"{'benchmark':<40} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, stats in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<40} {'-':>12} {stats['median_ms']:>10.2f}ms {'new':>9}")
+            continue
+        change = (stats["median_ms"] - base["median_ms"]) / base["median_ms"] * 100 if base["median_ms"] else 0.0
+        flag = ""
+        if fail_over is not None and change > fail_over:
+            regressions.append(name)
+            flag = "  << slower"
+        print(f"{name:<40} {base['median_ms']:>10.2f}ms {stats['median_ms']:>10.2f}ms {change:>+8.1f}%{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline Report Mate benchmarks.")
+    parser.add_argument("-o", "--output", default="bench.json")
+    parser.add_argument("--pages", default="10,60", help="comma-separated pages per synthetic paper")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05, help="mock server seconds before first byte")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="mock server seconds between stream chunks")
+    parser.add_argument("--skip-e2e", action="store_true")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    parser.add_argument("--fail-over", type=float, help="exit 1 if a median is this many percent slower")
+    args = parser.parse_args(argv)
+    pages_list = [int(p) for p in args.pages.split(",")]
+
+    started = time.time()
+    mock = MockOpenAI(latency=args.latency, chunk_delay=args.chunk_delay).start()
+    os.environ["OPENAI_BASE_URL"] = mock.base_url
+    try:
+        results = context_benchmarks(pages_list, args.repeat)
+        context = sample_context(max(pages_list))
+        if args.skip_e2e:
+            job = Job("bench", "generate")
+            generated = run_generate_job(
+                job, "sk-bench", "bench", paper_set(max(pages_list), 0), INPUTS, True, "section", 4,
+                CONTEXT_TOKENS, False, False,
+            )["state"]
+        else:
+            e2e, generated = e2e_benchmarks(mock, max(pages_list), args.repeat)
+            results.update(e2e)
+        results.update(prompt_benchmarks(context, generated["result"], args.repeat))
+        results.update(parse_benchmarks(generated["result"], args.repeat))
+    finally:
+        mock.stop()
+
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "exact_tokenizer": TokenCounter(MODEL).exact,
+            "config": {
+                "pages": pages_list,
+                "repeat": args.repeat,
+                "latency": args.latency,
+                "chunk_delay": args.chunk_delay,
+                "context_tokens": CONTEXT_TOKENS,
+            },
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, ensure_ascii=False, indent=2)
+    print(f"wrote {len(results)} benchmarks to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        regressions = compare(baseline, report, args.fail_over)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) slower than {args.fail_over}%", file=sys.stderr)
+            return 1
+    else:
+        for name, stats in results.items():
+            print(f"{name:<40} {stats['median_ms']:>10.2f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
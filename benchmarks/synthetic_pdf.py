@@ -0,0 +1,124 @@
+import random
+import zlib
+
+# =========================================================
+# Synthetic PDFs for benchmarks
+# - Text-only PDFs built by hand (no reportlab/fonts needed). All text uses one
+#   Type0 font with Identity-H encoding and a ToUnicode CMap, so pypdf extracts
+#   Korean and English alike; CIDs are simply the Unicode code points.
+# - Deterministic for a given seed, so runs are comparable.
+# =========================================================
+KO_WORDS = (
+    "생성형 인공지능 대학생 학술적 글쓰기 선행연구 연구모형 가설 검증 표본 설문 측정 도구 신뢰도 타당도 "
+    "분석 결과 효과 영향 매개 조절 변수 이론적 배경 한계 시사점 교육 현장 피드백 자기효능감 동기 "
+    "표절 윤리 평가 수업 설계 학습자 교수자 인식 태도 활용 빈도 역량 비판적 사고 논증 구조 문헌 검토"
+).split()
+EN_WORDS = (
+    "generative artificial intelligence student academic writing prior research model hypothesis test sample "
+    "survey measurement instrument reliability validity analysis result effect influence mediation moderation "
+    "variable theory limitation implication education feedback self-efficacy motivation plagiarism ethics "
+    "assessment course design learner instructor perception attitude usage frequency competence critical thinking"
+).split()
+
+LINES_PER_PAGE = 38
+WORDS_PER_LINE = {"ko": 9, "en": 12}
+
+
+def synthetic_pages(n_pages, lang="ko", seed=0):
+    """Page texts for a synthetic paper; lang is "ko", "en" or "mixed" (alternating pages)."""
+    rng = random.Random(f"{lang}:{seed}")
+    pages = []
+    for page_no in range(n_pages):
+        page_lang = lang if lang != "mixed" else ("ko", "en")[page_no % 2]
+        words = KO_WORDS if page_lang == "ko" else EN_WORDS
+        lines = []
+        for _ in range(LINES_PER_PAGE):
+            line = " ".join(rng.choice(words) for _ in range(WORDS_PER_LINE[page_lang]))
+            lines.append(line + ("." if rng.random() < 0.3 else ""))
+        pages.append("\n".join(lines))
+    return pages
+
+
+def synthetic_pdf(n_pages, lang="ko", seed=0):
+    return make_pdf(synthetic_pages(n_pages, lang, seed))
+
+
+def _to_unicode_cmap(chars):
+    entries = sorted(ord(ch) for ch in chars if ord(ch) <= 0xFFFF)
+    blocks = []
+    for i in range(0, len(entries), 100):
+        block = entries[i:i + 100]
+        blocks.append(f"{len(block)} beginbfchar\n")
+        blocks.extend(f"<{cid:04X}> <{cid:04X}>\n" for cid in block)
+        blocks.append("endbfchar\n")
+    return (
+        "/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n"
+        "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n"
+        "/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n"
+        "1 begincodespacerange\n<0000> <FFFF>\nendcodespacerange\n"
+        + "".join(blocks)
+        + "endcmap\nCMapName currentdict /CMap defineresource pop\nend\nend\n"
+    ).encode("ascii")
+
+
+def _stream(data, compress=True):
+    if compress:
+        data = zlib.compress(data)
+        return b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(data) + data + b"\nendstream"
+    return b"<< /Length %d >>\nstream\n" % len(data) + data + b"\nendstream"
+
+
+def _page_content(text):
+    ops = ["BT", "/F1 10 Tf", "12 TL", "50 760 Td"]
+    for line in text.split("\n"):
+        hexed = "".join(f"{ord(ch):04X}" for ch in line if ord(ch) <= 0xFFFF)
+        ops.append(f"<{hexed}> Tj T*")
+    ops.append("ET")
+    return "\n".join(ops).encode("ascii")
+
+
+def make_pdf(pages):
+    """A minimal PDF with one page per text in pages."""
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    chars = set("".join(pages))
+    cmap = add(_stream(_to_unicode_cmap(chars)))
+    descriptor = add(
+        b"<< /Type /FontDescriptor /FontName /Synthetic /Flags 4 /FontBBox [0 -200 1000 900] "
+        b"/ItalicAngle 0 /Ascent 880 /Descent -120 /CapHeight 700 /StemV 80 >>"
+    )
+    cid_font = add(
+        b"<< /Type /Font /Subtype /CIDFontType2 /BaseFont /Synthetic "
+        b"/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> "
+        b"/FontDescriptor %d 0 R /DW 1000 /CIDToGIDMap /Identity >>" % descriptor
+    )
+    font = add(
+        b"<< /Type /Font /Subtype /Type0 /BaseFont /Synthetic /Encoding /Identity-H "
+        b"/DescendantFonts [%d 0 R] /ToUnicode %d 0 R >>" % (cid_font, cmap)
+    )
+
+    pages_id = len(objects) + 2 * len(pages) + 1
+    kids = []
+    for text in pages:
+        content = add(_stream(_page_content(text)))
+        kids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font, content)
+        ))
+    add(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in kids), len(kids)))
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    return bytes(out)
@@ -0,0 +1,288 @@
+import hashlib
+import io
+import mmap
+import os
+import sys
+import tempfile
+import threading
+import time
+import weakref
+
+from cache import content_hash
+
+# =========================================================
+# Low-memory uploads and shared session context
+# - Uploads of SPILL_MIN_BYTES or more are written once to a content-addressed
+#   temp file and read through mmap (MappedFile) instead of being copied into
+#   new bytes objects. A MappedFile pickles as its path, so extraction workers
+#   map the file themselves rather than receiving the PDF through a pipe.
+#   Spills unused for SPILL_TTL_SECONDS are pruned, except those a live
+#   MappedFile in this process still points at; opening one refreshes its mtime.
+# - Extracted context text lives in one process-wide, reference-counted store
+#   keyed by its hash; session_state only holds a ContextHandle. Sessions that
+#   upload the same papers share one copy, which is dropped with the last handle.
+# =========================================================
+SPILL_DIR = os.environ.get("REPORT_MATE_SPILL_DIR", os.path.join(tempfile.gettempdir(), "report-mate-uploads"))
+SPILL_MIN_BYTES = int(os.environ.get("REPORT_MATE_SPILL_MIN_KB", "256")) * 1024
+SPILL_TTL_SECONDS = float(os.environ.get("REPORT_MATE_SPILL_TTL_HOURS", "24")) * 3600
+SPILL_WRITE_CHUNK = 1024 * 1024
+
+
+class SpillMissing(FileNotFoundError):
+    """A spilled upload whose temp file is gone; the file has to be uploaded again."""
+
+
+class MappedFile:
+    """A PDF on disk read in place through mmap; cache.content_hash uses its digest.
+
+    spilled marks a temp copy made by spill_upload (as opposed to a file the user owns).
+    """
+
+    def __init__(self, path, digest=None, size=None, spilled=False):
+        self.path = path
+        self.size = os.path.getsize(path) if size is None else size
+        self.digest = digest or _hash_file(path, self.size)
+        self.spilled = spilled
+        if spilled:
+            _live_spills.add(self)
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return f"MappedFile({self.path!r}, size={self.size})"
+
+    def open(self):
+        """A read-only, seekable stream over the file; close it (or use it in a with block) when done."""
+        if not self.size:
+            return io.BytesIO(b"")
+        try:
+            fh = open(self.path, "rb")
+        except FileNotFoundError:
+            if not self.spilled:
+                raise
+            raise SpillMissing("업로드한 파일의 임시 사본이 정리되었습니다. 파일을 다시 업로드해주세요.") from None
+        with fh:
+            if self.spilled:
+                _touch(self.path)
+            return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+_live_spills = weakref.WeakSet()
+
+
+def _touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def spill_exists(data):
+    """False only for a spilled MappedFile whose temp file has been removed."""
+    return not getattr(data, "spilled", False) or os.path.exists(data.path)
+
+
+def _hash_file(path, size):
+    if not size:
+        return content_hash(b"")
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        return content_hash(view)
+
+
+def spill_upload(upload):
+    """(name, data) for a Streamlit UploadedFile without copying large uploads.
+
+    Small files are returned as bytes; larger ones as a MappedFile over a temp
+    file named by the content hash, so the same paper is written once per host.
+    """
+    view = upload.getbuffer()
+    try:
+        if view.nbytes < SPILL_MIN_BYTES:
+            return upload.name, bytes(view)
+        digest = hashlib.sha256(view).hexdigest()
+        path = os.path.join(SPILL_DIR, f"{digest}.pdf")
+        try:
+            if os.path.exists(path):
+                os.utime(path)
+            else:
+                _write_spill(path, view)
+                _prune_spills()
+        except OSError:
+            return upload.name, bytes(view)
+        return upload.name, MappedFile(path, digest, view.nbytes, spilled=True)
+    finally:
+        view.release()
+
+
+def _write_spill(path, view):
+    os.makedirs(SPILL_DIR, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as fh:
+        for start in range(0, view.nbytes, SPILL_WRITE_CHUNK):
+            fh.write(view[start:start + SPILL_WRITE_CHUNK])
+    os.replace(tmp, path)
+
+
+def _prune_spills():
+    """Delete spilled uploads unused for SPILL_TTL_SECONDS (open mappings stay valid).
+
+    Files a live MappedFile still points at are kept, however old, so a long-lived
+    session can go on reading its uploads.
+    """
+    cutoff = time.time() - SPILL_TTL_SECONDS
+    live = {mapped.path for mapped in list(_live_spills)}
+    try:
+        entries = list(os.scandir(SPILL_DIR))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.path not in live and entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def spill_stats():
+    files = total = 0
+    try:
+        for entry in os.scandir(SPILL_DIR):
+            if entry.is_file() and entry.name.endswith(".pdf"):
+                files += 1
+                total += entry.stat().st_size
+    except OSError:
+        pass
+    return {"files": files, "bytes": total}
+
+
+# =========================================================
+# Shared context store
+# =========================================================
+class ContextHandle:
+    """What a session keeps instead of its context text; releases its reference when collected."""
+
+    def __init__(self, store, digest):
+        self.digest = digest
+        self._store = store
+        self._release = weakref.finalize(self, store._release, digest)
+
+    @property
+    def text(self):
+        return self._store.get(self.digest)
+
+    @property
+    def size(self):
+        return self._store.size(self.digest)
+
+    @property
+    def shared_by(self):
+        return self._store.refs(self.digest)
+
+    def release(self):
+        self._release()
+
+    def __repr__(self):
+        return f"ContextHandle({self.digest[:12]})"
+
+
+class ContextStore:
+    """Content-addressed, reference-counted text shared by every session in the process."""
+
+    def __init__(self):
+        self._entries = {}  # digest -> [text, references]
+        self._lock = threading.Lock()
+        self.stats = {"puts": 0, "shared": 0}
+
+    def put(self, text):
+        digest = content_hash(text.encode("utf-8"))
+        with self._lock:
+            self.stats["puts"] += 1
+            entry = self._entries.get(digest)
+            if entry is None:
+                self._entries[digest] = [text, 1]
+            else:
+                self.stats["shared"] += 1
+                entry[1] += 1
+        return ContextHandle(self, digest)
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+        return entry[0] if entry else ""
+
+    def size(self, digest):
+        return sys.getsizeof(self.get(digest))
+
+    def refs(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+        return entry[1] if entry else 0
+
+    def _release(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._entries[digest]
+
+    def summary(self):
+        """Entries, bytes held, handles, and bytes saved by sharing."""
+        with self._lock:
+            entries = [(sys.getsizeof(text), refs) for text, refs in self._entries.values()]
+        return {
+            "entries": len(entries),
+            "bytes": sum(size for size, _ in entries),
+            "handles": sum(refs for _, refs in entries),
+            "saved_bytes": sum(size * (refs - 1) for size, refs in entries),
+        }
+
+
+_context_store = ContextStore()
+
+
+def get_context_store():
+    return _context_store
+
+
+# =========================================================
+# Per-session memory accounting
+# =========================================================
+def deep_size(obj, _seen=None):
+    """Approximate bytes held by obj and the containers/strings inside it; shared objects count once."""
+    seen = set() if _seen is None else _seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(v, seen) for v in obj)
+    return size
+
+
+def session_memory(state):
+    """Bytes held by one session's state, plus its share of the shared context.
+
+    state is any mapping (st.session_state or a dict). by_key lists what the
+    session holds on its own, largest first; a ContextHandle counts only as a
+    handle there, and its text is reported as context_bytes / context_sessions.
+    """
+    by_key, context = {}, None
+    seen = set()
+    for key, value in state.items():
+        by_key[str(key)] = deep_size(value, seen)
+        if isinstance(value, ContextHandle):
+            context = value
+    context_bytes = context.size if context else 0
+    context_sessions = context.shared_by if context else 0
+    return {
+        "own_bytes": sum(by_key.values()),
+        "by_key": sorted(by_key.items(), key=lambda kv: -kv[1]),
+        "context_bytes": context_bytes,
+        "context_sessions": context_sessions,
+        "context_share_bytes": context_bytes // context_sessions if context_sessions else 0,
+    }
@@ -0,0 +1,152 @@
+import threading
+
+# =========================================================
+# Context budgeting (tokens, not characters)
+# - Korean and English tokenize very differently, so the context budget is
+#   planned in model tokens, counted locally with tiktoken when available.
+# - Without tiktoken (or its encoding files) a conservative per-script
+#   estimate is used instead.
+# =========================================================
+MODEL_LIMITS = [
+    # (model name prefix, context window, max output tokens)
+    ("gpt-4.1", 1047576, 32768),
+    ("gpt-4o", 128000, 16384),
+    ("gpt-4-turbo", 128000, 4096),
+    ("gpt-4", 8192, 4096),
+    ("gpt-3.5-turbo", 16385, 4096),
+    ("o1", 200000, 100000),
+    ("o3", 200000, 100000),
+    ("o4", 200000, 100000),
+]
+DEFAULT_LIMITS = (128000, 16384)
+
+SAFETY_MARGIN_TOKENS = 512
+CHAT_OVERHEAD_TOKENS = 3  # per message, plus once for the reply priming
+
+_KO_SAMPLE = (
+    "본 연구는 생성형 인공지능이 대학생의 학술적 글쓰기 과정에 미치는 영향을 선행연구를 바탕으로 "
+    "검토하고, 연구 공백을 규명하여 향후 연구모형 설계에 대한 시사점을 도출하고자 한다."
+)
+
+
+def model_limits(model):
+    name = (model or "").lower()
+    for prefix, window, max_output in MODEL_LIMITS:
+        if name.startswith(prefix):
+            return window, max_output
+    return DEFAULT_LIMITS
+
+
+class CharCounter:
+    """Character budget (the original behaviour)."""
+
+    unit = "chars"
+    min_chunk = 200
+
+    def count(self, text):
+        return len(text)
+
+    def truncate(self, text, n):
+        return text[:max(0, n)]
+
+
+class TokenCounter:
+    unit = "tokens"
+    min_chunk = 64
+
+    def __init__(self, model):
+        self.model = model
+        self.encoding = _encoding_for(model)
+
+    @property
+    def exact(self):
+        return self.encoding is not None
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return _estimate_tokens(text)
+
+    def truncate(self, text, n):
+        if n <= 0:
+            return ""
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            if len(tokens) <= n:
+                return text
+            return self.encoding.decode(tokens[:n])
+        # Estimate-based: shrink proportionally, then trim until it fits.
+        total = _estimate_tokens(text)
+        if total <= n:
+            return text
+        cut = text[:int(len(text) * n / total)]
+        while cut and _estimate_tokens(cut) > n:
+            cut = cut[:int(len(cut) * 0.95)]
+        return cut
+
+
+def _estimate_tokens(text):
+    hangul = sum(1 for ch in text if "가" <= ch <= "힣")
+    other = len(text) - hangul
+    return int(hangul * 1.0 + other / 3.5) + 1
+
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def _encoding_for(model):
+    with _encodings_lock:
+        if model in _encodings:
+            return _encodings[model]
+    try:
+        import tiktoken
+
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+    except Exception:
+        encoding = None
+    with _encodings_lock:
+        _encodings[model] = encoding
+    return encoding
+
+
+def count_messages(counter, messages):
+    return sum(counter.count(m["content"]) + CHAT_OVERHEAD_TOKENS for m in messages) + CHAT_OVERHEAD_TOKENS
+
+
+def plan_budget(model, template_tokens, expected_output_tokens, max_input_tokens=None):
+    """Split the model's context window into template / reserved output / context input.
+
+    Returns a dict describing the plan; "input_budget_tokens" is what the [자료 원문] block
+    may use, capped by max_input_tokens when given.
+    """
+    window, max_output = model_limits(model)
+    reserved_output = min(expected_output_tokens, max_output)
+    available = window - template_tokens - reserved_output - SAFETY_MARGIN_TOKENS
+    input_budget = max(0, available if max_input_tokens is None else min(available, max_input_tokens))
+    return {
+        "model": model,
+        "context_window": window,
+        "template_tokens": template_tokens,
+        "reserved_output_tokens": reserved_output,
+        "input_budget_tokens": input_budget,
+    }
+
+
+def expected_output_tokens(counter, n_subsections, paras_per_subsection, min_chars_per_para, with_source_map=True):
+    """Estimate output size of a draft in tokens from the requested shape.
+
+    Models tend to overshoot the minimum paragraph length, so 1.3x is assumed.
+    """
+    ko_ratio = counter.count(_KO_SAMPLE) / len(_KO_SAMPLE)
+    paragraphs = n_subsections * paras_per_subsection
+    chars = paragraphs * min_chars_per_para * 1.3
+    chars += 4 * 600  # detailed_outline: 6~10 sentences per section
+    if with_source_map:
+        chars += paragraphs * 1.5 * 150
+    return int(chars * ko_ratio) + 200
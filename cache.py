@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# =========================================================
+# Shared two-tier (memory + disk) text cache
+# - Lives in an imported module so it is shared by every Streamlit session
+#   in the process (app.py itself is re-executed on every rerun).
+# =========================================================
+DEFAULT_CACHE_DIR = os.environ.get(
+    "REPORT_MATE_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "report-mate"),
+)
+
+
+def content_hash(data) -> str:
+    """sha256 of bytes-like data; a blobs.MappedFile already carries its digest."""
+    digest = getattr(data, "digest", None)
+    if isinstance(digest, str):
+        return digest
+    return hashlib.sha256(data).hexdigest()
+
+
+class TieredCache:
+    """Thread-safe LRU cache of text values with a memory tier and a disk tier.
+
+    Both tiers are bounded in bytes. The memory tier evicts least recently used
+    entries; the disk tier evicts by file mtime, which is refreshed on every hit.
+    """
+
+    def __init__(self, directory, max_memory_bytes=64 * 1024 * 1024, max_disk_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._mem = OrderedDict()
+        self._mem_bytes = 0
+        self._disk_bytes = None
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0}
+
+    # ---------- public API ----------
+    def get(self, key):
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return self._mem[key][0]
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fh:
+                raw = fh.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+
+        value = raw.decode("utf-8")
+        with self._lock:
+            self.stats["disk_hits"] += 1
+            self._remember(key, value, len(raw))
+        return value
+
+    def put(self, key, value):
+        raw = value.encode("utf-8")
+        with self._lock:
+            self._remember(key, value, len(raw))
+            self.stats["writes"] += 1
+        self._write_disk(key, raw)
+
+    def delete(self, key):
+        with self._lock:
+            old = self._mem.pop(key, None)
+            if old is not None:
+                self._mem_bytes -= old[1]
+        try:
+            size = os.path.getsize(self._path(key))
+            os.remove(self._path(key))
+        except OSError:
+            return
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes -= size
+
+    def clear_memory(self):
+        with self._lock:
+            self._mem.clear()
+            self._mem_bytes = 0
+
+    # ---------- memory tier ----------
+    def _remember(self, key, value, size):
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._mem_bytes -= old[1]
+        if size > self.max_memory_bytes:
+            return
+        self._mem[key] = (value, size)
+        self._mem_bytes += size
+        while self._mem_bytes > self.max_memory_bytes:
+            _, (_, evicted) = self._mem.popitem(last=False)
+            self._mem_bytes -= evicted
+
+    # ---------- disk tier ----------
+    def _path(self, key):
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name[:2], name)
+
+    def _write_disk(self, key, raw):
+        if self.max_disk_bytes <= 0:
+            return
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                previous = os.path.getsize(path)
+            except OSError:
+                previous = 0
+            with open(tmp, "wb") as fh:
+                fh.write(raw)
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk_bytes()
+            else:
+                self._disk_bytes += len(raw) - previous
+            over = self._disk_bytes > self.max_disk_bytes
+        if over:
+            self._evict_disk()
+
+    def _iter_disk_files(self):
+        try:
+            shards = os.scandir(self.directory)
+        except OSError:
+            return
+        with shards:
+            for shard in shards:
+                if not shard.is_dir():
+                    continue
+                with os.scandir(shard.path) as entries:
+                    for entry in entries:
+                        if entry.is_file() and not entry.name.endswith(".tmp"):
+                            yield entry
+
+    def _scan_disk_bytes(self):
+        total = 0
+        for entry in self._iter_disk_files():
+            try:
+                total += entry.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def _evict_disk(self):
+        files = []
+        for entry in self._iter_disk_files():
+            try:
+                st_ = entry.stat()
+            except OSError:
+                continue
+            files.append((st_.st_mtime, st_.st_size, entry.path))
+        files.sort()
+
+        total = sum(size for _, size, _ in files)
+        target = int(self.max_disk_bytes * 0.9)
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
+
+
+# =========================================================
+# LLM response cache
+# - Keyed by everything that determines the completion, so identical jobs
+#   (reruns, demo replays, students with the same assignment) cost nothing.
+# =========================================================
+class ResponseCache:
+    """TTL layer over a TieredCache for raw chat-completion contents."""
+
+    def __init__(self, store, ttl_seconds):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0}
+
+    @staticmethod
+    def key(model, messages, response_format, temperature):
+        payload = json.dumps(
+            {"model": model, "messages": messages, "response_format": response_format, "temperature": temperature},
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return "chat:" + content_hash(payload.encode("utf-8"))
+
+    def get(self, key):
+        raw = self.store.get(key)
+        outcome, content = "misses", None
+        if raw is not None:
+            entry = json.loads(raw)
+            if time.time() - entry["created"] > self.ttl_seconds:
+                outcome = "expired"
+                self.store.delete(key)
+            else:
+                outcome, content = "hits", entry["content"]
+        with self._lock:
+            self.stats[outcome] += 1
+        return content
+
+    def put(self, key, content):
+        self.store.put(key, json.dumps({"created": time.time(), "content": content}, ensure_ascii=False))
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(
+                TieredCache(
+                    os.path.join(DEFAULT_CACHE_DIR, "responses"),
+                    max_memory_bytes=int(os.environ.get("REPORT_MATE_RESPONSE_CACHE_MEM_MB", "32")) * 1024 * 1024,
+                    max_disk_bytes=int(os.environ.get("REPORT_MATE_RESPONSE_CACHE_DISK_MB", "256")) * 1024 * 1024,
+                ),
+                ttl_seconds=float(os.environ.get("REPORT_MATE_RESPONSE_CACHE_TTL_HOURS", "168")) * 3600,
+            )
+        return _response_cache
@@ -0,0 +1,106 @@
+import math
+import re
+from collections import Counter
+
+# =========================================================
+# Context compaction (deterministic, per file)
+# - Running headers/footers: lines at the top/bottom of a page that recur
+#   (digits ignored, so page numbers match) on the file's first pages. The
+#   set of such lines is the file's "profile" and is cached with its pages.
+# - Reference lists: from a "References"/"참고문헌" heading on, the rest of
+#   the page is dropped, and so are following pages that read like one.
+# - Hyphenated line breaks are joined and whitespace runs collapsed. A
+#   compound keeps its hyphen ("self-\nefficacy" -> "self-efficacy") when the
+#   page spells it that way elsewhere or starts with a HYPHEN_PREFIXES word,
+#   unless the page has the joined word.
+# =========================================================
+COMPACT_VERSION = "c1"
+PROFILE_PAGES = 8
+EDGE_LINES = 3
+MIN_REPEATS = 3
+REPEAT_RATIO = 0.4
+REFERENCE_LINE_RATIO = 0.3
+HYPHEN_PREFIXES = frozenset({"self", "non", "co", "well", "long", "short", "cross"})
+WORD_SUFFIXES = frozenset({"er", "est", "ed", "ing", "ly", "ness"})  # "long-\ner" is "longer"
+
+_DIGITS = re.compile(r"\d+")
+_SPACES = re.compile(r"[ \t\u00a0\u3000]+")
+_BLANK_LINES = re.compile(r"\n{3,}")
+_HYPHEN_BREAK = re.compile(r"([A-Za-z]{2,})-\n([a-z]+)")
+_WORD = re.compile(r"[A-Za-z]+(?:-[A-Za-z]+)*")
+_REFERENCE_HEADING = re.compile(
+    r"^\s*(?:[IVX\d]+\.?\s*)?(references|bibliography|works cited|literature cited|참\s*고\s*문\s*헌|인용\s*문헌)\s*$",
+    re.IGNORECASE,
+)
+_CITATION_LINE = re.compile(
+    r"\((?:19|20)\d\d[a-z]?\)|\b(?:19|20)\d\d[a-z]?\.|\bdoi\b|https?://|\bet al\.|\bpp?\.\s*\d|\bvol\.\s*\d|^\s*\[\d+\]",
+    re.IGNORECASE,
+)
+
+
+def line_key(line):
+    return _DIGITS.sub("#", _SPACES.sub(" ", line).strip().lower())
+
+
+def _edge_indexes(lines):
+    nonblank = [i for i, line in enumerate(lines) if line.strip()]
+    return set(nonblank[:EDGE_LINES] + nonblank[-EDGE_LINES:])
+
+
+def boilerplate_lines(pages):
+    """Keys of lines repeated at the top/bottom of several of the given page texts."""
+    if len(pages) < MIN_REPEATS:
+        return frozenset()
+    counts = Counter()
+    for text in pages:
+        lines = text.split("\n")
+        counts.update({line_key(lines[i]) for i in _edge_indexes(lines)})
+    needed = max(MIN_REPEATS, math.ceil(REPEAT_RATIO * len(pages)))
+    return frozenset(key for key, n in counts.items() if key and n >= needed)
+
+
+def looks_like_references(lines):
+    nonblank = [line for line in lines if line.strip()]
+    if not nonblank:
+        return False
+    cited = sum(1 for line in nonblank if _CITATION_LINE.search(line))
+    return cited / len(nonblank) >= REFERENCE_LINE_RATIO
+
+
+def join_hyphen_breaks(text):
+    """Join words split by a hyphen at a line break, keeping the hyphen of compounds."""
+    if "-\n" not in text:
+        return text
+    words = set(_WORD.findall(text.lower()))
+
+    def join(m):
+        head, tail = m.group(1), m.group(2)
+        if f"{head}-{tail}".lower() in words:
+            return f"{head}-{tail}"
+        if (head + tail).lower() not in words and head.lower() in HYPHEN_PREFIXES and tail not in WORD_SUFFIXES:
+            return f"{head}-{tail}"
+        return head + tail
+
+    return _HYPHEN_BREAK.sub(join, text)
+
+
+def compact_page(text, boilerplate=frozenset(), in_references=False):
+    """Return (compacted text, in_references after this page); "" for a dropped reference page.
+
+    Pages must be passed in order, threading in_references from one page to the next.
+    """
+    lines = text.split("\n")
+    if boilerplate:
+        edges = _edge_indexes(lines)
+        lines = [line for i, line in enumerate(lines) if i not in edges or line_key(line) not in boilerplate]
+    if in_references:
+        if looks_like_references(lines):
+            return "", True
+        in_references = False
+    for i, line in enumerate(lines):
+        if _REFERENCE_HEADING.match(line):
+            lines, in_references = lines[:i], True
+            break
+    text = join_hyphen_breaks("\n".join(lines))
+    text = "\n".join(_SPACES.sub(" ", line).strip() for line in text.split("\n"))
+    return _BLANK_LINES.sub("\n\n", text).strip(), in_references
@@ -0,0 +1,175 @@
+import json
+import re
+
+# =========================================================
+# Model JSON: lenient parsing and schema normalization
+# - parse_model_json repairs near-valid replies locally: code fences or prose
+#   around the object, trailing commas, raw control characters in strings,
+#   and output cut off mid-way. A cut-off reply is closed after its last
+#   complete value, so a half-written section is dropped, not kept.
+# - normalize_draft coerces draft / section / expansion replies to the shape
+#   the app renders: one string per section, a {tag: summary} source_map and
+#   {subsection: [paragraph, ...]} new_paragraphs / rewritten_paragraphs.
+# =========================================================
+_FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*|\s*```\s*$")
+_WHITESPACE = re.compile(r"\s+")
+_DECODER = json.JSONDecoder(strict=False)
+
+
+def _close_truncated(text):
+    """text cut after its last complete value with the open containers closed; None if there is none.
+
+    Trailing commas before a closing bracket are dropped on the way.
+    """
+    out, stack = [], []
+    cut, closers = None, ""
+    in_string = escape = is_key = expect_key = in_literal = False
+
+    def complete():
+        return len(out), "".join(reversed(stack))
+
+    for ch in text:
+        if in_string:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+                if not is_key:
+                    cut, closers = complete()
+            continue
+        if in_literal and (ch in ",:}]" or ch.isspace()):
+            in_literal = False
+            cut, closers = complete()
+        if ch.isspace():
+            out.append(ch)
+        elif ch == '"':
+            in_string, is_key = True, expect_key
+            out.append(ch)
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            expect_key = ch == "{"
+            out.append(ch)
+        elif ch in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if not stack or stack[-1] != ch:
+                break
+            stack.pop()
+            out.append(ch)
+            expect_key = False
+            cut, closers = complete()
+            if not stack:
+                break
+        elif ch == ",":
+            out.append(ch)
+            expect_key = bool(stack) and stack[-1] == "}"
+        elif ch == ":":
+            out.append(ch)
+            expect_key = False
+        else:
+            in_literal = True
+            out.append(ch)
+    if cut is None:
+        return None
+    return "".join(out[:cut]) + closers
+
+
+def parse_model_json(content):
+    """(object, repaired) for a model's JSON reply; ({}, True) when nothing could be recovered."""
+    if not isinstance(content, str):  # None for refusals and content-filtered replies
+        return {}, True
+    try:
+        value = json.loads(content)
+        if isinstance(value, dict):
+            return value, False
+    except ValueError:
+        pass
+    text = _FENCE.sub("", content)
+    start = text.find("{")
+    if start < 0:
+        return {}, True
+    text = text[start:]
+    try:
+        value, _ = _DECODER.raw_decode(text)  # ignores anything after the object
+    except ValueError:
+        closed = _close_truncated(text)
+        try:
+            value = _DECODER.decode(closed) if closed else None
+        except ValueError:
+            value = None
+    return (value if isinstance(value, dict) else {}), True
+
+
+def as_text(value):
+    """A section value as text: lists become paragraphs, {subsection: text} becomes headed blocks."""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return "\n\n".join(text for text in (as_text(v).strip() for v in value) if text)
+    if isinstance(value, dict):
+        return "\n\n".join(f"{key}\n{as_text(v).strip()}" for key, v in value.items() if as_text(v).strip())
+    return str(value)
+
+
+def _section_keys(sections):
+    return {_WHITESPACE.sub("", section): section for section in sections}
+
+
+def _text_group(value, keys):
+    group = {}
+    for key, item in (value.items() if isinstance(value, dict) else ()):
+        text = as_text(item).strip()
+        if text:
+            group[keys.get(_WHITESPACE.sub("", str(key)), str(key))] = text
+    return group
+
+
+def normalize_source_map(value):
+    if isinstance(value, list):  # [{"tag": ..., "summary": ...}, ...]
+        value = {
+            entry.get("tag") or entry.get("ref"): entry.get("summary") or entry.get("evidence")
+            for entry in value if isinstance(entry, dict)
+        }
+    if not isinstance(value, dict):
+        return {}
+    return {str(tag): as_text(summary).strip() for tag, summary in value.items() if tag and as_text(summary).strip()}
+
+
+def normalize_new_paragraphs(value):
+    if not isinstance(value, dict):
+        return {}
+    paragraphs = {}
+    for number, paras in value.items():
+        paras = [paras] if isinstance(paras, str) else paras if isinstance(paras, list) else []
+        paras = [as_text(p).strip() for p in paras if as_text(p).strip()]
+        if paras:
+            paragraphs[str(number)] = paras
+    return paragraphs
+
+
+def normalize_draft(doc, sections=()):
+    """A copy of doc in the app's schema; section keys matching one of sections up to spacing are renamed."""
+    doc = dict(doc) if isinstance(doc, dict) else {}
+    keys = _section_keys(sections)
+    for group in ("detailed_outline", "interactive_draft"):
+        if group in doc:
+            doc[group] = _text_group(doc[group], keys)
+    if "source_map" in doc:
+        doc["source_map"] = normalize_source_map(doc["source_map"])
+    for group in ("new_paragraphs", "rewritten_paragraphs"):
+        if group in doc:
+            doc[group] = normalize_new_paragraphs(doc[group])
+    return doc
+
+
+def missing_sections(doc, sections, group="interactive_draft"):
+    """Sections without text in doc[group] (doc already normalized)."""
+    present = doc.get(group) or {}
+    return [section for section in sections if not present.get(section)]
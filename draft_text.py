@@ -0,0 +1,27 @@
+import functools
+import re
+
+# =========================================================
+# Draft text parsing (memoized)
+# - Lives outside app.py so the caches survive Streamlit reruns: a section's
+#   text is only split into paragraphs / REF segments once per distinct text.
+# =========================================================
+REF_SPLIT_PATTERN = re.compile(r"(\[REF:[^\]]+\])")
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+
+@functools.lru_cache(maxsize=2048)
+def parse_ref_segments(text):
+    """Split text into ((is_ref, part), ...); blank text between REF tags is dropped."""
+    segments = []
+    for part in REF_SPLIT_PATTERN.split(text):
+        if part.startswith("[REF:"):
+            segments.append((True, part))
+        elif part.strip():
+            segments.append((False, part))
+    return tuple(segments)
+
+
+@functools.lru_cache(maxsize=512)
+def split_paragraphs(text):
+    return tuple(p for p in PARAGRAPH_BREAK.split(text) if p.strip())
@@ -0,0 +1,425 @@
+import collections
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from budget import CharCounter
+from cache import DEFAULT_CACHE_DIR, TieredCache, content_hash
+from compaction import COMPACT_VERSION, PROFILE_PAGES, boilerplate_lines, compact_page
+from metrics import record_extraction
+
+# =========================================================
+# PDF page text extraction (content-addressed page cache)
+# - Keys are sha256(file bytes) + page number, so the same paper uploaded by
+#   any session (or under another file name) is parsed by pypdf only once.
+# - File data is bytes or a blobs.MappedFile; the latter reaches the process
+#   pool as a path and is memory-mapped by the worker.
+# =========================================================
+EXTRACT_VERSION = "v1"
+COMPACT = os.environ.get("REPORT_MATE_COMPACT", "1") != "0"
+
+_page_cache = None
+_page_cache_lock = threading.Lock()
+
+
+def get_page_cache():
+    global _page_cache
+    with _page_cache_lock:
+        if _page_cache is None:
+            _page_cache = TieredCache(
+                os.path.join(DEFAULT_CACHE_DIR, "pages"),
+                max_memory_bytes=int(os.environ.get("REPORT_MATE_PAGE_CACHE_MEM_MB", "64")) * 1024 * 1024,
+                max_disk_bytes=int(os.environ.get("REPORT_MATE_PAGE_CACHE_DISK_MB", "512")) * 1024 * 1024,
+            )
+        return _page_cache
+
+
+def _page_key(digest, page_no):
+    return f"pdf:{EXTRACT_VERSION}:{digest}:p{page_no}"
+
+
+def _count_key(digest):
+    return f"pdf:{EXTRACT_VERSION}:{digest}:pages"
+
+
+def _profile_key(digest):
+    return f"pdf:{EXTRACT_VERSION}:{digest}:profile:{COMPACT_VERSION}"
+
+
+# =========================================================
+# Process pool (pypdf is pure Python and CPU-bound)
+# - "spawn" keeps workers independent of the Streamlit server's threads.
+# - Workers only parse; the parent process owns the cache.
+# =========================================================
+PAGES_PER_TASK = 4
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def default_workers():
+    configured = os.environ.get("REPORT_MATE_EXTRACT_WORKERS")
+    if configured:
+        return max(1, int(configured))
+    return max(1, min(8, os.cpu_count() or 1))
+
+
+def get_extract_pool(workers=None):
+    global _pool
+    workers = workers or default_workers()
+    with _pool_lock:
+        if _pool is None or _pool._max_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _warm_worker():
+    importlib.import_module("pypdf")
+    return os.getpid()
+
+
+def warm_extract_pool(workers=None):
+    """Spawn the pool's workers and import pypdf in them (and here) ahead of the first upload; one Future per worker."""
+    importlib.import_module("pypdf")
+    workers = workers or default_workers()
+    if workers <= 1:
+        return []  # extraction runs in this process
+    pool = get_extract_pool(workers)
+    return [pool.submit(_warm_worker) for _ in range(workers)]
+
+
+def _open_pdf(data):
+    """A seekable stream over PDF bytes, or over a blobs.MappedFile read in place through mmap."""
+    if hasattr(data, "open"):
+        return data.open()
+    return io.BytesIO(data)
+
+
+def _page_count(data):
+    from pypdf import PdfReader
+
+    with _open_pdf(data) as stream:
+        return len(PdfReader(stream).pages)
+
+
+def _extract_page_numbers(data, page_numbers):
+    """[(page_no, text, seconds), ...]; seconds is the pypdf time for that page."""
+    from pypdf import PdfReader
+
+    extracted = []
+    with _open_pdf(data) as stream:
+        reader = PdfReader(stream)
+        for n in page_numbers:
+            started = time.perf_counter()
+            text = reader.pages[n - 1].extract_text() or ""
+            extracted.append((n, text, time.perf_counter() - started))
+    return extracted
+
+
+def _chunks(seq, size):
+    return [seq[i:i + size] for i in range(0, len(seq), size)]
+
+
+def _describe(e):
+    return f"{type(e).__name__}: {e}"
+
+
+class _Source:
+    def __init__(self, index, name, data, max_pages):
+        self.index = index
+        self.name = name
+        self.data = data
+        self.max_pages = max_pages
+        self.digest = None
+        self.page_count = 0
+        self.page_limit = 0
+        self.pages = {}
+        self.next_page = 1
+        self.error = None
+        self.boilerplate = frozenset()
+        self.in_references = False
+        self.compacted_through = 0
+        self.compaction = [0, 0, 0]  # characters before, characters after, pages dropped
+
+    @property
+    def exhausted(self):
+        return self.error is not None or self.next_page > self.page_limit
+
+
+def _open_sources(items, max_pages, cache, workers):
+    sources = []
+    for idx, (name, data) in enumerate(items):
+        src = _Source(idx, name, data, max_pages)
+        try:
+            src.digest = content_hash(data)
+            count = cache.get(_count_key(src.digest))
+            if count is None:
+                count = _page_count(data)
+                cache.put(_count_key(src.digest), str(count))
+            src.page_count = int(count)
+            src.page_limit = min(src.page_count, max_pages)
+        except Exception as e:
+            src.error = _describe(e)
+        sources.append(src)
+    if COMPACT:
+        _load_profiles(sources, cache, workers)
+    return sources
+
+
+def _load_profiles(sources, cache, workers):
+    """Set src.boilerplate from the cache, or from the first PROFILE_PAGES pages of the file."""
+    missing = []
+    for src in sources:
+        if src.error:
+            continue
+        cached = cache.get(_profile_key(src.digest))
+        if cached is None:
+            missing.append(src)
+        else:
+            src.boilerplate = frozenset(json.loads(cached))
+    _fetch([(src, list(range(1, min(src.page_count, PROFILE_PAGES) + 1))) for src in missing], cache, workers)
+    for src in missing:
+        if src.error:
+            continue
+        pages = [src.pages.get(n, "") for n in range(1, min(src.page_count, PROFILE_PAGES) + 1)]
+        src.boilerplate = boilerplate_lines(pages)
+        cache.put(_profile_key(src.digest), json.dumps(sorted(src.boilerplate), ensure_ascii=False))
+
+
+def _compact(src, text):
+    """Compact the next page of src (pages must come in order); tallies src.compaction."""
+    if not COMPACT:
+        return text
+    compacted, src.in_references = compact_page(text, src.boilerplate, src.in_references)
+    src.compaction[0] += len(text)
+    src.compaction[1] += len(compacted)
+    src.compaction[2] += bool(text.strip()) and not compacted
+    return compacted
+
+
+def _fetch(requests, cache, workers):
+    """Fill src.pages for [(src, page_numbers), ...]: cache first, then the process pool."""
+    tasks = []
+    stats = {}  # src.index -> (src, cached pages, [seconds per parsed page])
+    for src, numbers in requests:
+        if src.error:
+            continue
+        missing = []
+        cached = 0
+        for n in numbers:
+            if n in src.pages:
+                continue
+            text = cache.get(_page_key(src.digest, n))
+            if text is None:
+                missing.append(n)
+            else:
+                src.pages[n] = text
+                cached += 1
+        stats[src.index] = (src, cached, [])
+        for group in _chunks(missing, PAGES_PER_TASK):
+            tasks.append((src, group))
+
+    def _store(src, extracted):
+        for n, text, seconds in extracted:
+            cache.put(_page_key(src.digest, n), text)
+            src.pages[n] = text
+            stats[src.index][2].append(seconds)
+
+    if workers <= 1 or len(tasks) <= 1:
+        for src, group in tasks:
+            if src.error:
+                continue
+            try:
+                _store(src, _extract_page_numbers(src.data, group))
+            except Exception as e:
+                src.error = _describe(e)
+        _record(stats)
+        return
+
+    pool = get_extract_pool(workers)
+    futures = [(src, pool.submit(_extract_page_numbers, src.data, group)) for src, group in tasks]
+    for src, fut in futures:
+        try:
+            extracted = fut.result()
+        except BrokenProcessPool as e:
+            _reset_pool()
+            src.error = src.error or _describe(e)
+            continue
+        except Exception as e:
+            src.error = src.error or _describe(e)
+            continue
+        if not src.error:
+            _store(src, extracted)
+    _record(stats)
+
+
+def _record(stats):
+    for src, cached, page_seconds in stats.values():
+        record_extraction(src.name, page_seconds, cached)
+
+
+def extract_files(items, max_pages, cache=None, workers=None, compaction=None):
+    """Extract (and compact) the first max_pages pages of several PDFs.
+
+    items is [(name, data), ...]. Returns [(name, pages, error), ...] in input order,
+    where pages is [(page_no, text), ...] sorted by page and error is None on success.
+    A failing file only fails its own entry. compaction, if given, is filled with
+    {content digest: [characters before, characters after, pages dropped]}, so uploads
+    that share a name keep separate stats.
+    """
+    cache = cache or get_page_cache()
+    workers = workers or default_workers()
+
+    sources = _open_sources(items, max_pages, cache, workers)
+    _fetch([(src, list(range(1, src.page_limit + 1))) for src in sources], cache, workers)
+
+    results = []
+    for src in sources:
+        if src.error:
+            results.append((src.name, None, src.error))
+            continue
+        pages = [(n, _compact(src, text)) for n, text in sorted(src.pages.items()) if n <= src.page_limit]
+        results.append((src.name, pages, None))
+        if compaction is not None:
+            compaction[src.digest] = src.compaction
+    return results
+
+
+def extract_pages(data, max_pages, cache=None):
+    """Return [(page_no, text), ...] for the first max_pages pages of one PDF.
+
+    pypdf is only imported and run when at least one requested page is not cached.
+    """
+    (_, pages, error), = extract_files([(None, data)], max_pages, cache=cache, workers=1)
+    if error:
+        raise RuntimeError(error)
+    return pages
+
+
+# =========================================================
+# Budget-aware streaming extraction
+# - Pages are parsed lazily, one page group per file per wave, and parsing stops
+#   as soon as the budget is spent.
+# - The budget is water-filled across files: every file gets an equal share, and
+#   whatever a short file leaves unused is redistributed to the others.
+# - The budget unit comes from the counter (characters by default, or model
+#   tokens via budget.TokenCounter).
+# =========================================================
+PageChunk = collections.namedtuple("PageChunk", ["file_index", "name", "page_no", "text"])
+
+MIN_CHUNK_CHARS = CharCounter.min_chunk
+
+
+def format_page_chunk(name, page_no, content):
+    return f"\n[SOURCE: {name}, PAGE: {page_no}]\n{content}\n"
+
+
+def fit_page_chunk(name, page_no, content, room, counter):
+    """Return (chunk, size) for the page truncated to fit room, or (None, 0) if too little room is left."""
+    chunk = format_page_chunk(name, page_no, content)
+    size = counter.count(chunk)
+    if size <= room:
+        return chunk, size
+    content_room = room - counter.count(format_page_chunk(name, page_no, ""))
+    if content_room < counter.min_chunk:
+        return None, 0
+    chunk = format_page_chunk(name, page_no, counter.truncate(content, content_room))
+    return chunk, counter.count(chunk)
+
+
+def iter_page_chunks(
+    items, max_pages, budget, cache=None, workers=None, errors=None, counter=None, compaction=None
+):
+    """Yield PageChunk(file_index, name, page_no, text) until budget is used up.
+
+    Chunks are yielded in allocation order; sort by (file_index, page_no) for the
+    canonical [SOURCE, PAGE] order. Files that fail are appended to errors as
+    (name, message) and skipped. compaction is filled as in extract_files, for
+    the pages read so far.
+    """
+    cache = cache or get_page_cache()
+    workers = workers or default_workers()
+
+    sources = _open_sources(items, max_pages, cache, workers)
+    if compaction is not None:
+        compaction.update((src.digest, src.compaction) for src in sources if not src.error)
+    reported = set()
+
+    def _report(src):
+        if src.error and src.index not in reported:
+            reported.add(src.index)
+            if errors is not None:
+                errors.append((src.name, src.error))
+
+    for src in sources:
+        _report(src)
+
+    counter = counter or CharCounter()
+    used = 0
+    hungry = [src for src in sources if not src.exhausted]
+    while hungry and budget - used >= counter.min_chunk:
+        quota = (budget - used) // len(hungry)
+        allowance = {src.index: quota for src in hungry}
+        used_before = used
+        pending = list(hungry)
+        hungry = []
+
+        while pending:
+            _fetch(
+                [
+                    (src, list(range(src.next_page, min(src.next_page + PAGES_PER_TASK, src.page_limit + 1))))
+                    for src in pending
+                    if src.next_page not in src.pages
+                ],
+                cache,
+                workers,
+            )
+            waiting = []
+            for src in pending:
+                while not src.exhausted and src.next_page in src.pages and allowance[src.index] > 0:
+                    page_no = src.next_page
+                    if page_no > src.compacted_through:
+                        src.pages[page_no] = _compact(src, src.pages[page_no])
+                        src.compacted_through = page_no
+                    content = src.pages[page_no]
+                    if not content:
+                        del src.pages[page_no]
+                        src.next_page += 1
+                        continue
+                    chunk, size = fit_page_chunk(src.name, page_no, content, allowance[src.index], counter)
+                    if chunk is None:
+                        allowance[src.index] = 0
+                        break
+                    del src.pages[page_no]
+                    src.next_page += 1
+                    allowance[src.index] -= size
+                    used += size
+                    yield PageChunk(src.index, src.name, page_no, chunk)
+
+                _report(src)
+                if src.exhausted:
+                    continue
+                if allowance[src.index] <= 0:
+                    hungry.append(src)
+                else:
+                    waiting.append(src)
+            pending = waiting
+
+        if used == used_before:
+            break
@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# =========================================================
+# Background jobs
+# - Generation and expansion run on a process-wide worker pool instead of the
+#   Streamlit script thread, so a long request neither blocks the session nor
+#   dies with it.
+# - Jobs are keyed by session and job ID; a browser that reconnects with the
+#   same session ID (kept in the URL) re-attaches to its running job.
+# - Workers never touch st.*; they report a stage and a partial result which
+#   the UI polls.
+# =========================================================
+JOB_WORKERS = int(os.environ.get("REPORT_MATE_JOB_WORKERS", "8"))
+JOB_TTL_SECONDS = float(os.environ.get("REPORT_MATE_JOB_TTL_MINUTES", "60")) * 60
+
+STAGES = ("extracting", "condensing", "prompting", "generating", "merging")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """State of one background job, written by its worker and read by the UI."""
+
+    def __init__(self, session, kind):
+        self.id = uuid.uuid4().hex
+        self.session = session
+        self.kind = kind
+        self.status = "queued"  # queued / running / done / error / cancelled
+        self.stage = None
+        self.detail = ""
+        self.partial = None
+        self.result = None
+        self.error = None
+        self.created = self.updated = time.time()
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error", "cancelled")
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def raise_if_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    # ---------- called from the worker ----------
+    def set_stage(self, stage, detail=""):
+        self.raise_if_cancelled()
+        with self._lock:
+            self.stage, self.detail, self.updated = stage, detail, time.time()
+
+    def publish(self, partial):
+        """Replace the partial result shown while the job runs; pass a value the worker won't mutate."""
+        self.raise_if_cancelled()
+        with self._lock:
+            self.partial, self.updated = partial, time.time()
+
+    def _finish(self, status, result=None, error=None):
+        with self._lock:
+            self.status, self.result, self.error, self.updated = status, result, error, time.time()
+
+    # ---------- called from the UI ----------
+    def snapshot(self):
+        with self._lock:
+            return {
+                "status": self.status,
+                "stage": self.stage,
+                "detail": self.detail,
+                "partial": self.partial,
+                "cancel_requested": self._cancel.is_set(),
+            }
+
+
+class JobRunner:
+    """Thread pool plus a registry of jobs; finished jobs are kept until collected or expired."""
+
+    def __init__(self, max_workers=JOB_WORKERS, ttl_seconds=JOB_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="report-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, session, kind, fn, *args, **kwargs):
+        """Run fn(job, *args, **kwargs) in the background; its return value becomes job.result."""
+        self._prune()
+        job = Job(session, kind)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancel_requested:
+            job._finish("cancelled")
+            return
+        job.status = "running"
+        try:
+            result = fn(job, *args, **kwargs)
+        except JobCancelled:
+            job._finish("cancelled")
+        except Exception as e:
+            job._finish("error", error=e)
+        else:
+            job._finish("done", result=result)
+
+    def get(self, job_id, session):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None and job.session == session else None
+
+    def latest(self, session):
+        """The session's most recent job that has not been collected yet, if any."""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.session == session]
+        return max(jobs, key=lambda job: job.created) if jobs else None
+
+    def collect(self, job_id):
+        with self._lock:
+            return self._jobs.pop(job_id, None)
+
+    def cancel_session(self, session):
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.session == session]
+        for job in jobs:
+            job.cancel()
+
+    def active_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            for job_id in [i for i, job in self._jobs.items() if job.finished and job.updated < cutoff]:
+                del self._jobs[job_id]
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner():
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner()
+        return _runner
@@ -0,0 +1,119 @@
+import json
+
+# =========================================================
+# Incremental JSON parser for streamed model output
+# - Fed arbitrary text chunks; reports every completed scalar value together
+#   with its key path, and every closed container, as soon as it is seen.
+# - Only tracks structure; the final document is still parsed with json.loads.
+# =========================================================
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_DELIMITERS = set(",:}] \t\r\n")
+
+
+class IncrementalJSONParser:
+    """Streaming structural parser.
+
+    on_value(path, value) is called for each completed string/number/literal,
+    on_close(path) when an object or array ends. path is a tuple of keys (str)
+    and array indices (int) from the document root.
+    """
+
+    def __init__(self, on_value=None, on_close=None):
+        self.on_value = on_value
+        self.on_close = on_close
+        self.stack = []  # [kind, key-or-index]
+        self.expect_key = False
+        self.in_string = False
+        self.string_is_key = False
+        self.escape = None
+        self.buf = []
+        self.literal = []
+
+    @property
+    def path(self):
+        return tuple(entry[1] for entry in self.stack)
+
+    def feed(self, chunk):
+        for ch in chunk:
+            self._step(ch)
+
+    def _step(self, ch):
+        if self.in_string:
+            self._string_char(ch)
+            return
+
+        if self.literal and ch in _DELIMITERS:
+            self._finish_literal()
+
+        if ch in " \t\r\n":
+            return
+        if ch == '"':
+            self.in_string = True
+            self.string_is_key = self.expect_key
+            self.buf = []
+        elif ch == "{":
+            self.stack.append(["object", None])
+            self.expect_key = True
+        elif ch == "[":
+            self.stack.append(["array", 0])
+            self.expect_key = False
+        elif ch == ":":
+            self.expect_key = False
+        elif ch == ",":
+            if self.stack and self.stack[-1][0] == "array":
+                self.stack[-1][1] += 1
+                self.expect_key = False
+            else:
+                self.expect_key = True
+        elif ch in "}]":
+            path = self.path[:-1]
+            if self.stack:
+                self.stack.pop()
+            self.expect_key = False
+            if self.on_close:
+                self.on_close(path)
+        else:
+            self.literal.append(ch)
+
+    def _string_char(self, ch):
+        if self.escape is not None:
+            if self.escape == "":
+                if ch == "u":
+                    self.escape = "u"
+                    return
+                self.buf.append(_ESCAPES.get(ch, ch))
+                self.escape = None
+                return
+            self.escape += ch
+            if len(self.escape) == 5:
+                self.buf.append(chr(int(self.escape[1:], 16)))
+                self.escape = None
+            return
+        if ch == "\\":
+            self.escape = ""
+        elif ch == '"':
+            self.in_string = False
+            value = "".join(self.buf)
+            if any("\ud800" <= c <= "\udfff" for c in value):
+                value = value.encode("utf-16", "surrogatepass").decode("utf-16", "replace")
+            self.buf = []
+            if self.string_is_key:
+                if self.stack:
+                    self.stack[-1][1] = value
+            else:
+                self._emit(value)
+        else:
+            self.buf.append(ch)
+
+    def _finish_literal(self):
+        text = "".join(self.literal)
+        self.literal = []
+        try:
+            value = json.loads(text)
+        except ValueError:
+            return
+        self._emit(value)
+
+    def _emit(self, value):
+        if self.on_value:
+            self.on_value(self.path, value)
@@ -0,0 +1,341 @@
+import asyncio
+import collections
+import hashlib
+import importlib
+import os
+import queue
+import random
+import threading
+import time
+
+from metrics import record_request, registry
+
+# =========================================================
+# Shared OpenAI access
+# - One client per API key for the whole process, so HTTP connections stay
+#   alive across requests and Streamlit sessions.
+# - A process-wide limiter (requests/min, tokens/min, requests in flight)
+#   hands out slots round-robin across sessions, so one user's 17 parallel
+#   subsection requests cannot starve everyone else.
+# - Retries use full-jitter exponential backoff and honour Retry-After.
+# - The OpenAI SDK reads OPENAI_BASE_URL, so everything here can be pointed at
+#   a local mock server.
+# =========================================================
+RPM_LIMIT = int(os.environ.get("REPORT_MATE_OPENAI_RPM", "500"))
+TPM_LIMIT = int(os.environ.get("REPORT_MATE_OPENAI_TPM", "200000"))
+MAX_IN_FLIGHT = int(os.environ.get("REPORT_MATE_OPENAI_MAX_IN_FLIGHT", "16"))
+MAX_RETRIES = int(os.environ.get("REPORT_MATE_OPENAI_MAX_RETRIES", "5"))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_CAP_SECONDS = 30.0
+CHECK_INTERVAL_SECONDS = 0.25  # how often a waiting batch polls for cancellation
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """Process-wide admission control with round-robin fairness across sessions.
+
+    A limit of 0 disables that dimension.
+    """
+
+    def __init__(self, rpm=RPM_LIMIT, tpm=TPM_LIMIT, max_in_flight=MAX_IN_FLIGHT):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._cond = threading.Condition()
+        self._waiting = collections.OrderedDict()  # session -> deque of tickets
+        self._turns = collections.deque()  # sessions, in round-robin order
+        self.stats = {"granted": 0, "waited_seconds": 0.0}
+
+    def _wait_time(self, tokens):
+        now = time.monotonic()
+        wait = 0.0
+        if self.requests:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+
+    def acquire(self, session, tokens=0):
+        ticket = object()
+        started = time.monotonic()
+        with self._cond:
+            if session not in self._waiting:
+                self._waiting[session] = collections.deque()
+                self._turns.append(session)
+            self._waiting[session].append(ticket)
+            while True:
+                head = self._turns[0]
+                if self._waiting[head][0] is ticket:
+                    busy = self.max_in_flight > 0 and self.in_flight >= self.max_in_flight
+                    wait = None if busy else self._wait_time(tokens)
+                    if wait is not None and wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(tokens)
+            self.in_flight += 1
+            self._waiting[session].popleft()
+            self._turns.popleft()
+            if self._waiting[session]:
+                self._turns.append(session)
+            else:
+                del self._waiting[session]
+            self.stats["granted"] += 1
+            self.stats["waited_seconds"] += time.monotonic() - started
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+
+_limiter = RateLimiter()
+_clients = {}
+_async_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_limiter():
+    return _limiter
+
+
+def _key_id(api_key):
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def get_client(api_key):
+    from openai import OpenAI
+
+    with _clients_lock:
+        key = _key_id(api_key)
+        if key not in _clients:
+            _clients[key] = OpenAI(api_key=api_key, max_retries=0)
+        return _clients[key]
+
+
+def _get_async_client(api_key):
+    # Only called on the background loop, so the underlying httpx pool stays on one loop.
+    from openai import AsyncOpenAI
+
+    with _clients_lock:
+        key = _key_id(api_key)
+        if key not in _async_clients:
+            _async_clients[key] = AsyncOpenAI(api_key=api_key, max_retries=0)
+        return _async_clients[key]
+
+
+def preload_sdk():
+    """Import the OpenAI SDK (about 0.4 s) ahead of the first request."""
+    importlib.import_module("openai")
+
+
+# =========================================================
+# Retries
+# =========================================================
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def _is_retryable(error):
+    import openai
+
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def backoff_delay(attempt, error=None):
+    retry_after = _retry_after(error) if error is not None else None
+    if retry_after is not None:
+        return min(retry_after, BACKOFF_CAP_SECONDS * 4)
+    return random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def create_chat_completion(api_key, session, estimated_tokens=0, **kwargs):
+    """chat.completions.create through the shared client, limiter and retry policy.
+
+    With stream=True the returned iterator holds its limiter slot until it is exhausted or closed.
+    """
+    client = get_client(api_key)
+    model = kwargs.get("model")
+    for attempt in range(MAX_RETRIES + 1):
+        queued = time.monotonic()
+        _limiter.acquire(session, estimated_tokens)
+        started = time.monotonic()
+        try:
+            result = client.chat.completions.create(**kwargs)
+        except Exception as e:
+            _limiter.release()
+            if attempt >= MAX_RETRIES or not _is_retryable(e):
+                record_request(model, time.monotonic() - started, started - queued, outcome="error")
+                raise
+            registry.inc("report_mate_openai_retries_total", error=type(e).__name__)
+            time.sleep(backoff_delay(attempt, e))
+            continue
+        if kwargs.get("stream"):
+            return _release_when_done(result, model, queued, started)
+        _limiter.release()
+        record_request(model, time.monotonic() - started, started - queued, usage=result.usage)
+        return result
+
+
+def _release_when_done(stream, model, queued, started):
+    """Yield the stream's chunks; when exhausted or closed early, close the response and free the slot."""
+    first = usage = None
+    try:
+        for chunk in stream:
+            if first is None:
+                first = time.monotonic()
+            usage = chunk.usage or usage
+            yield chunk
+    finally:
+        try:
+            stream.close()
+        finally:
+            _limiter.release()
+            record_request(
+                model, time.monotonic() - started, started - queued,
+                ttft_seconds=None if first is None else first - started, usage=usage, stream=True,
+            )
+
+
+# =========================================================
+# Concurrent requests on a shared background event loop
+# =========================================================
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="openai-pool", daemon=True).start()
+        return _loop
+
+
+async def _acquire_async(session, estimated_tokens):
+    """Wait for a limiter slot without blocking the loop.
+
+    acquire() runs on a worker thread that cannot be interrupted, so if the awaiting task
+    is cancelled the slot is handed back as soon as that thread gets it.
+    """
+    acquiring = asyncio.ensure_future(asyncio.to_thread(_limiter.acquire, session, estimated_tokens))
+
+    def _give_back(fut):
+        if not fut.cancelled() and fut.exception() is None:
+            _limiter.release()
+
+    try:
+        await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        acquiring.add_done_callback(_give_back)
+        raise
+
+
+async def _create_async(api_key, session, estimated_tokens, kwargs):
+    # Runs in a copy of the caller's context, so metrics land in the caller's trace.
+    client = _get_async_client(api_key)
+    model = kwargs.get("model")
+    for attempt in range(MAX_RETRIES + 1):
+        queued = time.monotonic()
+        await _acquire_async(session, estimated_tokens)
+        started = time.monotonic()
+        try:
+            resp = await client.chat.completions.create(**kwargs)
+            record_request(model, time.monotonic() - started, started - queued, usage=resp.usage)
+            return resp
+        except Exception as e:
+            if attempt >= MAX_RETRIES or not _is_retryable(e):
+                record_request(model, time.monotonic() - started, started - queued, outcome="error")
+                raise
+            registry.inc("report_mate_openai_retries_total", error=type(e).__name__)
+            delay = backoff_delay(attempt, e)
+        finally:
+            _limiter.release()
+        await asyncio.sleep(delay)
+
+
+def _next_done(done, check):
+    if check is None:
+        return done.get()
+    while True:
+        check()
+        try:
+            return done.get(timeout=CHECK_INTERVAL_SECONDS)
+        except queue.Empty:
+            pass
+
+
+def iter_chat_completions(api_key, session, requests, max_concurrency=4, return_exceptions=False, check=None):
+    """Run [(estimated_tokens, create_kwargs), ...] concurrently; yield (index, response) as each completes.
+
+    At most max_concurrency of these requests are in flight at once (on top of the
+    global limiter). Runs in the caller's thread; an error is raised at the point its
+    request completes (or yielded in place of the response with return_exceptions),
+    and closing the generator cancels whatever is still pending. While waiting, check()
+    is called every CHECK_INTERVAL_SECONDS; whatever it raises abandons the batch the same way.
+    """
+    loop = _get_loop()
+    done = queue.Queue()
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def one(i, estimated_tokens, kwargs):
+        async with semaphore:
+            try:
+                return i, await _create_async(api_key, session, estimated_tokens, kwargs)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                return i, e
+
+    futures = []
+    for i, (estimated_tokens, kwargs) in enumerate(requests):
+        fut = asyncio.run_coroutine_threadsafe(one(i, estimated_tokens, kwargs), loop)
+        fut.add_done_callback(done.put)
+        futures.append(fut)
+
+    try:
+        for _ in futures:
+            yield _next_done(done, check).result()
+    finally:
+        for fut in futures:
+            fut.cancel()
@@ -0,0 +1,249 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+
+from cache import DEFAULT_CACHE_DIR
+from jobs import JobCancelled
+
+# =========================================================
+# Instrumentation
+# - A process-wide registry of Prometheus-style counters and histograms,
+#   written to a text file (node-exporter textfile format) after every run.
+# - A Trace per generate/expand run collects stage timings, per-file
+#   extraction and per-request API timings/tokens. It follows the run through
+#   threads and the shared event loop via a ContextVar, is returned to the UI
+#   for the diagnostics panel, and is appended to a JSON Lines log.
+# - REPORT_MATE_METRICS_FILE / REPORT_MATE_TRACE_LOG set to "" disable output.
+# =========================================================
+METRICS_FILE = os.environ.get("REPORT_MATE_METRICS_FILE", os.path.join(DEFAULT_CACHE_DIR, "metrics.prom"))
+TRACE_LOG = os.environ.get("REPORT_MATE_TRACE_LOG", os.path.join(DEFAULT_CACHE_DIR, "traces.jsonl"))
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+HELP = {
+    "report_mate_stage_seconds": "Wall time of pipeline stages and UI renders.",
+    "report_mate_extract_page_seconds": "pypdf time per extracted page.",
+    "report_mate_extract_pages_total": "PDF pages served, by source (parsed or cache).",
+    "report_mate_openai_request_seconds": "Chat completion time after admission, by mode.",
+    "report_mate_openai_ttft_seconds": "Time to first streamed token.",
+    "report_mate_openai_queue_seconds": "Time spent waiting for the rate limiter.",
+    "report_mate_openai_requests_total": "Chat completions, by outcome (ok, cached, error).",
+    "report_mate_openai_retries_total": "Retried chat completions, by error type.",
+    "report_mate_openai_tokens_total": "Tokens reported by the API, by kind.",
+    "report_mate_runs_total": "Generate/expand runs, by kind and status.",
+}
+
+
+class Registry:
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1.0, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            counts, total, count = self._histograms.get(key, ((0,) * len(BUCKETS), 0.0, 0))
+            counts = tuple(c + (value <= bound) for c, bound in zip(counts, BUCKETS))
+            self._histograms[key] = (counts, total + value, count + 1)
+
+    def render(self):
+        """The registry in Prometheus text exposition format."""
+        def fmt(labels, extra=()):
+            pairs = [f'{k}="{v}"' for k, v in (*labels, *extra)]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+        lines, typed = [], set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} counter"]
+            lines.append(f"{name}{fmt(labels)} {value:g}")
+        for (name, labels), (counts, total, count) in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} histogram"]
+            for bound, c in zip(BUCKETS, counts):
+                lines.append(f"{name}_bucket{fmt(labels, [('le', f'{bound:g}')])} {c}")
+            lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{fmt(labels)} {total:.6f}")
+            lines.append(f"{name}_count{fmt(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class Trace:
+    """Timings and usage of one generate/expand run."""
+
+    def __init__(self, kind, **attrs):
+        self.kind = kind
+        self.attrs = attrs
+        self.status = "running"
+        self.started = time.time()
+        self.seconds = None
+        self.spans = []
+        self.requests = []
+        self.files = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name, seconds):
+        with self._lock:
+            self.spans.append({"name": name, "seconds": round(seconds, 4)})
+
+    def add_request(self, record):
+        with self._lock:
+            self.requests.append(record)
+
+    def add_file(self, name, parsed, cached, parse_seconds):
+        with self._lock:
+            entry = self.files.setdefault(name, {"pages_parsed": 0, "pages_cached": 0, "parse_seconds": 0.0})
+            entry["pages_parsed"] += parsed
+            entry["pages_cached"] += cached
+            entry["parse_seconds"] = round(entry["parse_seconds"] + parse_seconds, 4)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "status": self.status,
+                "started": self.started,
+                "seconds": self.seconds,
+                **self.attrs,
+                "spans": list(self.spans),
+                "files": [{"name": name, **entry} for name, entry in self.files.items()],
+                "requests": list(self.requests),
+            }
+
+
+_current = contextvars.ContextVar("report_mate_trace", default=None)
+_output_lock = threading.Lock()
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def trace(kind, **attrs):
+    """Collect a Trace for the enclosed run, then log it and refresh the metrics file."""
+    current = Trace(kind, **attrs)
+    token = _current.set(current)
+    started = time.monotonic()
+    try:
+        yield current
+        current.status = "done"
+    except JobCancelled:
+        current.status = "cancelled"
+        raise
+    except BaseException:
+        current.status = "error"
+        raise
+    finally:
+        _current.reset(token)
+        current.seconds = round(time.monotonic() - started, 4)
+        registry.inc("report_mate_runs_total", kind=kind, status=current.status)
+        _write_outputs(current)
+
+
+@contextlib.contextmanager
+def span(name):
+    """Time a stage; recorded in the registry and, inside a run, in its Trace."""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        record_stage(name, time.monotonic() - started)
+
+
+def record_stage(name, seconds):
+    registry.observe("report_mate_stage_seconds", seconds, stage=name)
+    current = _current.get()
+    if current is not None:
+        current.add_span(name, seconds)
+
+
+def record_extraction(name, page_seconds, cached_pages):
+    """page_seconds: pypdf time of each page parsed for this file just now."""
+    for seconds in page_seconds:
+        registry.observe("report_mate_extract_page_seconds", seconds)
+    if page_seconds:
+        registry.inc("report_mate_extract_pages_total", len(page_seconds), source="parsed")
+    if cached_pages:
+        registry.inc("report_mate_extract_pages_total", cached_pages, source="cache")
+    current = _current.get()
+    if current is not None and (page_seconds or cached_pages):
+        current.add_file(name, len(page_seconds), cached_pages, sum(page_seconds))
+
+
+def record_request(
+    model, seconds=None, queue_seconds=None, ttft_seconds=None, usage=None, stream=False, outcome="ok"
+):
+    registry.inc("report_mate_openai_requests_total", outcome=outcome)
+    mode = "stream" if stream else "single"
+    if seconds is not None:
+        registry.observe("report_mate_openai_request_seconds", seconds, mode=mode)
+    if queue_seconds is not None:
+        registry.observe("report_mate_openai_queue_seconds", queue_seconds)
+    if ttft_seconds is not None:
+        registry.observe("report_mate_openai_ttft_seconds", ttft_seconds)
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    if prompt_tokens:
+        registry.inc("report_mate_openai_tokens_total", prompt_tokens, kind="prompt")
+    if completion_tokens:
+        registry.inc("report_mate_openai_tokens_total", completion_tokens, kind="completion")
+
+    current = _current.get()
+    if current is not None:
+        current.add_request({
+            "model": model,
+            "outcome": outcome,
+            "stream": stream,
+            "queue_seconds": None if queue_seconds is None else round(queue_seconds, 4),
+            "ttft_seconds": None if ttft_seconds is None else round(ttft_seconds, 4),
+            "seconds": None if seconds is None else round(seconds, 4),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+        })
+
+
+def record_repair(outcome, count=1):
+    """outcome: "recovered" / "failed" for locally repaired replies, "retried" for follow-up requests."""
+    registry.inc("report_mate_json_repairs_total", count, outcome=outcome)
+
+
+def _write_outputs(current):
+    with _output_lock:
+        try:
+            if TRACE_LOG:
+                os.makedirs(os.path.dirname(TRACE_LOG) or ".", exist_ok=True)
+                with open(TRACE_LOG, "a", encoding="utf-8") as fh:
+                    fh.write(json.dumps(current.to_dict(), ensure_ascii=False) + "\n")
+            if METRICS_FILE:
+                write_metrics_file(METRICS_FILE)
+        except OSError:
+            pass
+
+
+def write_metrics_file(path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.write(registry.render())
+    os.replace(tmp, path)
@@ -0,0 +1,1597 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from blobs import get_context_store
+from budget import CharCounter, TokenCounter, count_messages, expected_output_tokens, plan_budget
+from cache import content_hash, get_response_cache
+from draft_schema import missing_sections, normalize_draft, parse_model_json
+from draft_text import REF_SPLIT_PATTERN, split_paragraphs
+from extraction import extract_files, get_page_cache, iter_page_chunks, warm_extract_pool
+from json_stream import IncrementalJSONParser
+from llm_client import create_chat_completion, iter_chat_completions, preload_sdk
+from projects import get_project_store
+from retrieval import BM25Index, get_context_index, get_page_index, parse_context_chunks, tokenize
+
+# =========================================================
+# Drafting pipeline (no Streamlit)
+# - Context selection, prompts, OpenAI calls and result merging, shared by
+#   app.py and the batch CLI (batch.py).
+# - Long-running work reports progress through a jobs.Job.
+# =========================================================
+DRAFT_OUTLINE = {
+    "서론": ["1.1 연구 배경", "1.2 문제 제기", "1.3 연구 목적/질문", "1.4 연구 기여/구성"],
+    "이론적 배경": ["2.1 핵심 개념 정의", "2.2 선행연구 흐름", "2.3 한계/논쟁점", "2.4 연구 공백 및 연구모형 시사점"],
+    "연구방법": ["3.1 연구설계", "3.2 표본/자료", "3.3 측정(변수/도구)", "3.4 분석전략", "3.5 타당도·윤리"],
+    "결론": ["4.1 결과 요약(예상 포함)", "4.2 이론적 함의", "4.3 실천적 함의", "4.4 한계 및 후속연구"],
+}
+
+RETRIEVAL_MAX_PAGES_EACH = 60
+
+
+def outline_lines():
+    return "\n".join(f"  • {section}: {', '.join(subs)}" for section, subs in DRAFT_OUTLINE.items())
+
+
+def retrieval_queries(topic, purpose, hypothesis):
+    queries = [" ".join(x for x in (topic, purpose, hypothesis) if x)]
+    for subs in DRAFT_OUTLINE.values():
+        for sub in subs:
+            queries.append(f"{sub.split(' ', 1)[1]} {topic}")
+    return queries
+
+
+def get_combined_text_with_meta(
+    items, max_pages_each=10, max_chars=35000, errors=None, queries=None, max_tokens=None, model=None,
+    compaction=None,
+):
+    """items: [(file name, PDF bytes or blobs.MappedFile), ...]
+
+    compaction, if given, is filled with {content digest: [characters before compaction, after, pages dropped]}.
+    """
+    counter, budget = CharCounter(), max_chars
+    if max_tokens is not None:
+        counter, budget = TokenCounter(model), max_tokens
+    if queries:
+        index = get_page_index(items, max_pages_each)
+        if errors is not None:
+            errors.extend(index.errors)
+        if compaction is not None:
+            compaction.update(index.compaction)
+        chunks = index.select(queries, budget, counter=counter)
+    else:
+        chunks = sorted(
+            iter_page_chunks(items, max_pages_each, budget, errors=errors, counter=counter, compaction=compaction),
+            key=lambda c: (c.file_index, c.page_no),
+        )
+    return "".join(c.text for c in chunks)
+
+
+# Uploads are extracted and indexed in the background as soon as they arrive, so
+# generation finds them cached (or only the files added since). Pages 1..60 also
+# cover the sequential mode's first 10 pages.
+PREFETCH_WORKERS = 2
+
+_prefetch_pool = None
+_prefetching = {}  # file digests -> Future of the page index
+_prefetch_lock = threading.Lock()
+
+
+def prefetch_context(items):
+    """Start building the page index for [(name, data), ...]; returns its Future (shared while running)."""
+    global _prefetch_pool
+    key = tuple((name, content_hash(data)) for name, data in items)
+    with _prefetch_lock:
+        if key in _prefetching:
+            return _prefetching[key]
+        if _prefetch_pool is None:
+            _prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="report-prefetch")
+        future = _prefetching[key] = _prefetch_pool.submit(get_page_index, items, RETRIEVAL_MAX_PAGES_EACH)
+
+    def _forget(_):
+        with _prefetch_lock:
+            _prefetching.pop(key, None)
+
+    future.add_done_callback(_forget)
+    return future
+
+
+# A fresh process would otherwise make its first user wait for the OpenAI SDK
+# import, the tokenizer load and the extraction workers' spawn. warm_up() does
+# all three once, in the background, when the first page is served.
+WARM_UP = os.environ.get("REPORT_MATE_WARM_UP", "1") != "0"
+
+_warm_up_thread = None
+_warm_up_lock = threading.Lock()
+
+
+def _warm_up(model):
+    started = time.monotonic()
+    try:
+        preload_sdk()
+        TokenCounter(model).count("")
+        for future in warm_extract_pool():
+            future.result()
+    except Exception:
+        return  # only a head start; the first request does whatever is left
+    metrics.record_stage("warm_up", time.monotonic() - started)
+
+
+def warm_up(model="gpt-4o-mini"):
+    """Start the once-per-process warm-up; returns its thread, or None when REPORT_MATE_WARM_UP=0."""
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _warm_up_thread is None and WARM_UP:
+            _warm_up_thread = threading.Thread(target=_warm_up, args=(model,), name="report-warm-up", daemon=True)
+            _warm_up_thread.start()
+        return _warm_up_thread
+
+
+def plan_initial_budget(
+    topic, purpose, hypothesis, base_paras, min_chars_per_para, tone, model, max_input_tokens, source_map=True
+):
+    counter = TokenCounter(model)
+    system_msg, user_msg = build_initial_prompt(
+        topic, purpose, hypothesis, "", base_paras, min_chars_per_para, tone, source_map=source_map
+    )
+    template_tokens = count_messages(
+        counter, [{"role": "system", "content": system_msg}, {"role": "user", "content": user_msg}]
+    )
+    n_subsections = sum(len(subs) for subs in DRAFT_OUTLINE.values())
+    expected = expected_output_tokens(
+        counter, n_subsections, base_paras, min_chars_per_para, with_source_map=source_map
+    )
+    return counter, plan_budget(model, template_tokens, expected, max_input_tokens=max_input_tokens)
+
+
+def compaction_report(compaction, context_chars, context_tokens):
+    """Characters and pages removed by compaction; tokens at this context's tokens-per-character rate."""
+    chars_saved = sum(before - after for before, after, _ in compaction.values())
+    return {
+        "compaction_chars_saved": chars_saved,
+        "compaction_tokens_saved": round(chars_saved * context_tokens / context_chars) if context_chars else 0,
+        "compaction_pages_dropped": sum(dropped for _, _, dropped in compaction.values()),
+    }
+
+
+def map_report(model, usage, notes):
+    """Usage of the map (per-paper notes) step, reported next to the draft's own."""
+    return {
+        "map_model": model,
+        "map_notes": sum(len(file_notes) for file_notes in notes.values()),
+        "map_prompt_tokens_api": usage.get("prompt_tokens"),
+        "map_completion_tokens_api": usage.get("completion_tokens"),
+        "map_cache_hits": usage.get("cache_hits", 0),
+    }
+
+
+def token_report(kind, counter, prompts, usage, plan=None, context=""):
+    report = {
+        "kind": kind,
+        "requests": len(prompts),
+        "exact_tokenizer": counter.exact,
+        "context_tokens": counter.count(context),
+        "prompt_tokens_local": sum(
+            count_messages(counter, [{"role": "system", "content": s}, {"role": "user", "content": u}])
+            for s, u in prompts
+        ),
+        "prompt_tokens_api": usage.get("prompt_tokens"),
+        "completion_tokens_api": usage.get("completion_tokens"),
+        "cache_hits": usage.get("cache_hits", 0),
+        "repaired_responses": usage.get("repaired_responses", 0),
+        "repair_requests": usage.get("repair_requests", 0),
+        "failed_requests": usage.get("failed_requests", 0),
+    }
+    if plan:
+        report.update(plan)
+        report["planned_input_tokens"] = plan["template_tokens"] + plan["input_budget_tokens"]
+    return report
+
+
+# =========================================================
+# Prompts
+# =========================================================
+def tone_instructions(tone: str) -> str:
+    if tone == "Academic":
+        return "학술적·객관적 문체로, 정의-근거-논증 연결을 분명히 하되 과도한 수사는 피할 것."
+    if tone == "Formal":
+        return "격식을 갖춘 문체로, 문장 구조를 정돈하고 단정적 표현은 근거와 함께 제시할 것."
+    if tone == "Analytical":
+        return "분석적 문체로, 비교·대조·비판적 논의(한계/공백)를 더 적극적으로 포함할 것."
+    return "학술적 문체를 유지할 것."
+
+
+def drafting_system_msg(tone):
+    return f"""
+당신은 석사학위 논문을 다수 지도한 전문 학술 에디터입니다.
+제공된 자료에 근거해 엄밀한 학술 문체(석사 논문 수준)로 서술하며, 주장-근거-비판적 논의-연구 공백/기여를 명료하게 연결합니다.
+{tone_instructions(tone)}
+반드시 지정한 JSON 스키마로만 출력하세요.
+""".strip()
+
+
+def source_map_schema(source_map):
+    """The source_map entry of a JSON skeleton, or "" when the summaries are built locally."""
+    if not source_map:
+        return ""
+    return """,
+  "source_map": {
+    "[REF:파일명,p숫자]": "이 REF가 지지하는 핵심 근거(해당 페이지 내용) 요약"
+  }"""
+
+
+def build_initial_prompt(topic, purpose, hypothesis, context, base_paras, min_chars_per_para, tone, source_map=True):
+    system_msg = drafting_system_msg(tone)
+    source_map_req = """
+3) source_map:
+- 각 [REF:...] 태그에 대응하는 근거(해당 페이지의 핵심 요약)를 구체적으로 작성.
+""" if source_map else ""
+
+    user_msg = f"""
+주제: {topic}
+목적: {purpose}
+가설: {hypothesis}
+
+[자료 원문]
+{context}
+
+[요구사항]
+1) detailed_outline (간결):
+- 각 섹션(서론/이론적 배경/연구방법/결론)당 6~10문장 이내로 전개 전략만 요약.
+
+2) interactive_draft (석사 수준, 기본 분량 강화):
+- 각 섹션을 소절로 나누어 작성 (예시 구조를 반드시 반영):
+{outline_lines()}
+- 각 소절은 최소 {base_paras}개 문단으로 작성.
+- 각 문단은 최소 {min_chars_per_para}자 이상(한국어 기준).
+- 각 문단에 최소 1개의 인용 태그 [REF:파일명,p숫자]를 반드시 포함(가능하면 2개).
+- 논리 전개: (주장/요지 → 근거와 선행연구 연결 → 비판적 논의/한계 → 연구 공백 및 본 연구 위치화)를 균형 있게 포함.
+{source_map_req}
+{4 if source_map else 3}) REF 규칙:
+- 태그 포맷은 반드시 정확히 [REF:파일명,p숫자]
+- 파일명은 [SOURCE: ...]에 나온 파일명을 그대로 사용
+- 페이지 숫자는 [PAGE: ...]를 근거로 사용
+
+[반드시 아래 JSON으로만 출력]
+{{
+  "detailed_outline": {{
+    "서론": "...",
+    "이론적 배경": "...",
+    "연구방법": "...",
+    "결론": "..."
+  }},
+  "interactive_draft": {{
+    "서론": "...",
+    "이론적 배경": "...",
+    "연구방법": "...",
+    "결론": "..."
+  }}{source_map_schema(source_map)}
+}}
+""".strip()
+    return system_msg, user_msg
+
+
+def build_section_prompt(
+    topic, purpose, hypothesis, context, section, subsections, base_paras, min_chars_per_para, tone,
+    include_outline=True, source_map=True,
+):
+    # Same system message and [자료 원문] prefix as build_initial_prompt, so concurrent
+    # requests share a prompt prefix; only the scope at the end differs.
+    system_msg = drafting_system_msg(tone)
+    outline_req = f"""
+1) detailed_outline (간결):
+- '{section}' 섹션의 전개 전략만 6~10문장 이내로 요약.
+""" if include_outline else """
+1) detailed_outline:
+- 작성하지 말 것(빈 객체로 출력).
+"""
+    outline_json = f'"{section}": "..."' if include_outline else ""
+    source_map_req = """
+3) source_map:
+- 이번에 작성한 각 [REF:...] 태그에 대응하는 근거(해당 페이지의 핵심 요약)를 구체적으로 작성.
+""" if source_map else ""
+
+    user_msg = f"""
+주제: {topic}
+목적: {purpose}
+가설: {hypothesis}
+
+[자료 원문]
+{context}
+
+[작성 범위]
+- 전체 구조 중 '{section}' 섹션의 다음 소절만 작성: {", ".join(subsections)}
+- 다른 섹션·소절은 작성하지 말 것. 소절 제목(예: {subsections[0]})으로 각 소절을 시작할 것.
+
+[요구사항]
+{outline_req.strip()}
+
+2) interactive_draft (석사 수준, 기본 분량 강화):
+- 각 소절은 최소 {base_paras}개 문단으로 작성.
+- 각 문단은 최소 {min_chars_per_para}자 이상(한국어 기준).
+- 각 문단에 최소 1개의 인용 태그 [REF:파일명,p숫자]를 반드시 포함(가능하면 2개).
+- 논리 전개: (주장/요지 → 근거와 선행연구 연결 → 비판적 논의/한계 → 연구 공백 및 본 연구 위치화)를 균형 있게 포함.
+{source_map_req}
+{4 if source_map else 3}) REF 규칙:
+- 태그 포맷은 반드시 정확히 [REF:파일명,p숫자]
+- 파일명은 [SOURCE: ...]에 나온 파일명을 그대로 사용
+- 페이지 숫자는 [PAGE: ...]를 근거로 사용
+
+[반드시 아래 JSON으로만 출력]
+{{
+  "detailed_outline": {{{outline_json}}},
+  "interactive_draft": {{
+    "{section}": "..."
+  }}{source_map_schema(source_map)}
+}}
+""".strip()
+    return system_msg, user_msg
+
+
+def build_outline_prompt(topic, purpose, hypothesis, context, tone):
+    system_msg = drafting_system_msg(tone)
+    user_msg = f"""
+주제: {topic}
+목적: {purpose}
+가설: {hypothesis}
+
+[자료 원문]
+{context}
+
+[작성 범위]
+- detailed_outline만 작성 (초안 본문은 작성하지 말 것).
+
+[요구사항]
+- 각 섹션(서론/이론적 배경/연구방법/결론)당 6~10문장 이내로 전개 전략만 요약.
+- 소절 구조:
+{outline_lines()}
+
+[반드시 아래 JSON으로만 출력]
+{{
+  "detailed_outline": {{
+    "서론": "...",
+    "이론적 배경": "...",
+    "연구방법": "...",
+    "결론": "..."
+  }}
+}}
+""".strip()
+    return system_msg, user_msg
+
+
+def plan_section_requests(
+    topic, purpose, hypothesis, context, base_paras, min_chars_per_para, tone, granularity, source_map=True
+):
+    """Return [(section, subsection or None, (system_msg, user_msg)), ...] in outline order."""
+    requests = []
+    if granularity == "subsection":
+        requests.append((None, None, build_outline_prompt(topic, purpose, hypothesis, context, tone)))
+    for section, subs in DRAFT_OUTLINE.items():
+        if granularity == "subsection":
+            for sub in subs:
+                requests.append((section, sub, build_section_prompt(
+                    topic, purpose, hypothesis, context, section, [sub],
+                    base_paras, min_chars_per_para, tone, include_outline=False, source_map=source_map,
+                )))
+        else:
+            requests.append((section, None, build_section_prompt(
+                topic, purpose, hypothesis, context, section, subs,
+                base_paras, min_chars_per_para, tone, source_map=source_map,
+            )))
+    return requests
+
+
+# =========================================================
+# Expansion (delta requests: only new paragraphs per subsection)
+# =========================================================
+SUBSECTION_HEADING = re.compile(r"^[ \t>#*]*(\d\.\d)(?=[\s.)*])", re.MULTILINE)
+EXPAND_CONTEXT_TOKENS_PER_SECTION = 3000
+EXPAND_TAIL_CHARS = 500
+
+
+def outline_headings(text, matches, section):
+    """The matches that are headings of section: numbers from its outline, in outline order.
+
+    A body line starting with a decimal ("3.5 점 이상…") also matches SUBSECTION_HEADING; keeping the
+    longest run in outline order, preferring lines that carry the outline title, leaves such lines out.
+    """
+    subs = DRAFT_OUTLINE.get(section)
+    if not subs:
+        return matches
+    order = {sub.split(" ", 1)[0]: i for i, sub in enumerate(subs)}
+    names = {sub.split(" ", 1)[0]: sub.split(" ", 1)[1] for sub in subs}
+    candidates = [m for m in matches if m.group(1) in order]
+    chains = []  # chains[i]: ((headings, title lines), matches) of the best run ending at candidates[i]
+    for i, m in enumerate(candidates):
+        line_end = text.find("\n", m.start())
+        titled = names[m.group(1)] in text[m.start():line_end if line_end >= 0 else len(text)]
+        (count, hits), chain = max(
+            (chains[j] for j in range(i) if order[candidates[j].group(1)] < order[m.group(1)]),
+            key=lambda c: c[0], default=((0, 0), []),
+        )
+        chains.append(((count + 1, hits + titled), chain + [m]))
+    return max(chains, key=lambda c: c[0], default=((0, 0), []))[1]
+
+
+def split_subsections(text, section=None):
+    """Split a section's draft at its '1.1 …' headings -> (preamble, [(number, block), ...]).
+
+    With section, only that section's subsection numbers (DRAFT_OUTLINE) count as headings.
+    """
+    matches = list(SUBSECTION_HEADING.finditer(text))
+    if section is not None:
+        matches = outline_headings(text, matches, section)
+    if not matches:
+        return text, []
+    blocks = []
+    for i, m in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        blocks.append((m.group(1), text[m.start():end]))
+    return text[:matches[0].start()], blocks
+
+
+def last_paragraph(block, limit=EXPAND_TAIL_CHARS):
+    paras = [p.strip() for p in re.split(r"\n\s*\n", block) if p.strip()]
+    tail = paras[-1] if paras else ""
+    return tail if len(tail) <= limit else "…" + tail[-limit:]
+
+
+def section_subsections(section, text):
+    """[(number, title, tail)] for a section, from its existing headings or DRAFT_OUTLINE."""
+    _, blocks = split_subsections(text, section)
+    titles = {sub.split(" ", 1)[0]: sub for sub in DRAFT_OUTLINE.get(section, [])}
+    if blocks:
+        return [(num, titles.get(num, num), last_paragraph(block)) for num, block in blocks]
+    tail = last_paragraph(text)
+    return [(sub.split(" ", 1)[0], sub, tail) for sub in DRAFT_OUTLINE.get(section, [])]
+
+
+def build_expand_prompt(
+    topic, purpose, hypothesis, context, section, subsections, add_paras, min_chars_per_para, tone, source_map=True
+):
+    """Ask only for new paragraphs per subsection of one section (the draft itself is not resent)."""
+    system_msg = f"""
+당신은 석사학위 논문을 다수 지도한 전문 학술 에디터입니다.
+기존 초안에 이어 붙일 새 문단만 작성해 초안을 더 전문적이고 더 길게 확장합니다. 근거(REF) 밀도와 논리 연결을 강화하세요.
+{tone_instructions(tone)}
+반드시 지정한 JSON 스키마로만 출력하세요.
+""".strip()
+
+    existing = "\n\n".join(f"### {title}\n{tail}" for _, title, tail in subsections)
+    example = ",\n".join(f'    "{num}": ["새 문단", "..."]' for num, _, _ in subsections)
+    source_map_req = "\n- source_map에는 새 문단에서 사용한 REF만 작성." if source_map else ""
+    user_msg = f"""
+주제: {topic}
+목적: {purpose}
+가설: {hypothesis}
+
+[자료 원문]
+{context}
+
+[확장 범위]
+- '{section}' 섹션의 각 소절 끝에 이어 붙일 새 문단만 작성 (기존 문단은 다시 쓰지 말 것).
+
+[기존 소절의 마지막 문단(이어쓰기 참고용)]
+{existing}
+
+[확장 요구사항]
+- 각 소절마다 새 문단을 {add_paras}개씩 작성 (소절 제목은 쓰지 말 것).
+- 새로 추가되는 각 문단은 최소 {min_chars_per_para}자 이상.
+- 새 문단마다 최소 1개의 [REF:파일명,p숫자] 포함(가능하면 2개).
+- 기존 문단과 내용이 겹치지 않도록 논의를 심화·확장할 것.{source_map_req}
+
+[REF 규칙]
+- 태그 포맷은 반드시 정확히 [REF:파일명,p숫자]
+- 파일명은 [SOURCE: ...]에 나온 파일명을 그대로 사용
+- 페이지 숫자는 [PAGE: ...]를 근거로 사용
+
+[반드시 아래 JSON으로만 출력]
+{{
+  "new_paragraphs": {{
+{example}
+  }}{source_map_schema(source_map)}
+}}
+""".strip()
+    return system_msg, user_msg
+
+
+def append_paragraphs(text, new_paragraphs, section=None):
+    """Insert {number: [paragraph, ...]} at the end of each matching subsection of a section's text."""
+    preamble, blocks = split_subsections(text, section)
+    new_paragraphs = {num: [normalize_ref_tags(str(p)) for p in paras if str(p).strip()]
+                      for num, paras in (new_paragraphs or {}).items() if isinstance(paras, list)}
+    if not blocks:
+        extra = [p for paras in new_paragraphs.values() for p in paras]
+        return "\n\n".join([text.rstrip()] + extra) if extra else text
+    out = [preamble]
+    for num, block in blocks:
+        paras = new_paragraphs.pop(num, [])
+        out.append("\n\n".join([block.rstrip()] + paras) + "\n\n" if paras else block)
+    leftovers = [p for paras in new_paragraphs.values() for p in paras]
+    merged = "".join(out).rstrip()
+    return "\n\n".join([merged] + leftovers) if leftovers else merged
+
+
+def plan_expand_requests(
+    topic, purpose, hypothesis, context_text, result, add_paras, min_chars_per_para, tone, model, source_map=True
+):
+    """One delta request per section, each with only the context pages relevant to that section."""
+    index = get_context_index(context_text)
+    counter = TokenCounter(model)
+    requests = []
+    for section, text in result.get("interactive_draft", {}).items():
+        subsections = section_subsections(section, text)
+        queries = [f"{title.split(' ', 1)[-1]} {topic}" for _, title, _ in subsections]
+        context = "".join(
+            c.text for c in index.select(queries, EXPAND_CONTEXT_TOKENS_PER_SECTION, counter=counter)
+        )
+        requests.append((section, None, build_expand_prompt(
+            topic, purpose, hypothesis, context, section, subsections, add_paras, min_chars_per_para, tone,
+            source_map=source_map,
+        )))
+    return requests
+
+
+def merge_expansion(result, requests, deltas):
+    merged = {
+        "detailed_outline": dict(result.get("detailed_outline", {})),
+        "interactive_draft": dict(result.get("interactive_draft", {})),
+        "source_map": dict(result.get("source_map", {})),
+    }
+    for (section, _sub, _prompt), delta in zip(requests, deltas):
+        delta = normalize_draft(delta)
+        if not delta.get("new_paragraphs"):
+            continue
+        merged["interactive_draft"][section] = append_paragraphs(
+            merged["interactive_draft"].get(section, ""), delta.get("new_paragraphs"), section
+        )
+        for tag, summary in merge_source_maps(delta.get("source_map")).items():
+            merged["source_map"].setdefault(tag, summary)
+    return merged
+
+
+# =========================================================
+# Single-subsection rewrite / expand
+# - One request for one subsection: only the context pages most relevant to
+#   it and the end of the previous / start of the next subsection are sent,
+#   never the rest of the draft, so cost follows the subsection's size.
+# - "rewrite" replaces the subsection's paragraphs under its heading;
+#   "expand" appends new ones like a whole-draft expansion does.
+# =========================================================
+SUBSECTION_CONTEXT_TOKENS = 1500
+NEIGHBOUR_CHARS = 400
+SUBSECTION_MODES = {"rewrite": "rewritten_paragraphs", "expand": "new_paragraphs"}
+HEADING_MAX_CHARS = 60
+
+
+def subsection_title(section, number):
+    return next((sub for sub in DRAFT_OUTLINE.get(section, []) if sub.split(" ", 1)[0] == number), number)
+
+
+def subsection_neighbours(text, number, section=None, limit=NEIGHBOUR_CHARS):
+    """(the subsection's block, end of the previous block, start of the next) within a section's text."""
+    _, blocks = split_subsections(text, section)
+    numbers = [num for num, _ in blocks]
+    if number not in numbers:
+        return "", last_paragraph(text, limit), ""
+    i = numbers.index(number)
+    before = last_paragraph(blocks[i - 1][1], limit) if i > 0 else ""
+    after = blocks[i + 1][1].strip() if i + 1 < len(blocks) else ""
+    return blocks[i][1].strip(), before, after if len(after) <= limit else after[:limit] + "…"
+
+
+def build_subsection_prompt(
+    topic, purpose, hypothesis, context, section, title, current, before, after, mode, paras,
+    min_chars_per_para, tone, source_map=True,
+):
+    """Rewrite or extend one subsection; the reply holds only that subsection's paragraphs."""
+    system_msg = drafting_system_msg(tone)
+    number = title.split(" ", 1)[0]
+    key = SUBSECTION_MODES[mode]
+    if mode == "rewrite":
+        task = "더 깊이 있게 다시 작성"
+        requirements = f"""
+- 현재 소절을 대신할 문단을 최소 {paras}개 문단으로 작성 (소절 제목은 쓰지 말 것).
+- 현재 소절의 핵심 논지는 유지하되 근거와 선행연구 연결, 비판적 논의(한계/논쟁점)를 더 구체적으로 보강할 것."""
+    else:
+        task = "끝에 이어 붙일 새 문단만 작성"
+        requirements = f"""
+- 현재 소절 끝에 이어 붙일 새 문단을 {paras}개씩 작성 (기존 문단은 다시 쓰지 말 것, 소절 제목은 쓰지 말 것).
+- 기존 문단과 내용이 겹치지 않도록 논의를 심화·확장할 것."""
+    source_map_req = "\n- source_map에는 이번에 쓴 문단의 REF만 작성." if source_map else ""
+    user_msg = f"""
+주제: {topic}
+목적: {purpose}
+가설: {hypothesis}
+
+[자료 원문]
+{context}
+
+[작업 범위]
+- '{section}' 섹션의 '{title}' 소절만 {task}. 다른 소절은 작성하지 말 것.
+
+[앞 소절의 끝부분]
+{before or "(없음)"}
+
+[현재 소절]
+{current or "(아직 작성되지 않음)"}
+
+[뒤 소절의 시작 부분]
+{after or "(없음)"}
+
+[요구사항]{requirements}
+- 각 문단은 최소 {min_chars_per_para}자 이상(한국어 기준).
+- 각 문단에 최소 1개의 [REF:파일명,p숫자] 포함(가능하면 2개).
+- 앞뒤 소절과 내용이 겹치지 않고 자연스럽게 이어지도록 할 것.{source_map_req}
+
+[REF 규칙]
+- 태그 포맷은 반드시 정확히 [REF:파일명,p숫자]
+- 파일명은 [SOURCE: ...]에 나온 파일명을 그대로 사용
+- 페이지 숫자는 [PAGE: ...]를 근거로 사용
+
+[반드시 아래 JSON으로만 출력]
+{{
+  "{key}": {{
+    "{number}": ["문단", "..."]
+  }}{source_map_schema(source_map)}
+}}
+""".strip()
+    return system_msg, user_msg
+
+
+def plan_subsection_request(
+    topic, purpose, hypothesis, context_text, result, section, number, mode, add_paras, base_paras,
+    min_chars_per_para, tone, model, source_map=True,
+):
+    """(section, number, prompt) with the context pages most relevant to that one subsection."""
+    title = subsection_title(section, number)
+    current, before, after = subsection_neighbours(
+        result.get("interactive_draft", {}).get(section, ""), number, section
+    )
+    queries = [f"{title.split(' ', 1)[-1]} {topic}"]
+    if current:
+        queries.append(REF_SPLIT_PATTERN.sub(" ", current))
+    context = "".join(
+        c.text for c in get_context_index(context_text).select(
+            queries, SUBSECTION_CONTEXT_TOKENS, counter=TokenCounter(model)
+        )
+    )
+    body = current.split("\n", 1)[1] if "\n" in current else ""
+    paras = max(base_paras, len(split_paragraphs(body))) if mode == "rewrite" else add_paras
+    return section, number, build_subsection_prompt(
+        topic, purpose, hypothesis, context, section, title, current, before, after, mode, paras,
+        min_chars_per_para, tone, source_map,
+    )
+
+
+def subsection_paragraphs(delta, number, mode):
+    """The paragraphs a subsection reply holds for number (or its only entry, however it was keyed)."""
+    paragraphs = normalize_draft(delta).get(SUBSECTION_MODES[mode]) or {}
+    if number in paragraphs:
+        return paragraphs[number]
+    matching = [paras for key, paras in paragraphs.items() if key.split(" ", 1)[0] == number]
+    if not matching and len(paragraphs) == 1:
+        matching = list(paragraphs.values())
+    return matching[0] if matching else []
+
+
+def has_subsection(text, number, section=None):
+    """Whether a section's text has a '1.1 …' heading for number (rewrite and expand need one)."""
+    return any(num == number for num, _ in split_subsections(text, section)[1])
+
+
+def subsection_heading(block, title):
+    """The heading of a subsection block: its number and title, without body text on the same line."""
+    line = block.split("\n", 1)[0].rstrip()
+    m = SUBSECTION_HEADING.match(line)
+    name = title.split(" ", 1)[1] if " " in title else ""
+    start = line.find(name, m.end()) if name else -1
+    if start >= 0:
+        end = start + len(name)
+        return line[:end] + re.match(r"[*_]*", line[end:]).group(0)
+    if len(line) <= HEADING_MAX_CHARS and not REF_SPLIT_PATTERN.search(line):
+        return line
+    return line[:m.start(1)] + title
+
+
+def replace_subsection(text, number, title, paragraphs, section=None):
+    """Replace the paragraphs under a subsection's heading; the heading must be in the text."""
+    preamble, blocks = split_subsections(text, section)
+    body = "\n\n".join(paragraphs)
+    for i, (num, block) in enumerate(blocks):
+        if num == number:
+            heading = subsection_heading(block, title)
+            blocks[i] = (num, f"{heading}\n{body}\n\n" if i + 1 < len(blocks) else f"{heading}\n{body}")
+            return preamble + "".join(b for _, b in blocks)
+    raise ValueError(f"'{title}' 소절 제목을 본문에서 찾을 수 없습니다.")
+
+
+def merge_subsection(result, request, delta, mode):
+    section, number, _prompt = request
+    merged = {
+        "detailed_outline": dict(result.get("detailed_outline", {})),
+        "interactive_draft": dict(result.get("interactive_draft", {})),
+        "source_map": dict(result.get("source_map", {})),
+    }
+    paragraphs = [normalize_ref_tags(p) for p in subsection_paragraphs(delta, number, mode)]
+    if not paragraphs:
+        return merged
+    text = merged["interactive_draft"].get(section, "")
+    if mode == "rewrite":
+        merged["interactive_draft"][section] = replace_subsection(
+            text, number, subsection_title(section, number), paragraphs, section
+        )
+    else:
+        merged["interactive_draft"][section] = append_paragraphs(text, {number: paragraphs}, section)
+    merged["source_map"].update(merge_source_maps(normalize_draft(delta).get("source_map")))
+    return merged
+
+
+# =========================================================
+# OpenAI calls (shared client, rate limiter and response cache)
+# =========================================================
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+
+def chat_messages(system_msg, user_msg):
+    return [{"role": "system", "content": system_msg}, {"role": "user", "content": user_msg}]
+
+
+def cached_response(use_cache, model, messages, temperature, usage):
+    """Return (cache key or None, cached content or None) for a JSON chat request."""
+    if not use_cache:
+        return None, None
+    cache = get_response_cache()
+    key = cache.key(model, messages, JSON_RESPONSE_FORMAT, temperature)
+    content = cache.get(key)
+    if content is not None:
+        metrics.record_request(model, outcome="cached")
+        if usage is not None:
+            usage["cache_hits"] = usage.get("cache_hits", 0) + 1
+    return key, content
+
+
+def add_usage(usage, resp_usage):
+    if usage is not None and resp_usage is not None:
+        usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + resp_usage.prompt_tokens
+        usage["completion_tokens"] = usage.get("completion_tokens", 0) + resp_usage.completion_tokens
+
+
+def parse_reply(content, usage):
+    """(result, clean) for a reply; repaired replies are counted in usage and never cached."""
+    result, repaired = parse_model_json(content)
+    if repaired:
+        metrics.record_repair("recovered" if result else "failed")
+        if usage is not None:
+            usage["repaired_responses"] = usage.get("repaired_responses", 0) + 1
+    return result, not repaired
+
+
+def call_openai_json(
+    api_key, model, system_msg, user_msg, temperature=0.45, usage=None, use_cache=True, session="default",
+    accept=None, job=None,
+):
+    """One JSON chat request; the reply is cached only if it parsed cleanly and accept(result) holds.
+
+    With a job the request goes through the async pool, so cancelling the job aborts it in flight.
+    """
+    messages = chat_messages(system_msg, user_msg)
+    key, cached = cached_response(use_cache, model, messages, temperature, usage)
+    if cached is not None:
+        return json.loads(cached)
+    estimated_tokens = count_messages(TokenCounter(model), messages)
+    kwargs = {"model": model, "messages": messages, "response_format": JSON_RESPONSE_FORMAT, "temperature": temperature}
+    if job is None:
+        resp = create_chat_completion(api_key, session, estimated_tokens, **kwargs)
+    else:
+        completions = iter_chat_completions(
+            api_key, session, [(estimated_tokens, kwargs)], check=job.raise_if_cancelled
+        )
+        try:
+            _, resp = next(completions)
+        finally:
+            completions.close()
+    add_usage(usage, resp.usage)
+    content = resp.choices[0].message.content
+    result, clean = parse_reply(content, usage)
+    if key and clean and (accept is None or accept(result)):
+        get_response_cache().put(key, content)
+    return result
+
+
+def call_openai_json_stream(
+    api_key, model, system_msg, user_msg, temperature=0.45, usage=None, on_value=None, on_close=None,
+    use_cache=True, session="default", accept=None, job=None,
+):
+    messages = chat_messages(system_msg, user_msg)
+    parser = IncrementalJSONParser(on_value=on_value, on_close=on_close)
+    key, cached = cached_response(use_cache, model, messages, temperature, usage)
+    if cached is not None:
+        parser.feed(cached)
+        return json.loads(cached)
+    stream = create_chat_completion(
+        api_key,
+        session,
+        estimated_tokens=count_messages(TokenCounter(model), messages),
+        model=model,
+        messages=messages,
+        response_format=JSON_RESPONSE_FORMAT,
+        temperature=temperature,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    parts = []
+    try:
+        for chunk in stream:
+            if job is not None:
+                job.raise_if_cancelled()
+            add_usage(usage, chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                delta = chunk.choices[0].delta.content
+                parts.append(delta)
+                parser.feed(delta)
+    finally:
+        stream.close()
+    content = "".join(parts)
+    result, clean = parse_reply(content, usage)
+    if key and clean and (accept is None or accept(result)):
+        get_response_cache().put(key, content)
+    return result
+
+
+def call_openai_json_many(
+    api_key, model, prompts, temperature=0.45, max_concurrency=4, usage=None, on_result=None,
+    use_cache=True, session="default", accept=None, clean=None, errors=None, job=None,
+):
+    """Run several JSON chat requests concurrently (at most max_concurrency in flight).
+
+    Returns the parsed results in prompt order; on_result(i, result) is called as each completes.
+    A reply is cached only if it parsed cleanly and accept(i, result) holds. If clean is a set,
+    the indexes of replies that parsed cleanly (or came from the cache) are added to it.
+    If errors is a dict, a request that fails for good gets {} as its result and {i: exception}
+    in errors (counted in usage["failed_requests"]) instead of failing the whole batch.
+    With a job, cancelling it aborts the requests still in flight (JobCancelled is raised).
+    """
+    counter = TokenCounter(model)
+    results = [None] * len(prompts)
+    keys, pending = {}, []
+    for i, (system_msg, user_msg) in enumerate(prompts):
+        messages = chat_messages(system_msg, user_msg)
+        key, cached = cached_response(use_cache, model, messages, temperature, usage)
+        if cached is not None:
+            results[i] = json.loads(cached)
+            if clean is not None:
+                clean.add(i)
+            if on_result:
+                on_result(i, results[i])
+            continue
+        keys[len(pending)] = (i, key)
+        pending.append((
+            count_messages(counter, messages),
+            {"model": model, "messages": messages, "response_format": JSON_RESPONSE_FORMAT, "temperature": temperature},
+        ))
+
+    completions = iter_chat_completions(
+        api_key, session, pending, max_concurrency, return_exceptions=errors is not None,
+        check=job.raise_if_cancelled if job is not None else None,
+    )
+    try:
+        for j, resp in completions:
+            i, key = keys[j]
+            if isinstance(resp, Exception):
+                errors[i] = resp
+                results[i] = {}
+                if usage is not None:
+                    usage["failed_requests"] = usage.get("failed_requests", 0) + 1
+                if on_result:
+                    on_result(i, results[i])
+                continue
+            add_usage(usage, resp.usage)
+            content = resp.choices[0].message.content
+            results[i], parsed = parse_reply(content, usage)
+            if parsed and clean is not None:
+                clean.add(i)
+            if key and parsed and (accept is None or accept(i, results[i])):
+                get_response_cache().put(key, content)
+            if on_result:
+                on_result(i, results[i])
+    finally:
+        completions.close()
+    return results
+
+
+# =========================================================
+# Merging partial results
+# =========================================================
+REF_TAG_PATTERN = re.compile(r"\[REF:\s*([^,\]]+?)\s*,\s*p\.?\s*(\d+)\s*\]")
+
+
+def normalize_ref_tags(text):
+    return REF_TAG_PATTERN.sub(lambda m: f"[REF:{m.group(1)},p{m.group(2)}]", text)
+
+
+def merge_source_maps(*maps):
+    merged = {}
+    for source_map in maps:
+        for tag, summary in (source_map or {}).items():
+            tag = normalize_ref_tags(tag)
+            if len(str(summary)) > len(str(merged.get(tag, ""))):
+                merged[tag] = summary
+    return merged
+
+
+def merge_section_results(requests, results, base=None):
+    """Merge per-section/per-subsection results (None = not finished yet) into the draft schema.
+
+    base: an earlier draft whose sections are kept where no result replaces them (targeted repair).
+    """
+    base = normalize_draft(base, DRAFT_OUTLINE)
+    outline = dict(base.get("detailed_outline") or {})
+    merged = {"detailed_outline": {}, "interactive_draft": {}, "source_map": dict(base.get("source_map") or {})}
+    drafts = {}
+    for (section, _sub, _prompt), part in zip(requests, results):
+        if not part:
+            continue
+        part = normalize_draft(part, DRAFT_OUTLINE)
+        for key, text in (part.get("detailed_outline") or {}).items():
+            outline.setdefault(key, text)
+        if section is not None:
+            draft = part.get("interactive_draft") or {}
+            text = draft.get(section) or "\n\n".join(draft.values())
+            if text:
+                drafts.setdefault(section, []).append(normalize_ref_tags(text))
+        merged["source_map"] = merge_source_maps(merged["source_map"], part.get("source_map"))
+    merged["detailed_outline"] = {**{s: outline[s] for s in DRAFT_OUTLINE if s in outline}, **outline}
+    base_draft = base.get("interactive_draft") or {}
+    for section in DRAFT_OUTLINE:
+        if section in drafts:
+            merged["interactive_draft"][section] = "\n\n".join(drafts[section])
+        elif section in base_draft:
+            merged["interactive_draft"][section] = base_draft[section]
+    for section, text in base_draft.items():
+        merged["interactive_draft"].setdefault(section, text)
+    return merged
+
+
+# =========================================================
+# Validation and targeted repair
+# - Replies are parsed leniently (draft_schema.parse_model_json) and only
+#   clean replies that contain what was asked for are cached.
+# - A request whose reply still lacks its part is sent once more on its own;
+#   a whole-draft reply that lost sections gets one request per missing
+#   section. Everything that did parse is kept.
+# =========================================================
+def part_complete(request, part):
+    if request[0] is None:  # the outline request of the subsection mode
+        return not missing_sections(normalize_draft(part, DRAFT_OUTLINE), DRAFT_OUTLINE, "detailed_outline")
+    return bool(normalize_draft(part, DRAFT_OUTLINE).get("interactive_draft"))
+
+
+def delta_complete(request, delta):
+    return bool(normalize_draft(delta).get("new_paragraphs"))
+
+
+def draft_complete(result):
+    return not missing_sections(normalize_draft(result, DRAFT_OUTLINE), DRAFT_OUTLINE)
+
+
+def plan_repair_requests(
+    topic, purpose, hypothesis, context, base_paras, min_chars_per_para, tone, result, source_map=True
+):
+    """[(section, None, prompt), ...] for what a whole-draft result is missing, in outline order."""
+    result = normalize_draft(result, DRAFT_OUTLINE)
+    missing = missing_sections(result, DRAFT_OUTLINE)
+    outline = result.get("detailed_outline") or {}
+    requests = [
+        (section, None, build_section_prompt(
+            topic, purpose, hypothesis, context, section, DRAFT_OUTLINE[section],
+            base_paras, min_chars_per_para, tone, include_outline=section not in outline, source_map=source_map,
+        ))
+        for section in missing
+    ]
+    if any(s not in missing for s in missing_sections(result, DRAFT_OUTLINE, "detailed_outline")):
+        requests.insert(0, (None, None, build_outline_prompt(topic, purpose, hypothesis, context, tone)))
+    return requests
+
+
+def retry_incomplete(
+    api_key, model, requests, results, is_complete, temperature, max_concurrency, usage, on_result, session,
+    use_cache=True, clean=None, errors=None, job=None,
+):
+    """Send the requests whose results fail is_complete(request, result) once more; results is updated in place.
+
+    clean, a set as for call_openai_json_many, is kept in step with the results that get replaced;
+    so is errors, a dict as for call_openai_json_many. job is passed on as well.
+    """
+    retry = [i for i, (request, result) in enumerate(zip(requests, results)) if not is_complete(request, result)]
+    if not retry:
+        return results
+    metrics.record_repair("retried", len(retry))
+    if usage is not None:
+        usage["repair_requests"] = usage.get("repair_requests", 0) + len(retry)
+
+    retried_clean, retried_errors = set(), {} if errors is not None else None
+
+    def on_retry(j, result):
+        if is_complete(requests[retry[j]], result):
+            results[retry[j]] = result
+            if clean is not None:
+                (clean.add if j in retried_clean else clean.discard)(retry[j])
+            if errors is not None:
+                errors.pop(retry[j], None)
+            on_result(retry[j], result)
+
+    call_openai_json_many(
+        api_key, model, [requests[i][2] for i in retry],
+        temperature=temperature, max_concurrency=max_concurrency, usage=usage, on_result=on_retry,
+        use_cache=use_cache, session=session, accept=lambda j, result: is_complete(requests[retry[j]], result),
+        clean=retried_clean, errors=retried_errors, job=job,
+    )
+    if errors is not None:
+        errors.update((retry[j], e) for j, e in retried_errors.items())
+    return results
+
+
+def raise_if_all_failed(errors, count):
+    """Re-raise the first API error when all count requests failed (a bad key should fail the job)."""
+    if errors and len(errors) == count:
+        raise errors[min(errors)]
+
+
+# =========================================================
+# Local source map
+# - Every REF tag in the draft is checked against the pages that were actually
+#   sent as context, and its popover gets the most relevant excerpt of that
+#   page. Tags pointing at files/pages the model never saw are flagged.
+# - With source_map=False the model is not asked for summaries at all, which
+#   saves a large share of the output tokens.
+# =========================================================
+SOURCE_EXCERPT_CHARS = 400
+_EXCERPT_UNIT = re.compile(r"(?<=[.!?。])\s+|\n+")
+
+
+def source_key(name):
+    """File names as the model tends to vary them: case, surrounding spaces, a missing extension."""
+    name = name.strip().lower()
+    return name[:-4] if name.endswith(".pdf") else name
+
+
+def page_excerpt(content, query, limit=SOURCE_EXCERPT_CHARS):
+    """The run of sentences/lines (up to about limit chars) sharing the most terms with query."""
+    units = [u.strip() for u in _EXCERPT_UNIT.split(content) if u.strip()]
+    if not units:
+        return ""
+    terms = set(tokenize(query))
+    unit_terms = [set(tokenize(u)) for u in units]
+    best, best_score = (0, 1), -1
+    for start in range(len(units)):
+        end, size, seen = start, 0, set()
+        while end < len(units) and (end == start or size + len(units[end]) <= limit):
+            size += len(units[end]) + 1
+            seen |= unit_terms[end]
+            end += 1
+        score = len(seen & terms)
+        if score > best_score:
+            best, best_score = (start, end), score
+    excerpt = " ".join(units[best[0]:best[1]])
+    if len(excerpt) > limit:
+        excerpt = excerpt[:limit].rstrip() + "…"
+    return ("…" if best[0] else "") + excerpt
+
+
+def resolve_sources(result, context_text):
+    """Add source_excerpts {tag: excerpt} and invalid_refs [tag, ...] for the REF tags in the draft."""
+    pages = {(source_key(name), page_no): content for _, name, page_no, content in parse_context_chunks(context_text)}
+    citing = {}
+    for text in (result.get("interactive_draft") or {}).values():
+        for paragraph in split_paragraphs(str(text)):
+            for tag in REF_SPLIT_PATTERN.findall(paragraph):
+                citing.setdefault(tag, []).append(paragraph)
+
+    excerpts, invalid = {}, []
+    for tag, paragraphs in citing.items():
+        m = REF_TAG_PATTERN.fullmatch(tag)
+        content = pages.get((source_key(m.group(1)), int(m.group(2)))) if m else None
+        if content is None:
+            invalid.append(tag)
+        else:
+            excerpts[tag] = page_excerpt(content, " ".join(REF_SPLIT_PATTERN.sub(" ", p) for p in paragraphs))
+    return {
+        **result,
+        "source_map": result.get("source_map") or {},
+        "source_excerpts": excerpts,
+        "invalid_refs": invalid,
+    }
+
+
+# =========================================================
+# Generation
+# =========================================================
+class PartialDraft:
+    """Collects IncrementalJSONParser events of a streamed draft and publishes them to the job."""
+
+    def __init__(self, job):
+        self.job = job
+        self.result = {"detailed_outline": {}, "interactive_draft": {}, "source_map": {}}
+
+    def on_value(self, path, value):
+        if len(path) != 2 or not isinstance(value, str) or path[0] not in self.result:
+            return
+        group, key = path
+        self.result[group][key] = value
+        self.job.publish({g: dict(values) for g, values in self.result.items()})
+
+
+def generate_json(api_key, model, system_msg, user_msg, temperature, usage, stream, job, session, use_cache=True):
+    if not stream:
+        return call_openai_json(
+            api_key=api_key, model=model, system_msg=system_msg, user_msg=user_msg,
+            temperature=temperature, usage=usage, use_cache=use_cache, session=session, accept=draft_complete,
+            job=job,
+        )
+    draft = PartialDraft(job)
+    return call_openai_json_stream(
+        api_key=api_key, model=model, system_msg=system_msg, user_msg=user_msg,
+        temperature=temperature, usage=usage, on_value=draft.on_value, use_cache=use_cache, session=session,
+        accept=draft_complete, job=job,
+    )
+
+
+def requests_done(parts):
+    return f"{sum(part is not None for part in parts)}/{len(parts)} 요청 완료"
+
+
+def generate_draft_concurrently(
+    api_key, model, requests, temperature, max_concurrency, usage, job, session, use_cache=True, base=None
+):
+    """Run section requests concurrently and merge them (over base, when repairing a draft)."""
+    results = [None] * len(requests)
+
+    def on_result(i, part):
+        results[i] = part
+        job.publish(merge_section_results(requests, results, base))
+        job.set_stage("generating", requests_done(results))
+
+    errors = {}
+    results = call_openai_json_many(
+        api_key, model, [prompt for _, _, prompt in requests],
+        temperature=temperature, max_concurrency=max_concurrency, usage=usage, on_result=on_result,
+        use_cache=use_cache, session=session, accept=lambda i, part: part_complete(requests[i], part),
+        errors=errors, job=job,
+    )
+    results = retry_incomplete(
+        api_key, model, requests, results, part_complete, temperature, max_concurrency, usage, on_result,
+        session, use_cache, errors=errors, job=job,
+    )
+    if base is None:
+        raise_if_all_failed(errors, len(requests))
+    job.set_stage("merging")
+    with metrics.span("merge"):
+        return merge_section_results(requests, results, base)
+
+
+def expand_draft_concurrently(
+    api_key, model, result, requests, temperature, max_concurrency, usage, job, session, use_cache=True
+):
+    deltas = [None] * len(requests)
+
+    def on_result(i, delta):
+        deltas[i] = delta
+        job.publish(merge_expansion(result, requests, deltas))
+        job.set_stage("generating", requests_done(deltas))
+
+    errors = {}
+    deltas = call_openai_json_many(
+        api_key, model, [prompt for _, _, prompt in requests],
+        temperature=temperature, max_concurrency=max_concurrency, usage=usage, on_result=on_result,
+        use_cache=use_cache, session=session, accept=lambda i, delta: delta_complete(requests[i], delta),
+        errors=errors, job=job,
+    )
+    deltas = retry_incomplete(
+        api_key, model, requests, deltas, delta_complete, temperature, max_concurrency, usage, on_result,
+        session, use_cache, errors=errors, job=job,
+    )
+    raise_if_all_failed(errors, len(requests))
+    job.set_stage("merging")
+    with metrics.span("merge"):
+        return merge_expansion(result, requests, deltas)
+
+
+# =========================================================
+# Map-reduce context (per-paper notes)
+# - Map: a cheap model condenses each paper, one request per page group, into
+#   short notes tagged with their page. Requests run concurrently, and the
+#   notes are cached by file hash and map model (also when the response cache
+#   is off), independent of the file name and the research topic. Groups
+#   without notes are asked once more, and a paper's notes are only cached
+#   when every group's reply parsed cleanly and had notes.
+# - Reduce: the draft prompts get the notes, as one [SOURCE, PAGE] chunk per
+#   cited page, instead of the raw pages; the same budget then covers far more
+#   papers, and REF tags and popovers keep working on the notes.
+# =========================================================
+NOTES_VERSION = "n1"
+MAP_MAX_PAGES_EACH = 60
+MAP_GROUP_TOKENS = 6000
+MAP_NOTES_PER_GROUP = 8
+
+
+def notes_key(digest, model):
+    return f"notes:{NOTES_VERSION}:{model}:{MAP_MAX_PAGES_EACH}:{digest}"
+
+
+def plan_note_groups(pages, counter, group_tokens=MAP_GROUP_TOKENS):
+    """Split [(page_no, text), ...] into consecutive groups of about group_tokens each."""
+    groups, current, used = [], [], 0
+    for page_no, text in pages:
+        if not text:
+            continue
+        size = counter.count(text)
+        if size > group_tokens:
+            text, size = counter.truncate(text, group_tokens), group_tokens
+        if current and used + size > group_tokens:
+            groups.append(current)
+            current, used = [], 0
+        current.append((page_no, text))
+        used += size
+    if current:
+        groups.append(current)
+    return groups
+
+
+def build_notes_prompt(group):
+    system_msg = """
+당신은 학술 문헌을 정리하는 연구 조교입니다.
+주어진 논문 페이지의 핵심 내용을 근거 페이지가 표시된 짧은 노트로 압축합니다.
+반드시 지정한 JSON 스키마로만 출력하세요.
+""".strip()
+    pages = "".join(f"\n[PAGE: {page_no}]\n{text}\n" for page_no, text in group)
+    user_msg = f"""
+[논문 페이지]
+{pages}
+[요구사항]
+- 연구 질문·목적, 핵심 개념 정의, 이론적 틀, 방법(설계·표본·측정), 주요 결과와 수치, 한계·시사점 중 이 페이지들에 있는 내용만 노트로 정리.
+- 노트는 최대 {MAP_NOTES_PER_GROUP}개, 각 1~2문장의 한국어로 작성하고 고유명사·수치·저자명은 원문대로 유지.
+- page에는 그 노트의 근거가 된 [PAGE: ...] 번호를 적을 것.
+- 페이지에 없는 내용을 추측해 쓰지 말 것.
+
+[반드시 아래 JSON으로만 출력]
+{{
+  "notes": [
+    {{"page": 1, "note": "..."}}
+  ]
+}}
+""".strip()
+    return system_msg, user_msg
+
+
+def parse_notes(result, group):
+    """[(page_no, note), ...] from a map response; notes citing a page outside the group go to its first page."""
+    pages = [page_no for page_no, _ in group]
+    notes = []
+    for entry in (result or {}).get("notes") or []:
+        if not isinstance(entry, dict) or not str(entry.get("note", "")).strip():
+            continue
+        try:
+            page_no = int(entry.get("page"))
+        except (TypeError, ValueError):
+            page_no = pages[0]
+        notes.append((page_no if page_no in pages else pages[0], str(entry["note"]).strip()))
+    return notes
+
+
+def condense_papers(api_key, session, items, model, max_concurrency, usage, job, use_cache=True, errors=None, compaction=None):
+    """{file index: [(page_no, note), ...]} for every paper that could be read (empty if none came back).
+
+    Notes are cached per file hash, so only new papers are extracted and condensed.
+    """
+    cache, counter = get_page_cache(), TokenCounter(model)
+    notes, missing = {}, []
+    for file_index, (_, data) in enumerate(items):
+        cached = cache.get(notes_key(content_hash(data), model))
+        if cached is None:
+            missing.append(file_index)
+        else:
+            notes[file_index] = [tuple(note) for note in json.loads(cached)]
+    with metrics.span("extract"):
+        extracted = extract_files(
+            [items[i] for i in missing], MAP_MAX_PAGES_EACH, compaction=compaction
+        ) if missing else []
+
+    requests = []
+    for file_index, (name, pages, error) in zip(missing, extracted):
+        if error:
+            if errors is not None:
+                errors.append((name, error))
+            continue
+        notes[file_index] = []
+        for group in plan_note_groups(pages, counter):
+            requests.append((file_index, group, build_notes_prompt(group)))
+    if not requests:
+        return notes
+
+    results = [None] * len(requests)
+    job.set_stage("condensing", requests_done(results))
+
+    def on_result(i, part):
+        results[i] = part
+        job.set_stage("condensing", requests_done(results))
+
+    def is_complete(request, result):
+        return bool(parse_notes(result, request[1]))
+
+    clean, failed = set(), {}
+    with metrics.span("condense"):
+        results = call_openai_json_many(
+            api_key, model, [prompt for _, _, prompt in requests],
+            temperature=0.2, max_concurrency=max_concurrency, usage=usage, on_result=on_result,
+            use_cache=use_cache, session=session, accept=lambda i, result: is_complete(requests[i], result),
+            clean=clean, errors=failed, job=job,
+        )
+        results = retry_incomplete(
+            api_key, model, requests, results, is_complete, 0.2, max_concurrency, usage, on_result, session,
+            use_cache, clean=clean, errors=failed, job=job,
+        )
+        if not any(notes.values()):  # no cached notes either
+            raise_if_all_failed(failed, len(requests))
+    complete = {}
+    for i, ((file_index, group, _), result) in enumerate(zip(requests, results)):
+        notes[file_index].extend(parse_notes(result, group))
+        complete[file_index] = complete.get(file_index, True) and i in clean and is_complete(requests[i], result)
+    for file_index, cacheable in complete.items():
+        notes[file_index].sort(key=lambda note: note[0])
+        if cacheable:
+            cache.put(
+                notes_key(content_hash(items[file_index][1]), model), json.dumps(notes[file_index], ensure_ascii=False)
+            )
+    return notes
+
+
+def notes_context(items, notes, budget, counter, queries=None):
+    """The notes as [SOURCE, PAGE] chunks (one per cited page) that fit budget; most relevant first with queries."""
+    docs = []
+    for file_index, file_notes in sorted(notes.items()):
+        by_page = {}
+        for page_no, note in file_notes:
+            by_page.setdefault(page_no, []).append(f"- {note}")
+        docs.extend((file_index, items[file_index][0], page_no, "\n".join(lines)) for page_no, lines in sorted(by_page.items()))
+    chunks = BM25Index(docs).select(queries or [], budget, counter=counter)
+    return "".join(c.text for c in chunks)
+
+
+# =========================================================
+# Jobs
+# - run_*_job(job, ...) is what the app's JobRunner and the batch CLI execute;
+#   the returned "state" holds the app's session-state updates. The context
+#   goes there as a handle into the shared blobs.ContextStore.
+# - With a project_id, the result is also saved as a new version of that
+#   project in the projects.ProjectStore before the job finishes.
+# =========================================================
+def save_project(project_id, result, expansion_level, report, session, warnings, inputs=None, context=None):
+    """Save a result version; a storage failure becomes a warning, the draft itself is still returned."""
+    try:
+        with metrics.span("save"):
+            return get_project_store().save(
+                project_id, result, expansion_level, report, session=session, inputs=inputs, context=context
+            )
+    except (sqlite3.Error, OSError) as e:
+        warnings.append(f"프로젝트를 저장하지 못했습니다: {e}")
+        return None
+
+
+def run_generate_job(
+    job, api_key, session, items, inputs, use_retrieval, granularity, max_concurrency, context_token_budget,
+    stream, use_cache, source_map=True, condense_model=None, project_id=None,
+):
+    """Extract, prompt and generate one draft.
+
+    granularity: None for a single request, "section" or "subsection" for concurrent requests.
+    source_map: False leaves REF summaries out of the requested schema (popovers use page excerpts).
+    condense_model: map-reduce mode; the draft is written from per-paper notes made with this model.
+    """
+    topic, purpose, hypothesis = inputs["topic"], inputs["purpose"], inputs["hypothesis"]
+    base_paras, min_chars_per_para = inputs["base_paras"], inputs["min_chars_per_para"]
+    tone, model = inputs["tone_setting"], inputs["model_name"]
+
+    with metrics.trace("generate", job=job.id, model=model, granularity=granularity or "single") as trace:
+        job.set_stage("extracting")
+        counter, plan = plan_initial_budget(
+            topic, purpose, hypothesis, base_paras, min_chars_per_para, tone, model, context_token_budget,
+            source_map,
+        )
+        extract_errors, compaction, map_usage = [], {}, {}
+        if condense_model:
+            notes = condense_papers(
+                api_key, session, items, condense_model, max_concurrency, map_usage, job, use_cache,
+                extract_errors, compaction,
+            )
+            context = notes_context(
+                items, notes, plan["input_budget_tokens"], counter,
+                queries=retrieval_queries(topic, purpose, hypothesis) if use_retrieval else None,
+            )
+        else:
+            with metrics.span("extract"):
+                context = get_combined_text_with_meta(
+                    items,
+                    max_pages_each=RETRIEVAL_MAX_PAGES_EACH if use_retrieval else 10,
+                    errors=extract_errors,
+                    queries=retrieval_queries(topic, purpose, hypothesis) if use_retrieval else None,
+                    max_tokens=plan["input_budget_tokens"],
+                    model=model,
+                    compaction=compaction,
+                )
+        warnings = [f"'{file_name}' 텍스트 추출에 실패하여 제외했습니다: {error}" for file_name, error in extract_errors]
+        if condense_model:
+            warnings.extend(
+                f"'{items[i][0]}'에서 노트를 만들지 못해 자료에서 빠졌습니다."
+                for i, file_notes in sorted(notes.items()) if not file_notes
+            )
+
+        job.set_stage("prompting")
+        with metrics.span("prompt"):
+            if granularity is None:
+                requests = None
+                prompts = [build_initial_prompt(
+                    topic, purpose, hypothesis, context, base_paras, min_chars_per_para, tone, source_map
+                )]
+            else:
+                requests = plan_section_requests(
+                    topic, purpose, hypothesis, context, base_paras, min_chars_per_para, tone, granularity,
+                    source_map,
+                )
+                prompts = [prompt for _, _, prompt in requests]
+
+        usage = {}
+        with metrics.span("generate"):
+            if requests is None:
+                job.set_stage("generating")
+                system_msg, user_msg = prompts[0]
+                result = normalize_draft(generate_json(
+                    api_key, model, system_msg, user_msg, 0.45, usage, stream, job, session, use_cache
+                ), DRAFT_OUTLINE)
+                repairs = plan_repair_requests(
+                    topic, purpose, hypothesis, context, base_paras, min_chars_per_para, tone, result, source_map
+                )
+                if repairs:
+                    metrics.record_repair("retried", len(repairs))
+                    usage["repair_requests"] = usage.get("repair_requests", 0) + len(repairs)
+                    job.set_stage("generating", requests_done([None] * len(repairs)))
+                    result = generate_draft_concurrently(
+                        api_key, model, repairs, 0.45, max_concurrency, usage, job, session, use_cache, base=result
+                    )
+                job.set_stage("merging")
+            else:
+                job.set_stage("generating", requests_done([None] * len(requests)))
+                result = generate_draft_concurrently(
+                    api_key, model, requests, 0.45, max_concurrency, usage, job, session, use_cache
+                )
+        missing = missing_sections(result, DRAFT_OUTLINE)
+        if missing:
+            warnings.append(f"모델 응답 오류로 다음 섹션을 작성하지 못했습니다: {', '.join(missing)}")
+        with metrics.span("sources"):
+            result = resolve_sources(result, context)
+        report = token_report("generate", counter, prompts, usage, plan=plan, context=context)
+        report.update(compaction_report(compaction, len(context), report["context_tokens"]))
+        if condense_model:
+            report.update(map_report(condense_model, map_usage, notes))
+        trace.attrs.update(
+            context_chars=len(context),
+            context_tokens=report["context_tokens"],
+            prompt_tokens_local=report["prompt_tokens_local"],
+            compaction_chars_saved=report["compaction_chars_saved"],
+            compaction_tokens_saved=report["compaction_tokens_saved"],
+        )
+        version = save_project(
+            project_id, result, 0, report, session, warnings, inputs=inputs, context=context
+        ) if project_id else None
+    return {
+        "state": {
+            "result": result,
+            "context": get_context_store().put(context),
+            "expansion_level": 0,
+            "last_inputs": inputs,
+            "token_report": report,
+            "last_trace": trace.to_dict(),
+            "project_id": project_id,
+            "project_version": version,
+        },
+        "warnings": warnings,
+    }
+
+
+def run_expand_job(
+    job, api_key, session, inputs, context, result, expansion_level, add_paras, min_chars_per_para,
+    max_concurrency, use_cache, source_map=True, project_id=None,
+):
+    model = inputs["model_name"]
+    with metrics.trace("expand", job=job.id, model=model) as trace:
+        job.set_stage("prompting")
+        with metrics.span("prompt"):
+            requests = plan_expand_requests(
+                inputs["topic"], inputs["purpose"], inputs["hypothesis"], context, result,
+                add_paras, min_chars_per_para, inputs["tone_setting"], model, source_map,
+            )
+        job.set_stage("generating", requests_done([None] * len(requests)))
+        usage = {}
+        with metrics.span("generate"):
+            result = expand_draft_concurrently(
+                api_key, model, result, requests, 0.50, max_concurrency, usage, job, session, use_cache
+            )
+        with metrics.span("sources"):
+            result = resolve_sources(result, context)
+        report = token_report("expand", TokenCounter(model), [prompt for _, _, prompt in requests], usage)
+        trace.attrs.update(prompt_tokens_local=report["prompt_tokens_local"])
+        warnings = []
+        version = save_project(
+            project_id, result, expansion_level + 1, report, session, warnings
+        ) if project_id else None
+    return {
+        "state": {
+            "result": result,
+            "expansion_level": expansion_level + 1,
+            "token_report": report,
+            "last_trace": trace.to_dict(),
+            "project_version": version,
+        },
+        "warnings": warnings,
+    }
+
+
+def run_subsection_job(
+    job, api_key, session, inputs, context, result, section, number, mode, add_paras, base_paras,
+    min_chars_per_para, use_cache, source_map=True, project_id=None, expansion_level=0,
+):
+    """Rewrite ("rewrite") or extend ("expand") one subsection of a draft with a single request."""
+    model = inputs["model_name"]
+
+    def is_complete(request, delta):
+        return bool(subsection_paragraphs(delta, number, mode))
+
+    if not has_subsection(result.get("interactive_draft", {}).get(section, ""), number, section):
+        raise ValueError(f"'{section}' 섹션에 '{subsection_title(section, number)}' 소절 제목이 없어 소절 단위로 작업할 수 없습니다.")
+    with metrics.trace("subsection", job=job.id, model=model, mode=mode) as trace:
+        job.set_stage("prompting")
+        with metrics.span("prompt"):
+            request = plan_subsection_request(
+                inputs["topic"], inputs["purpose"], inputs["hypothesis"], context, result, section, number, mode,
+                add_paras, base_paras, min_chars_per_para, inputs["tone_setting"], model, source_map,
+            )
+        job.set_stage("generating")
+        usage, errors = {}, {}
+        with metrics.span("generate"):
+            deltas = call_openai_json_many(
+                api_key, model, [request[2]], temperature=0.50, max_concurrency=1, usage=usage,
+                use_cache=use_cache, session=session, accept=lambda i, delta: is_complete(request, delta),
+                errors=errors, job=job,
+            )
+            deltas = retry_incomplete(
+                api_key, model, [request], deltas, is_complete, 0.50, 1, usage, lambda i, delta: None,
+                session, use_cache, errors=errors, job=job,
+            )
+            raise_if_all_failed(errors, 1)
+        job.set_stage("merging")
+        with metrics.span("merge"):
+            merged = merge_subsection(result, request, deltas[0], mode)
+        warnings = [] if is_complete(request, deltas[0]) else [
+            f"모델 응답 오류로 '{subsection_title(section, number)}' 소절을 작성하지 못했습니다."
+        ]
+        with metrics.span("sources"):
+            merged = resolve_sources(merged, context)
+        report = token_report("subsection", TokenCounter(model), [request[2]], usage)
+        trace.attrs.update(prompt_tokens_local=report["prompt_tokens_local"])
+        version = save_project(
+            project_id, merged, expansion_level, report, session, warnings
+        ) if project_id else None
+    return {
+        "state": {
+            "result": merged,
+            "token_report": report,
+            "last_trace": trace.to_dict(),
+            "project_version": version,
+        },
+        "warnings": warnings,
+    }
@@ -0,0 +1,235 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from cache import DEFAULT_CACHE_DIR, content_hash
+from jobs import get_job_runner
+
+# =========================================================
+# Project store (SQLite)
+# - One row per project (inputs, title, latest version) and one per result
+#   version: generation is version 0, every expansion adds one. Results and
+#   context text are stored zlib-compressed; a context is stored once by hash
+#   and shared by all projects built from the same pages.
+# - Jobs save as they finish, so a draft outlives the browser session, "새
+#   프로젝트 시작" and server restarts; reopening one is a local read.
+# - Each project keeps its KEEP_VERSIONS newest versions; compact() also
+#   drops contexts no project uses any more. It runs once per process as a
+#   background job, and only VACUUMs once free pages reach VACUUM_FREE_RATIO.
+# =========================================================
+PROJECTS_PATH = os.environ.get("REPORT_MATE_PROJECTS_DB", os.path.join(DEFAULT_CACHE_DIR, "projects.sqlite3"))
+KEEP_VERSIONS = int(os.environ.get("REPORT_MATE_PROJECT_VERSIONS", "5"))
+VACUUM_FREE_RATIO = float(os.environ.get("REPORT_MATE_PROJECTS_VACUUM_RATIO", "0.25"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id TEXT PRIMARY KEY,
+    session TEXT NOT NULL,
+    title TEXT NOT NULL,
+    inputs TEXT NOT NULL,
+    context_digest TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    latest_version INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS projects_by_session ON projects (session, updated DESC);
+CREATE INDEX IF NOT EXISTS projects_by_updated ON projects (updated DESC);
+CREATE TABLE IF NOT EXISTS contexts (
+    digest TEXT PRIMARY KEY,
+    chars INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS versions (
+    project_id TEXT NOT NULL REFERENCES projects (id) ON DELETE CASCADE,
+    version INTEGER NOT NULL,
+    expansion_level INTEGER NOT NULL,
+    created REAL NOT NULL,
+    result BLOB NOT NULL,
+    token_report TEXT,
+    PRIMARY KEY (project_id, version)
+) WITHOUT ROWID;
+"""
+
+
+def _pack(text):
+    return zlib.compress(text.encode("utf-8"), 6)
+
+
+def _unpack(blob):
+    return zlib.decompress(blob).decode("utf-8")
+
+
+class ProjectStore:
+    """Thread-safe SQLite store of projects and their result versions."""
+
+    def __init__(self, path=PROJECTS_PATH, keep_versions=KEEP_VERSIONS):
+        self.path = path
+        self.keep_versions = keep_versions
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(_SCHEMA)
+
+    # ---------- writes ----------
+    def save(
+        self, project_id, result, expansion_level=0, token_report=None, session="default", inputs=None, context=None
+    ):
+        """Add a result version and return its number.
+
+        The first save of a project needs inputs and context; later ones (expansions)
+        only add a version and keep the project's inputs and context.
+        """
+        now = time.time()
+        result_blob = _pack(json.dumps(result, ensure_ascii=False))
+        report = json.dumps(token_report, ensure_ascii=False) if token_report is not None else None
+        digest = content_hash(context.encode("utf-8")) if context is not None else None
+        context_blob = _pack(context) if context is not None else None
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            row = self._db.execute("SELECT latest_version FROM projects WHERE id = ?", (project_id,)).fetchone()
+            if digest is not None:
+                self._db.execute(
+                    "INSERT OR IGNORE INTO contexts (digest, chars, data) VALUES (?, ?, ?)",
+                    (digest, len(context), context_blob),
+                )
+            if row is None:
+                inputs = inputs or {}
+                version = 0
+                self._db.execute(
+                    "INSERT INTO projects (id, session, title, inputs, context_digest, created, updated, latest_version)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        project_id, session, inputs.get("topic") or "제목 없음",
+                        json.dumps(inputs, ensure_ascii=False), digest, now, now, version,
+                    ),
+                )
+            else:
+                version = row[0] + 1
+                self._db.execute(
+                    "UPDATE projects SET updated = ?, latest_version = ? WHERE id = ?", (now, version, project_id)
+                )
+            self._db.execute(
+                "INSERT INTO versions (project_id, version, expansion_level, created, result, token_report)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (project_id, version, expansion_level, now, result_blob, report),
+            )
+            self._db.execute(
+                "DELETE FROM versions WHERE project_id = ? AND version <= ?", (project_id, version - self.keep_versions)
+            )
+        return version
+
+    def delete(self, project_id):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM projects WHERE id = ?", (project_id,))
+
+    def compact(self, keep_versions=None):
+        """Trim every project to its newest versions and drop unused contexts; returns rows removed.
+
+        The file is rewritten (VACUUM) only when free pages make up VACUUM_FREE_RATIO of it.
+        """
+        keep = self.keep_versions if keep_versions is None else keep_versions
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            versions = self._db.execute(
+                "DELETE FROM versions WHERE version <= "
+                "(SELECT latest_version FROM projects WHERE projects.id = versions.project_id) - ?",
+                (keep,),
+            ).rowcount
+            contexts = self._db.execute(
+                "DELETE FROM contexts WHERE digest NOT IN "
+                "(SELECT context_digest FROM projects WHERE context_digest IS NOT NULL)"
+            ).rowcount
+        with self._lock:
+            free, = self._db.execute("PRAGMA freelist_count").fetchone()
+            pages, = self._db.execute("PRAGMA page_count").fetchone()
+            vacuumed = bool(pages) and free / pages >= VACUUM_FREE_RATIO
+            if vacuumed:
+                self._db.execute("VACUUM")
+        return {"versions": versions, "contexts": contexts, "vacuumed": vacuumed}
+
+    # ---------- reads ----------
+    def load(self, project_id, version=None):
+        """The project's inputs, context text and one result version (the latest by default); None if unknown."""
+        with self._lock:
+            project = self._db.execute(
+                "SELECT p.inputs, p.latest_version, c.data FROM projects p"
+                " LEFT JOIN contexts c ON c.digest = p.context_digest WHERE p.id = ?",
+                (project_id,),
+            ).fetchone()
+            if project is None:
+                return None
+            if version is None:
+                version = project[1]
+            row = self._db.execute(
+                "SELECT expansion_level, result, token_report FROM versions WHERE project_id = ? AND version = ?",
+                (project_id, version),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "project_id": project_id,
+            "version": version,
+            "inputs": json.loads(project[0]),
+            "context": _unpack(project[2]) if project[2] is not None else "",
+            "result": json.loads(_unpack(row[1])),
+            "expansion_level": row[0],
+            "token_report": json.loads(row[2]) if row[2] is not None else None,
+        }
+
+    def versions(self, project_id):
+        """[(version, expansion_level, created), ...], newest first."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT version, expansion_level, created FROM versions WHERE project_id = ? ORDER BY version DESC",
+                (project_id,),
+            ).fetchall()
+
+    def list(self, session=None, limit=20):
+        """Recent projects, newest first: [{"id", "title", "updated", "latest_version"}, ...]."""
+        query = "SELECT id, title, updated, latest_version FROM projects"
+        args = ()
+        if session is not None:
+            query += " WHERE session = ?"
+            args = (session,)
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY updated DESC LIMIT ?", args + (limit,)).fetchall()
+        return [{"id": r[0], "title": r[1], "updated": r[2], "latest_version": r[3]} for r in rows]
+
+    def stats(self):
+        with self._lock:
+            projects, = self._db.execute("SELECT COUNT(*) FROM projects").fetchone()
+            versions, = self._db.execute("SELECT COUNT(*) FROM versions").fetchone()
+            contexts, chars, stored = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(chars), 0), COALESCE(SUM(LENGTH(data)), 0) FROM contexts"
+            ).fetchone()
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        return {
+            "projects": projects, "versions": versions, "contexts": contexts,
+            "context_chars": chars, "context_bytes": stored, "file_bytes": size,
+        }
+
+
+_project_store = None
+_project_store_lock = threading.Lock()
+
+
+def get_project_store():
+    global _project_store
+    with _project_store_lock:
+        if _project_store is None:
+            _project_store = ProjectStore()
+            get_job_runner().submit("maintenance", "compact", _compact, _project_store)
+        return _project_store
+
+
+def _compact(job, store):
+    return store.compact()
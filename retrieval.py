@@ -0,0 +1,232 @@
+import math
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+
+from budget import CharCounter
+from cache import content_hash
+from extraction import PageChunk, extract_files, fit_page_chunk
+
+# =========================================================
+# Local page-level retrieval (BM25)
+# - Runs fully in-process; no embeddings or external services.
+# - Korean has no whitespace-delimited morphology we can rely on offline, so
+#   Hangul runs are indexed as character bigrams; Latin text as lowercase words.
+# =========================================================
+_LATIN = re.compile(r"[a-z0-9]+")
+_HANGUL = re.compile(r"[가-힣]+")
+
+
+def tokenize(text):
+    text = text.lower()
+    tokens = [t for t in _LATIN.findall(text) if len(t) > 1]
+    for run in _HANGUL.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """BM25 over extracted pages. docs is [(file_index, name, page_no, content), ...].
+
+    term_counts, if given, holds a precomputed Counter(tokenize(content)) per doc;
+    compaction maps content digests to (characters before compaction, after, pages dropped).
+    """
+
+    def __init__(self, docs, k1=1.5, b=0.75, errors=None, term_counts=None, compaction=None):
+        self.docs = docs
+        self.errors = list(errors or [])
+        self.compaction = dict(compaction or {})
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.lengths = []
+        for i, (_, _, _, content) in enumerate(docs):
+            tf = term_counts[i] if term_counts is not None else Counter(tokenize(content))
+            self.lengths.append(sum(tf.values()))
+            for term, count in tf.items():
+                self.postings[term].append((i, count))
+        n = len(docs)
+        self.avgdl = (sum(self.lengths) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            for term, plist in self.postings.items()
+        }
+
+    def score(self, query):
+        scores = defaultdict(float)
+        if not self.avgdl:
+            return scores
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self.postings[term]:
+                norm = tf + self.k1 * (1 - self.b + self.b * self.lengths[i] / self.avgdl)
+                scores[i] += idf * tf * (self.k1 + 1) / norm
+        return scores
+
+    def rank(self, queries):
+        """Merge per-query rankings round-robin so every query gets its best pages in early."""
+        rankings = []
+        for q in queries:
+            scores = self.score(q)
+            rankings.append(sorted((i for i, s in scores.items() if s > 0), key=lambda i: (-scores[i], i)))
+
+        order, seen = [], set()
+        for depth in range(max((len(r) for r in rankings), default=0)):
+            for ranking in rankings:
+                if depth < len(ranking) and ranking[depth] not in seen:
+                    seen.add(ranking[depth])
+                    order.append(ranking[depth])
+        return order
+
+    def select(self, queries, budget, counter=None):
+        """Return PageChunks for the most relevant pages that fit budget, in [SOURCE, PAGE] order.
+
+        Falls back to document order when no page matches any query.
+        """
+        counter = counter or CharCounter()
+        order = self.rank(queries) or list(range(len(self.docs)))
+        chunks, used = [], 0
+        for i in order:
+            file_index, name, page_no, content = self.docs[i]
+            chunk, size = fit_page_chunk(name, page_no, content, budget - used, counter)
+            if chunk is None:
+                break
+            chunks.append(PageChunk(file_index, name, page_no, chunk))
+            used += size
+            if used >= budget:
+                break
+        return sorted(chunks, key=lambda c: (c.file_index, c.page_no))
+
+
+# =========================================================
+# Index cache (per document set, assembled from per-file entries)
+# - Each file's pages and term counts are cached by content hash, so adding or
+#   removing one upload only extracts and tokenizes that file; the set index
+#   is then rebuilt from cached counts.
+# - Files are built single-flight: a request for a file another thread is
+#   already extracting (e.g. an upload prefetch) waits for it instead.
+# =========================================================
+INDEX_CACHE_SIZE = 16
+FILE_CACHE_SIZE = 32
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+_files = OrderedDict()  # (digest, max_pages) -> ([(page_no, content, Counter), ...], compaction stats)
+_building = {}  # (digest, max_pages) -> Lock held while that file is extracted
+_files_lock = threading.Lock()
+
+
+def _cached_files(keys):
+    with _files_lock:
+        found = {key: _files[key] for key in keys if key in _files}
+        for key in found:
+            _files.move_to_end(key)
+    return found
+
+
+def load_file_pages(items, max_pages, workers=None):
+    """[(entry, error), ...] per (name, data) item.
+
+    entry is ([(page_no, content, term counts), ...], (characters before compaction, after, pages dropped)).
+    """
+    keys = [(content_hash(data), max_pages) for _, data in items]
+    found = _cached_files(keys)
+    missing = sorted({key for key in keys if key not in found})
+    errors = {}
+    if missing:
+        with _files_lock:
+            locks = [_building.setdefault(key, threading.Lock()) for key in missing]
+        for lock in locks:
+            lock.acquire()
+        try:
+            found.update(_cached_files(missing))
+            todo = [(key, item) for key, item in zip(keys, items) if key not in found]
+            todo = list(dict(todo).items())
+            compaction = {}
+            extracted = extract_files(
+                [item for _, item in todo], max_pages, workers=workers, compaction=compaction
+            ) if todo else []
+            for (key, _), (_, pages, error) in zip(todo, extracted):
+                if error:
+                    errors[key] = error  # not cached: it may be transient
+                    continue
+                found[key] = (
+                    [(page_no, content, Counter(tokenize(content))) for page_no, content in pages if content],
+                    tuple(compaction.get(key[0], (0, 0, 0))),
+                )
+            with _files_lock:
+                for key in missing:
+                    if key in found:
+                        _files[key] = found[key]
+                    _building.pop(key, None)
+                while len(_files) > FILE_CACHE_SIZE:
+                    _files.popitem(last=False)
+        finally:
+            for lock in locks:
+                lock.release()
+    return [(found.get(key), errors.get(key)) for key in keys]
+
+
+def get_page_index(items, max_pages, workers=None):
+    """Build (or reuse) the BM25 index for a set of (name, data) uploads."""
+    key = (max_pages, tuple((name, content_hash(data)) for name, data in items))
+    with _indexes_lock:
+        if key in _indexes:
+            _indexes.move_to_end(key)
+            return _indexes[key]
+
+    docs, term_counts, errors, compaction = [], [], [], {}
+    files = zip(key[1], load_file_pages(items, max_pages, workers))
+    for file_index, ((name, digest), (entry, error)) in enumerate(files):
+        if error:
+            errors.append((name, error))
+            continue
+        pages, compaction[digest] = entry
+        for page_no, content, tf in pages:
+            docs.append((file_index, name, page_no, content))
+            term_counts.append(tf)
+    index = BM25Index(docs, errors=errors, term_counts=term_counts, compaction=compaction)
+
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+_CHUNK_MARKER = re.compile(r"\n\[SOURCE: (.+?), PAGE: (\d+)\]\n")
+
+
+def parse_context_chunks(context_text):
+    """Recover [(file_index, name, page_no, content), ...] from a combined [SOURCE, PAGE] context."""
+    docs, file_indexes = [], {}
+    parts = _CHUNK_MARKER.split(context_text)
+    for i in range(1, len(parts) - 2, 3):
+        name, page_no, content = parts[i], int(parts[i + 1]), parts[i + 2]
+        if content.endswith("\n"):
+            content = content[:-1]
+        file_index = file_indexes.setdefault(name, len(file_indexes))
+        if content.strip():
+            docs.append((file_index, name, page_no, content))
+    return docs
+
+
+def get_context_index(context_text):
+    """BM25 index over the pages already selected into a session's context_text."""
+    key = ("context", content_hash(context_text.encode("utf-8")))
+    with _indexes_lock:
+        if key in _indexes:
+            _indexes.move_to_end(key)
+            return _indexes[key]
+    index = BM25Index(parse_context_chunks(context_text))
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
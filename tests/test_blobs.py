@@ -0,0 +1,55 @@
+import gc
+import io
+import os
+
+import pytest
+
+import blobs
+
+
+@pytest.fixture
+def spill_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(blobs, "SPILL_DIR", str(tmp_path))
+    monkeypatch.setattr(blobs, "SPILL_MIN_BYTES", 0)
+    monkeypatch.setattr(blobs, "SPILL_TTL_SECONDS", 60)
+    return tmp_path
+
+
+def upload(data, name="paper.pdf"):
+    upload = io.BytesIO(data)
+    upload.name = name
+    return upload
+
+
+def age(path, seconds=3600):
+    old = os.path.getmtime(path) - seconds
+    os.utime(path, (old, old))
+
+
+def test_prune_keeps_spills_still_referenced(spill_dir):
+    _, mapped = blobs.spill_upload(upload(b"%PDF-1.4 kept"))
+    age(mapped.path)
+    blobs._prune_spills()
+    assert os.path.exists(mapped.path)
+
+    path = mapped.path
+    del mapped
+    gc.collect()
+    blobs._prune_spills()
+    assert not os.path.exists(path)
+
+
+def test_open_refreshes_mtime(spill_dir):
+    _, mapped = blobs.spill_upload(upload(b"%PDF-1.4 touched"))
+    age(mapped.path)
+    with mapped.open() as stream:
+        assert stream.read(4) == b"%PDF"
+    assert os.path.getmtime(mapped.path) > blobs.time.time() - 60
+
+
+def test_missing_spill_asks_for_upload_again(spill_dir):
+    _, mapped = blobs.spill_upload(upload(b"%PDF-1.4 gone"))
+    os.remove(mapped.path)
+    assert not blobs.spill_exists(mapped)
+    with pytest.raises(blobs.SpillMissing, match="다시 업로드"):
+        mapped.open()
@@ -0,0 +1,16 @@
+from cache import ResponseCache, TieredCache
+
+
+def test_expired_response_is_removed_from_both_tiers(tmp_path, monkeypatch):
+    store = TieredCache(str(tmp_path), max_memory_bytes=1024, max_disk_bytes=1024)
+    cache = ResponseCache(store, ttl_seconds=60)
+    cache.put("k", "content")
+    assert cache.get("k") == "content"
+
+    monkeypatch.setattr("cache.time.time", lambda: 1e12)
+    assert cache.get("k") is None
+    assert cache.stats["expired"] == 1
+    assert "k" not in store._mem and not list(store._iter_disk_files())
+
+    assert cache.get("k") is None
+    assert cache.stats == {"hits": 1, "misses": 1, "expired": 1}
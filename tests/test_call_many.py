@@ -0,0 +1,95 @@
+import asyncio
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import llm_client
+import pipeline
+from jobs import Job, JobCancelled
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    """Replies {"ok": <prompt>} to every request, except that prompts containing FAIL raise."""
+    calls = []
+
+    async def create(api_key, session, estimated_tokens, kwargs):
+        prompt = kwargs["messages"][-1]["content"]
+        calls.append(prompt)
+        if "FAIL" in prompt:
+            raise ValueError(f"rejected: {prompt}")
+        message = SimpleNamespace(content=json.dumps({"ok": prompt}))
+        return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=message)])
+
+    monkeypatch.setattr(llm_client, "_create_async", create)
+    return calls
+
+
+def test_one_failed_request_does_not_fail_the_batch(fake_api):
+    usage, errors, seen = {}, {}, {}
+    results = pipeline.call_openai_json_many(
+        "sk", "gpt-4o-mini", [("s", "a"), ("s", "FAIL b"), ("s", "c")], usage=usage, use_cache=False,
+        on_result=seen.__setitem__, errors=errors,
+    )
+    assert results == [{"ok": "a"}, {}, {"ok": "c"}]
+    assert list(errors) == [1] and isinstance(errors[1], ValueError)
+    assert usage["failed_requests"] == 1 and seen[1] == {}
+
+
+def test_failed_request_is_retried_and_reported_as_incomplete(fake_api):
+    requests = [(None, None, ("s", "a")), (None, None, ("s", "FAIL b"))]
+    errors = {}
+    results = pipeline.call_openai_json_many(
+        "sk", "gpt-4o-mini", [prompt for _, _, prompt in requests], use_cache=False, errors=errors,
+    )
+    results = pipeline.retry_incomplete(
+        "sk", "gpt-4o-mini", requests, results, lambda request, result: bool(result), 0.45, 2, {},
+        lambda i, result: None, "s", use_cache=False, errors=errors,
+    )
+    assert results == [{"ok": "a"}, {}]
+    assert fake_api.count("FAIL b") == 2
+    pipeline.raise_if_all_failed(errors, len(requests))
+
+
+def test_all_failed_requests_raise(fake_api):
+    errors = {}
+    pipeline.call_openai_json_many("sk", "gpt-4o-mini", [("s", "FAIL a"), ("s", "FAIL b")], use_cache=False, errors=errors)
+    with pytest.raises(ValueError, match="FAIL a"):
+        pipeline.raise_if_all_failed(errors, 2)
+
+
+def test_without_errors_a_failure_still_raises(fake_api):
+    with pytest.raises(ValueError):
+        pipeline.call_openai_json_many("sk", "gpt-4o-mini", [("s", "FAIL a"), ("s", "b")], use_cache=False)
+
+
+@pytest.mark.parametrize("many", [True, False])
+def test_cancelling_the_job_aborts_requests_in_flight(monkeypatch, many):
+    aborted = []
+
+    async def create(api_key, session, estimated_tokens, kwargs):
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            aborted.append(kwargs["messages"][-1]["content"])
+            raise
+
+    monkeypatch.setattr(llm_client, "_create_async", create)
+    job = Job("s", "generate")
+    threading.Timer(0.1, job.cancel).start()
+    started = time.monotonic()
+    with pytest.raises(JobCancelled):
+        if many:
+            pipeline.call_openai_json_many(
+                "sk", "gpt-4o-mini", [("s", "a"), ("s", "b")], use_cache=False, errors={}, job=job
+            )
+        else:
+            pipeline.call_openai_json("sk", "gpt-4o-mini", "s", "a", use_cache=False, job=job)
+    assert time.monotonic() - started < 2
+    deadline = time.monotonic() + 2
+    while len(aborted) < (2 if many else 1) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sorted(aborted) == (["a", "b"] if many else ["a"])
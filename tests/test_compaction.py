@@ -0,0 +1,24 @@
+from benchmarks.synthetic_pdf import make_pdf
+from cache import content_hash
+from compaction import join_hyphen_breaks
+from extraction import extract_files
+
+
+def test_line_break_hyphenation_is_joined():
+    assert join_hyphen_breaks("the hyphen-\nation rule") == "the hyphenation rule"
+    assert join_hyphen_breaks("a long-\ner run") == "a longer run"
+
+
+def test_compounds_keep_their_hyphen():
+    assert join_hyphen_breaks("self-\nefficacy and long-\nterm effects") == "self-efficacy and long-term effects"
+    assert join_hyphen_breaks("decision-\nmaking; decision-making") == "decision-making; decision-making"
+    assert join_hyphen_breaks("a co-\nhort study of the cohort") == "a cohort study of the cohort"
+
+
+def test_compaction_stats_of_uploads_with_the_same_name_are_kept_apart():
+    short = make_pdf(["Short page.\n" * 2])
+    long = make_pdf(["A much longer page with more text.\n" * 20])
+    compaction = {}
+    extract_files([("paper.pdf", short), ("paper.pdf", long)], 1, workers=1, compaction=compaction)
+    assert set(compaction) == {content_hash(short), content_hash(long)}
+    assert compaction[content_hash(short)][0] < compaction[content_hash(long)][0]
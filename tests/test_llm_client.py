@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+import pytest
+
+import llm_client
+import pipeline
+from jobs import Job, JobCancelled
+
+
+class FakeStream:
+    """Stands in for openai.Stream: yields content chunks and records close()."""
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.closed = False
+
+    def __iter__(self):
+        for part in self.parts:
+            delta = SimpleNamespace(content=part)
+            yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=delta)])
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_stream(monkeypatch):
+    stream = FakeStream(['{"interactive_draft": {"서론": "첫 문단"', ', "결론": "끝"}}'])
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: stream)))
+    monkeypatch.setattr(llm_client, "get_client", lambda api_key: client)
+    monkeypatch.setattr(llm_client, "_limiter", llm_client.RateLimiter(rpm=0, tpm=0))
+    return stream
+
+
+def test_cancelled_streaming_job_closes_response(fake_stream):
+    job = Job("s", "generate")
+    job.cancel()
+    with pytest.raises(JobCancelled):
+        pipeline.generate_json("sk", "gpt-4o-mini", "system", "user", 0.45, {}, True, job, "s", use_cache=False)
+    assert fake_stream.closed
+    assert llm_client._limiter.in_flight == 0
+
+
+def test_finished_stream_is_closed(fake_stream):
+    chunks = list(llm_client.create_chat_completion("sk", "s", model="gpt-4o-mini", stream=True))
+    assert len(chunks) == 2
+    assert fake_stream.closed
+    assert llm_client._limiter.in_flight == 0
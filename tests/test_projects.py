@@ -0,0 +1,34 @@
+import random
+
+import projects
+from projects import ProjectStore
+
+
+def test_compact_vacuums_only_when_enough_space_is_free(tmp_path):
+    store = ProjectStore(str(tmp_path / "projects.sqlite3"))
+    assert store.compact()["vacuumed"] is False
+
+    rng = random.Random(0)
+    noise = "".join(rng.choice("abcdefghij") for _ in range(200_000))
+    store.save("p1", {"interactive_draft": {}}, inputs={"topic": "t"}, context=noise)
+    store.delete("p1")
+    removed = store.compact()
+    assert removed["contexts"] == 1 and removed["vacuumed"] is True
+    assert store._db.execute("PRAGMA freelist_count").fetchone()[0] == 0
+
+
+def test_first_use_compacts_in_the_background(tmp_path, monkeypatch):
+    submitted = []
+
+    class Runner:
+        def submit(self, session, kind, fn, *args):
+            submitted.append((kind, fn, args))
+
+    monkeypatch.setattr(projects, "PROJECTS_PATH", str(tmp_path / "projects.sqlite3"))
+    monkeypatch.setattr(projects, "ProjectStore", lambda: ProjectStore(projects.PROJECTS_PATH))
+    monkeypatch.setattr(projects, "get_job_runner", lambda: Runner())
+    monkeypatch.setattr(projects, "_project_store", None)
+    store = projects.get_project_store()
+    assert [kind for kind, _, _ in submitted] == ["compact"]
+    kind, fn, args = submitted[0]
+    assert args == (store,) and fn(None, *args)["vacuumed"] is False
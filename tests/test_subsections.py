@@ -0,0 +1,46 @@
+import pytest
+
+from pipeline import append_paragraphs, has_subsection, replace_subsection, split_subsections
+
+METHODS = """3.1 연구설계
+설계 문단 [REF:a.pdf,p1].
+
+3.2 표본/자료
+표본은 다음 기준으로 골랐다.
+3.5 점 이상을 받은 응답자만 분석에 포함했다 [REF:a.pdf,p2].
+
+3.3 측정(변수/도구)
+측정 문단.
+
+3.4 분석전략
+분석 문단.
+
+3.5 타당도·윤리
+윤리 문단."""
+
+
+def test_body_line_starting_with_a_decimal_is_not_a_heading():
+    _, blocks = split_subsections(METHODS, "연구방법")
+    assert [num for num, _ in blocks] == ["3.1", "3.2", "3.3", "3.4", "3.5"]
+    assert "3.5 점 이상" in dict(blocks)["3.2"]
+
+
+def test_decimal_from_another_section_is_not_a_heading():
+    text = "1.1 연구 배경\n2.5 배 증가했다는 보고가 있다.\n\n1.2 문제 제기\n문제 문단."
+    assert [num for num, _ in split_subsections(text, "서론")[1]] == ["1.1", "1.2"]
+    assert not has_subsection(text, "2.5", "서론")
+
+
+def test_rewrite_and_expand_touch_only_their_subsection():
+    rewritten = replace_subsection(METHODS, "3.2", "3.2 표본/자료", ["새 표본 문단."], "연구방법")
+    assert "3.5 점 이상" not in rewritten
+    assert rewritten.count("3.5 타당도·윤리\n윤리 문단.") == 1
+
+    expanded = append_paragraphs(METHODS, {"3.5": ["추가 윤리 문단."]}, "연구방법")
+    assert expanded.endswith("윤리 문단.\n\n추가 윤리 문단.")
+    assert "3.5 점 이상을 받은 응답자만 분석에 포함했다 [REF:a.pdf,p2].\n\n3.3" in expanded
+
+
+def test_rewrite_without_heading_fails():
+    with pytest.raises(ValueError):
+        replace_subsection("제목 없는 본문.", "1.1", "1.1 연구 배경", ["문단"], "서론")